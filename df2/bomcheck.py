@@ -0,0 +1,148 @@
+"""Check and fix the encoding of the text files of a source tree.
+
+All text files of the Dragonfly sources must be UTF-8 with a BOM. The
+default check only reads the first bytes of each file, the strict check
+also decodes the whole file. The files are read in a thread pool, the
+results are cached by path, size and mtime, in memory and optionally in a
+file, so an unchanged tree is checked without reading any file.
+"""
+
+import os
+import json
+import codecs
+import multiprocessing.pool
+from fileinventory import FileInventory
+
+CACHE_NAME = ".df2-encodings.json"
+VERSION = 1
+
+# the number of threads, the work is mostly waiting for the disk
+THREADS = 8
+
+OK = "ok"
+NO_BOM = "no BOM"
+INVALID = "invalid UTF-8"
+
+# (path, size, mtime, strict): result, shared by all checks of a process
+_results = {}
+
+def _ignore(path):
+    return "test-scripts" in path
+
+def check_file(path, strict=False):
+    """Return OK, NO_BOM or INVALID for the file at path."""
+    with open(path, "rb") as f:
+        if strict:
+            data = f.read()
+        else:
+            data = f.read(len(codecs.BOM_UTF8))
+    if not data.startswith(codecs.BOM_UTF8):
+        return NO_BOM
+    if strict:
+        try:
+            data.decode("utf-8")
+        except UnicodeDecodeError:
+            return INVALID
+    return OK
+
+def _check(job):
+    path, strict = job
+    try:
+        return check_file(path, strict)
+    except IOError:
+        # removed since the walk
+        return OK
+
+def _load_cache(cache_path):
+    if not cache_path or not os.path.isfile(cache_path):
+        return
+    try:
+        with open(cache_path, "rb") as f:
+            data = json.load(f)
+    except ValueError:
+        return
+    if data.get("version") == VERSION:
+        for path, size, mtime, strict, result in data.get("results", []):
+            _results.setdefault((path, size, mtime, strict), result)
+
+def _save_cache(cache_path, keys):
+    if not cache_path or not os.path.isdir(os.path.dirname(cache_path)):
+        return
+    entries = set()
+    for key in keys:
+        entries.update(k for k in [key, key[:3] + (True,)] if k in _results)
+    results = [list(key) + [_results[key]] for key in sorted(entries)]
+    with open(cache_path, "wb") as f:
+        json.dump({"version": VERSION, "results": results}, f)
+
+def _cached(key):
+    if key in _results:
+        return _results[key]
+    # a file which passed the strict check also passes the other one
+    if _results.get(key[:3] + (True,)) == OK:
+        return OK
+    return None
+
+def check_tree(src, exts, strict=False, threads=THREADS, cache_path=None):
+    """Check all files below src with an extension in exts. src is a path
+    or a FileInventory. Returns a sorted list of (path, result) of the
+    files which are not OK."""
+    inventory = src if isinstance(src, FileInventory) else FileInventory(src)
+    _load_cache(cache_path)
+    keys = []
+    todo = []
+    for rel_path in inventory.paths(exts):
+        path = inventory.abspath(rel_path)
+        size, mtime = inventory.stat(rel_path)
+        if _ignore(path):
+            continue
+        key = (path, size, mtime, strict)
+        keys.append(key)
+        if not _cached(key):
+            todo.append(key)
+
+    if len(todo) > 1 and threads > 1:
+        pool = multiprocessing.pool.ThreadPool(min(threads, len(todo)))
+        try:
+            results = pool.map(_check, [(k[0], strict) for k in todo])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_check((k[0], strict)) for k in todo]
+    _results.update(zip(todo, results))
+
+    _save_cache(cache_path, keys)
+    bad = []
+    for key in keys:
+        result = _cached(key)
+        if result != OK:
+            bad.append((key[0], result))
+    return sorted(bad)
+
+def fix_file(path):
+    """Add a BOM to the file at path. The content must be valid UTF-8, a
+    file which is not is left untouched. Returns None or the error."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(codecs.BOM_UTF8):
+        return None
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError, e:
+        return e
+    with open(path, "wb") as f:
+        f.write(codecs.BOM_UTF8 + data)
+    return None
+
+def fix_files(paths, threads=THREADS):
+    """Fix all files in paths, see fix_file. Returns a list of the
+    errors, in the order of paths."""
+    if len(paths) > 1 and threads > 1:
+        pool = multiprocessing.pool.ThreadPool(min(threads, len(paths)))
+        try:
+            return pool.map(fix_file, paths)
+        finally:
+            pool.close()
+            pool.join()
+    return [fix_file(path) for path in paths]
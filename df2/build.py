@@ -5,12 +5,36 @@ import shutil
 import tempfile
 import sys
 import zipfile
+import gzip
+import zlib
 import base64
+import hashlib
+import mimetypes
 import urllib
 import subprocess
 import time
+import io
+import json
+import array
+import inspect
+import StringIO
+import multiprocessing
+import multiprocessing.pool
 from functools import partial
 from createmanifests import create_manifests
+from buildtree import BuildTree, replace_dir
+from buildmanifest import BuildManifest, MANIFEST_NAME, settings_digest, file_hash
+from buildmanifest import state_dir
+from buildstats import BuildStats
+from depgraph import DependencyGraph, BASE_URL, GRAPH_NAME
+from depgraph import evaluate as evaluate_directives, format_when
+import vcs
+import changelog
+import sourcemap
+import watch
+import bomcheck
+from fileinventory import FileInventory
+from minifycache import MinifyCache, minifier_identity
 
 """
 uglifyjs is a python wrapper for uglifyjs.
@@ -32,274 +56,139 @@ except ImportError:
     print "failed to import uglifyjs"
     import jsminify
 
+# only a minifier which reports the positions of the tokens keeps the
+# source maps of the bundles
+_minify_maps = hasattr(jsminify, "minify_str") and \
+    "mappings" in inspect.getargspec(jsminify.minify_str)[0]
+# the same for the renaming of the local names, the "mangle" setting
+_minify_mangle = hasattr(jsminify, "minify_str") and \
+    "mangle" in inspect.getargspec(jsminify.minify_str)[0]
+
 
 _text_exts = (".js", ".html", ".xml", ".css")
 _directive_exts = (".xml", ".html", ".xhtml") # files that may have <!-- command.. directives
 _keyword_exts = (".css", ".js", ".xml", ".html", ".xhtml", ".txt") # files we will try to do keyword interpolation on
 _license_exts = (".js", ".css") # extensions that should get a license
 _img_exts = (".png", ".jpg", ".gif")
-_script_ele = u"<script src=\"%s\"/>\n"
-_style_ele = u"<link rel=\"stylesheet\" href=\"%s\"/>\n"
-_base_url = u"<base href=\"%s\" />\n"
-_re_command = re.compile("""\s?<!--\s+command\s+(?P<command>\w+)\s+"?(?P<target>.*?)"?\s*(?:if\s+(?P<neg>not)?\s*(?P<cond>\S+?))?\s*-->""")
-_re_comment = re.compile("""\s*<!--.*-->\s*""")
-_re_script = re.compile("\s?<script +src=\"(?P<src>[^\"]*)\"")
-_re_css = re.compile("\s?<link +rel=\"stylesheet\" +href=\"(?P<href>[^\"]*)\"/>")
+_gzip_exts = (".js", ".css", ".xml", ".html", ".xhtml", ".svg", ".manifest", ".txt") # served as text
+_stored_exts = (".png", ".jpg", ".jpeg", ".gif", ".zip", ".gz") # already compressed
+_mime_types = {".png": "image/png",
+               ".jpg": "image/jpeg",
+               ".jpeg": "image/jpeg",
+               ".gif": "image/gif",
+               ".svg": "image/svg+xml",
+               ".ico": "image/x-icon"}
 _re_condition = re.compile("\s+if\s+(not)? (.*)")
 _re_client_lang_file = re.compile("^client-([a-zA-Z\-]{2,5})\.xml$")
+_re_img_url = re.compile(r"""url\((['"]?(.*?)['"]?)\)""")
 _re_linked_source = re.compile(r"(?:src|href)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
 _re_strict = re.compile(r"(\"|')use strict\1;?\s*")
 _re_branch = re.compile("# On branch\s*(.*)")
 _re_short_hash = re.compile(r"([0-9-a-z]{12})", re.I)
-_re_bts_dfl = re.compile(r"DFL-\d*")
-LOG_BODY = """<!doctype html>
-<title>%s</title>
-<meta charset=utf-8>
-<style>
-html, body
-{
-    font: menu;
-    padding: 0;
-    margin: 0;
-}
-h2
-{
-    padding: 0 10px;
-    font-weight: normal;
-}
-table
-{
-    border-collapse: collapse;
-    width: 100%%;
-}
-td
-{
-    padding: 2px 10px;
-    border: 1px solid hsl(0, 0%%, 90%%);
-    border-width: 1px 0;
-    vertical-align: text-top;
-}
-td:first-child
-{
-    white-space: pre;
-}
-a
-{
-    text-decoration: none;
-    font-family: monospace;
-    color: #05F;
-}
-a:hover
-{
-   text-decoration: underline;
-}
-.right-aligned
-{
-    float: right;
-}
-</style>
-<h2>%s</h2>
-<table>%s</table>"""
-
-LOG_H2 = """%s <span class="right-aligned">%s</span> """
-LOG_A = """<a href="%s">%s</a>"""
-
-# LOG_LINE % (author, url_commit, hash, summary, date)
-LOG_LINE = """<tr>
-    <td>%s</td>
-    <td><a href="%s">%s</a></td>
-    <td>%s</td>
-    <td>%s</td>
-</tr>
-"""
 
-GIT_COMMANDS = {"update": lambda *a: ["git", "checkout", a[0]],
-                "get_hash": lambda *a: ["git", "rev-parse", "--short=12", a[0]],
-                "log": lambda *a: ["git", "log",
-                                   "--format=\"c:%H%na:%an<%ae>%nd:%ad%ns:%s%n\"",
-                                   "--date=short",
-                                   "--no-merges", "%s..%s" % (a[0], a[1])]}
-
-HG_COMMANDS = {"update": lambda *a: ["hg", "up", a[0]],
-               "get_hash": lambda *a: ["hg", "log", "-r", a[0],
-                                       "--template", "{rev}:{node|short}"],
-               "log": lambda *a: ["hg", "log", "-r", "%s:%s" % (a[1], a[0]),
-                                  "--style", "changelog"]}
-
-class LogEntry(object):
-
-    def __init__(self):
-        self.hash = ""
-        self.shorthash = ""
-        self.author = ""
-        self.author_email = ""
-        self.date = ""
-        self.subject = ""
-
-    def update(self, line):
-        # c:ae004cc9a5d4b7068238e2ecb0659b5815742609
-        # a:Chris K<chrisk@opera.com>
-        # d:2012-06-27
-        # s:Fix for DFL-3263, Weird styling when starting profiler when REPL overlay is on.
-        #
-        if line.startswith("c:"):
-            self.hash = line[2:]
-            self.shorthash = self.hash[0:12]
-        elif line.startswith("a:"):
-            author = line[2:]
-            email = ""
-            if "<" in author:
-                author, email = author.split("<", 1)
-                email = email.strip(">")
-            self.author = author
-            self.email = email
-        elif "d:" in line:
-            self.date = line[2:]
-        elif "s" in line:
-            self.subject = line[2:]
-        else:
-            print "Invalid log format", line
-
-def _remove_strict(content):
-  return _re_strict.sub("", content, count=1)
+def _call(job):
+    fn, args = job
+    return fn(*args)
+
+# CPU time spent in the workers of the process pools, see buildstats
+_worker_cpu_time = [0.0]
+
+def _call_timed(job):
+    start = os.times()
+    ret = _call(job)
+    end = os.times()
+    return ret, end[0] - start[0] + end[1] - start[1]
+
+def _map(pool, fn, arg_lists):
+    """Return [fn(*args) for args in arg_lists]. If pool is set, the calls
+    are done in the worker processes of the pool. The results are always in
+    the order of arg_lists, so the build output does not depend on the
+    number of jobs."""
+    if pool:
+        results = pool.map(_call_timed, [(fn, args) for args in arg_lists], chunksize=1)
+        _worker_cpu_time[0] += sum(cpu for ret, cpu in results)
+        return [ret for ret, cpu in results]
+    return [fn(*args) for args in arg_lists]
 
 _concatcomment =u"""
 /* dfbuild: concatenated from: %s */
 """
 
-def _process_directive_files(dirpath, vars):
-    for base, dirs, files in os.walk(dirpath, topdown=True):
-        for file in [ os.path.join(dirpath, base, f) for f in files if f.endswith(_directive_exts) ]:
-            _process_directives(dirpath, file, vars)
+def _process_directive_files(tree, vars, graph=None):
+    """Process the directives in all directive files of the tree. graph
+    is the DependencyGraph of the last build, files which did not change
+    since then are not parsed again."""
+    graph = graph or DependencyGraph()
+    consumed = set()
+    for path in tree.paths(_directive_exts):
+        consumed.update(_process_directives(tree, path, vars, graph))
+    for path in consumed:
+        if path in tree:
+            tree.remove(path)
 
 
-def _process_directives(root, filepath, vars):
+def _process_directives(tree, filepath, vars, graph):
     """
-    Process all directives in the file filepath. The root dir is in root
-
-    TODO: Refactor this to use separate functions for each directive and
-    just pass in a context for it to keep stuff in.
+    Process all directives in the file filepath of the build tree. Returns
+    the paths of the files which got concatenated.
     """
-    file = open(filepath)
-
-    tmpfd, tmppath = tempfile.mkstemp(".tmp", "dfbuild.")
-    tmpfile = os.fdopen(tmpfd, "w")
-
-    known_files = {}
-    current_css_file = None
-    current_js_file = None
-    for line in file:
-        match_cmd = _re_command.search(line)
-        match_css = _re_css.search(line)
-        match_js = _re_script.search(line)
-        match_comment = _re_comment.search(line)
-
-
-        if match_cmd:
-            cmd, target, neg, cond = match_cmd.groups()
-            if cond: # check if this directive is conditional
-                c = bool(cond in vars and vars[cond])
-                if neg:
-                    c = not c
-
-                if not c: # the condition was not met, skip rule
-                    continue
-
-            # at this point the rule will be honoured
-            if cmd == "concat_css":
-                if target in ["off", "false", "no"]:
-                    current_css_file = None
-                elif target in known_files:
-                    current_css_file = target
-                else:
-                    known_files[target] = []
-                    current_css_file = target
-                    tmpfile.write(_style_ele % target)
-                continue
-            elif cmd == "concat_js":
-                if target in ["off", "false", "no"]:
-                    current_js_file = None
-                elif target in known_files:
-                    current_js_file = target
-                else:
-                    known_files[target] = []
-                    current_js_file = target
-                    tmpfile.write(_script_ele % target)
-                continue
-            elif cmd == "set_rel_base_url" and \
-               vars.has_key("base_url") and vars["base_url"]:
-                tmpfile.write(_base_url % vars["base_url"])
-                continue
-            else: # some other unknown command! Let fall through so line is written
-                pass
-        elif match_comment:
-            continue
-        elif match_css:
-            if current_css_file:
-                known_files[current_css_file].append(match_css.group("href"))
-                continue
-        elif match_js:
-            if current_js_file:
-                known_files[current_js_file].append(match_js.group("src"))
-                #fixme: The following continue should have been on the same level as this comment. However, that causes lang files to be included. must fix
-            continue
-        elif line.isspace():
-            continue
-
-        tmpfile.write(line)
-
-    tmpfile.close()
-
-    # write back the temp stuff, which is now the authoritative stuff:
-
-    shutil.copy(tmppath, filepath)
-    os.unlink(tmppath)
-
-    for outfile, contentfiles in known_files.items():
-        outpath = os.path.join(root, outfile)
-        outdir = os.path.dirname(outpath)
-
-        if not os.path.isdir(outdir):
-            os.makedirs(outdir)
-
-        fout_path = os.path.join(root, outfile)
-        fout = codecs.open(fout_path, "w", encoding="utf_8_sig")
+    f = tree.get_file(filepath)
+    items = graph.items(filepath, f.src_path,
+                        lambda: io.StringIO(tree.get_text(filepath)),
+                        tree.stat_source(f.src_path))
+    out, bundles = evaluate_directives(items, vars)
+    tree.set_text(filepath, u"".join(out))
+
+    consumed = []
+    for outfile, sources in bundles:
+        contentfiles = [infile for index, infile in sources]
+        content = []
+        line_map = sourcemap.LineMap()
         for infile in contentfiles:
-            fout.write(_concatcomment % infile)
-            fin = codecs.open(os.path.join(root, infile), "r", encoding="utf_8_sig")
-            fout.write(_remove_strict(fin.read()))
-            fin.close()
-            os.unlink(os.path.join(root, infile))
-        fout.close()
-
-def _clean_dir(root, exclude_dirs, exclude_files):
+            content.append(_concatcomment % infile)
+            line_map.add(content[-1])
+            content.append(_concat_file(tree, infile, line_map))
+            consumed.append(infile)
+        tree.set_text(outfile, u"".join(content))
+        tree.derive(outfile, contentfiles)
+        tree.get_file(outfile).line_map = line_map
+    return consumed
+
+def _concat_file(tree, path, line_map):
+    """Return the content of the file at path for a bundle, without the
+    first "use strict", and add its runs to the LineMap of the bundle."""
+    f = tree.get_file(path)
+    text = tree.get_text(path)
+    match = _re_strict.search(text)
+    if f.line_map and not match:
+        line_map.add_map(f.line_map)
+        return text
+    if not match:
+        line_map.add(text, f.src_path)
+        return text
+    line_map.add(text[:match.start()], f.src_path)
+    line_map.add(text[match.end():], f.src_path, *sourcemap.end_position(text[:match.end()]))
+    return text[:match.start()] + text[match.end():]
+
+def _clean_dir(tree, exclude_dirs, exclude_files):
     """
-    Remove anything in either of the blacklists, then remove all empty
-    directories under root and its children
+    Remove anything in either of the blacklists. Empty directories are
+    never written to the destination.
     """
-    exclude_files = [os.path.normpath(os.path.join(root, f)) for f in exclude_files ]
-    exclude_dirs = [os.path.normpath(os.path.join(root, d)) for d in exclude_dirs ]
+    for path in exclude_dirs:
+        tree.remove_dir(path)
 
-    # first pass, remove blacklisted files
-    for base, dirs, files in os.walk(root, topdown=True):
-        if base in exclude_dirs:
-            shutil.rmtree(base)
-            continue
+    for path in exclude_files:
+        if path in tree:
+            tree.remove(path)
 
-        for file in files:
-            absfile = os.path.abspath(os.path.join(base, file))
-            if absfile in exclude_files and os.path.isfile(absfile):
-                os.unlink(absfile)
 
-    # second pass, remove empty dirs
-    for base, dirs, files in os.walk(root, topdown=True):
-        if not dirs and not files:
-            os.rmdir(base)
+def _license_str(content, license):
+    return license + u"\n" + content
 
-
-def _add_license(root, license_path="include-license.txt", whitelist=[]):
+def _add_license(tree, license_path="include-license.txt", whitelist=[], pool=None):
     """
-    Read a license from license_path and append it to all files under root
+    Read a license from license_path and prepend it to all files in the tree
     whose extension is in _license_exts.
     """
     if not os.path.isfile(license_path):
@@ -309,112 +198,248 @@ def _add_license(root, license_path="include-license.txt", whitelist=[]):
     license = lfile.read()
     lfile.close()
 
-    license_files = []
-
-    for base, dirs, files in os.walk(root):
-        if whitelist:
-            bl = [d for d in dirs if not d in whitelist]
-            while bl:
-                dirs.pop(dirs.index(bl.pop()))
-
-        license_files.extend( [ os.path.join(base, f) for f in files if f.endswith(_license_exts)] )
-
-    for f in license_files:
-        source = codecs.open(f, "r", encoding="utf_8_sig")
-        tmpfd, tmppath = tempfile.mkstemp(".tmp", "dfbuild.")
-        tmpfile = os.fdopen(tmpfd, "w")
-        wrapped = codecs.getwriter("utf_8_sig")(tmpfile)
-        wrapped.write(license)
-        wrapped.write("\n")
-        wrapped.write(source.read())
-        source.close()
-        tmpfile.close()
-        shutil.copy(tmppath, f)
-        os.unlink(tmppath)
-
-
-def _add_keywords(root, keywords):
+    license_path = os.path.abspath(license_path)
+    paths = tree.stale_paths(_license_exts, whitelist)
+    results = _map(pool, _license_str, [(tree.get_text(p), license) for p in paths])
+    for path, content in zip(paths, results):
+        tree.set_text(path, content)
+        tree.add_sources(path, [license_path])
+        f = tree.get_file(path)
+        if f.line_map:
+            line_map = sourcemap.LineMap()
+            line_map.add(license + u"\n")
+            line_map.add_map(f.line_map)
+            f.line_map = line_map
+
+
+def _keywords_re(keys, encoding=None):
+    """Compile keys into one alternation. Longer keys come first, so a key
+    wins over its prefixes. If encoding is set, the pattern matches byte
+    strings in that encoding."""
+    keys = sorted(keys, key=lambda k: (-len(k), k))
+    if encoding:
+        keys = [k.encode(encoding) if isinstance(k, unicode) else k for k in keys]
+    else:
+        keys = [k.decode("utf-8") if isinstance(k, str) else k for k in keys]
+    return re.compile("|".join(re.escape(k) for k in keys))
+
+def _keyword_key(keywords, key):
+    """Return the key of keywords which matched as key."""
+    if isinstance(key, unicode) and not key in keywords:
+        return key.encode("utf-8")
+    return key
+
+def _keywords_str(content, keywords, re_keywords):
+    """Replace all keywords in content in a single scan. Returns the new
+    content and a dict of the keywords which were found."""
+    used = {}
+    def replace(match):
+        key = _keyword_key(keywords, match.group(0))
+        used[key] = keywords[key]
+        return keywords[key]
+
+    return re_keywords.sub(replace, content), used
+
+def _keywords_line_map(line_map, content, new_content, keywords, re_keywords):
+    """Return the LineMap of new_content, content after the keyword
+    substitution, line_map is the one of content. A value maps to the start
+    of its keyword, the text around the keywords to where it was. The
+    runs are made with LineMap.map_tokens, from one position at each
+    keyword and at the start of each run of line_map."""
+    mappings = []
+    runs = line_map.runs
+    index = 0
+    # the position in content and in the new content
+    in_pos = out_pos = (0, 0)
+    start = 0
+    for match in list(re_keywords.finditer(content)) + [None]:
+        text = content[start:match.start() if match else len(content)]
+        in_end = sourcemap.end_position(text, *in_pos)
+        mappings.extend((out_pos[0] + 1, out_pos[1], in_pos[0] + 1, in_pos[1]))
+        while index < len(runs) and runs[index][:2] < in_end:
+            line, column = runs[index][:2]
+            if (line, column) > in_pos:
+                if line == in_pos[0]:
+                    column += out_pos[1] - in_pos[1]
+                mappings.extend((line - in_pos[0] + out_pos[0] + 1, column,
+                                 runs[index][0] + 1, runs[index][1]))
+            index += 1
+        out_pos = sourcemap.end_position(text, *out_pos)
+        in_pos = in_end
+        if match:
+            value = keywords[_keyword_key(keywords, match.group(0))]
+            mappings.extend((out_pos[0] + 1, out_pos[1], in_pos[0] + 1, in_pos[1]))
+            out_pos = sourcemap.end_position(value, *out_pos)
+            in_pos = sourcemap.end_position(match.group(0), *in_pos)
+            start = match.end()
+    return line_map.map_tokens(mappings, new_content)
+
+def _add_keywords(tree, keywords, pool=None):
     """
-    Do keyword replacement on all files in and under root which has an
+    Do keyword replacement on all files in the tree which have an
     extension in _keyword_exts. keywords is a dictionary, the key will be
-    replaced with the value.
+    replaced with the value. Files without any keyword are left untouched.
     """
-    keyword_files = []
-    for base, dirs, files in os.walk(root):
-        keyword_files.extend( [ os.path.join(base, f) for f in files if f.endswith(_keyword_exts)] )
-
-    for f in keyword_files:
-        source = codecs.open(f, "r", encoding="utf_8_sig")
-        tmpfd, tmppath = tempfile.mkstemp(".tmp", "dfbuild.")
-        tmpfile = os.fdopen(tmpfd, "w")
-        wrapped = codecs.getwriter("utf_8_sig")(tmpfile)
-        for line in source:
-            for key, val in keywords.items():
-                line = line.replace(key, val)
-            wrapped.write(line)
-
-        source.close()
-        tmpfile.close()
-        shutil.copy(tmppath, f)
-        os.unlink(tmppath)
-
-def _is_utf8(path):
-    """Check if file at path is utf8. Note that this only checks for a
-    utf8 BOM, nothing more
-    """
-    if not os.path.isfile(path): return None
-    f = open(path, "rb")
-    return "test-scripts" in path and True or f.read(3) == codecs.BOM_UTF8
-
-def _get_all_js_files(src, whitelist=[]):
-    js_files = []
-    for base, dirs, files in os.walk(src):
-        if whitelist:
-            bl = [d for d in dirs if not d in whitelist]
-            while bl:
-                dirs.pop(dirs.index(bl.pop()))
+    if not keywords:
+        return
 
-        js_files.extend([os.path.join(base, f) for f in files if f.endswith(".js")])
+    re_text = _keywords_re(keywords)
+    re_bytes = _keywords_re(keywords, "utf-8")
+    paths = []
+    for path in tree.paths(_keyword_exts):
+        if isinstance(tree.get_file(path).content, unicode):
+            found = re_text.search(tree.get_text(path))
+        else:
+            # not decoded yet, search the raw file
+            found = re_bytes.search(tree.get_bytes(path))
+        if found:
+            paths.append(path)
+
+    results = _map(pool, _keywords_str, [(tree.get_text(p), keywords, re_text) for p in paths])
+    for path, (content, used) in zip(paths, results):
+        f = tree.get_file(path)
+        if f.line_map:
+            f.line_map = _keywords_line_map(f.line_map, tree.get_text(path), content,
+                                             keywords, re_text)
+        tree.set_text(path, content)
+        tree.add_sources(path, [], used)
+
+def _minify_str(content, with_map=False, mangle=False):
+    """Minify a string with jsminify. The uglifyjs interface only works
+    on paths, in that case the content goes through a temp file. If
+    with_map is set, returns the minified string and the token mappings,
+    see jsminify.Minify. If mangle is set, the local names are renamed
+    too, the minifier must support it, see _minify_mangle."""
+    if with_map:
+        mappings = array.array("i")
+        return jsminify.minify_str(content, mappings, mangle=mangle), mappings
+    if mangle:
+        return jsminify.minify_str(content, mangle=True)
+    if hasattr(jsminify, "minify_str"):
+        return jsminify.minify_str(content)
+
+    tmpfd, tmppath = tempfile.mkstemp(".js", "dfbuild.")
+    tmpfile = os.fdopen(tmpfd, "wb")
+    tmpfile.write(content.encode("utf-8"))
+    tmpfile.close()
+    jsminify.minify_in_place(tmppath)
+    fp = codecs.open(tmppath, "r", encoding="utf_8_sig")
+    content = fp.read()
+    fp.close()
+    os.unlink(tmppath)
+    return content
 
-    return js_files
+def _set_minified(tree, path, minified, mappings=None):
+    f = tree.get_file(path)
+    if mappings is None:
+        f.line_map = None
+    else:
+        f.line_map = f.line_map.map_tokens(mappings, minified)
+    tree.set_text(path, minified)
 
-def _minify_buildout(src, whitelist=[]):
+def _minify_buildout(tree, whitelist=[], pool=None, cache=None, source_maps=False,
+                     mangle=False):
     """
-    Run minification on all javascript files in directory src. Minification
-    is done in-place, so the original file is replaced with the minified one.
+    Run minification on all javascript files in the tree. If cache is set,
+    a file which is in the MinifyCache is not minified again. If
+    source_maps is set, the LineMap of a bundle is carried through the
+    minification, else it is dropped. If mangle is set, the local names in
+    the scripts are shortened, see jsminify.mangle_locals. Returns the
+    number of minified files and the number of them from the cache.
     """
-    for f_p in _get_all_js_files(src, whitelist):
-        jsminify.minify_in_place(f_p)
-
-def _suppress_warnings(src, whitelist=[]):
-    for path in _get_all_js_files(src, whitelist):
-        content = ""
-        with open(path, 'rb') as f:
-            content = f.read()
-        if content:
-            with open(path, 'wb') as f:
-                f.write(content)
-                f.write(";opera.postError=function(){}")
-
-def _localize_buildout(src, langdir, option_minify):
-    """Make a localized version of the build dir. That is, with one
+    mangle = bool(mangle and _minify_mangle)
+    variant = "mangle" if mangle else ""
+    stale = tree.stale_paths((".js",), whitelist)
+    paths = []
+    for path in stale:
+        with_map = source_maps and _minify_maps and bool(tree.get_file(path).line_map)
+        result = cache and cache.get(tree.get_text(path), with_map, variant)
+        if result is None:
+            paths.append((path, with_map))
+        elif with_map:
+            _set_minified(tree, path, *result)
+        else:
+            _set_minified(tree, path, result)
+
+    results = _map(pool, _minify_str, [(tree.get_text(p), m, mangle) for p, m in paths])
+    for (path, with_map), result in zip(paths, results):
+        content, mappings = result if with_map else (result, None)
+        if cache:
+            cache.put(tree.get_text(path), content, mappings, variant)
+        _set_minified(tree, path, content, mappings)
+    return len(stale), len(stale) - len(paths)
+
+def _source_map_name(src, source):
+    """Return the name of the file source in the source maps of a build
+    from src, e.g. "ecma-debugger/runtimes.js"."""
+    path = os.path.relpath(source, src)
+    if path.startswith(os.pardir):
+        path = os.path.basename(source)
+    return path.replace(os.sep, "/")
+
+def _keep_source_maps(tree, manifest):
+    """Add the source maps of the scripts which are up to date in the
+    destination to the tree, they are not written again. A script whose
+    map is missing or changed is built again."""
+    for path in tree.paths((".js",)):
+        f = tree.get_file(path)
+        if not f.up_to_date or not f.line_map:
+            continue
+        tree.set_text(path + ".map", "")
+        tree.derive(path + ".map", [path])
+        map_file = tree.get_file(path + ".map")
+        map_file.up_to_date = manifest.is_up_to_date(map_file)
+        f.up_to_date = map_file.up_to_date
+
+def _write_source_maps(tree, root=""):
+    """Write a source map for each script with a LineMap next to it, e.g.
+    script/dragonfly.js.map, and link it from the end of the script. Runs
+    after _fingerprint_bundles, the map of a fingerprinted script is named
+    after it, e.g. script/dragonfly.3f9a1c2b.js.map. If root is not set,
+    the content of the sources is embedded in the maps, else it is the URL
+    the sources are found at. Returns the number of written maps."""
+    contents = {}
+    def read(source):
+        if not source in contents:
+            contents[source] = sourcemap.read_source(source)
+        return contents[source]
+
+    count = 0
+    for path in tree.stale_paths((".js",)):
+        f = tree.get_file(path)
+        if not f.line_map:
+            continue
+        output = tree.output_path(path)
+        name = os.path.basename(output)
+        tree.set_text(path + ".map",
+                      sourcemap.source_map(f.line_map, name, partial(_source_map_name, tree.src),
+                                           root, read))
+        tree.derive(path + ".map", [path])
+        _name_derived_outputs(tree, path)
+        tree.set_text(path, tree.get_text(path) + u"\n//# sourceMappingURL=%s.map\n" % name)
+        count += 1
+    return count
+
+def _suppress_warnings_str(content):
+    return content + u";opera.postError=function(){}"
+
+def _suppress_warnings(tree, whitelist=[], pool=None):
+    paths = [p for p in tree.stale_paths((".js",), whitelist) if tree.get_text(p)]
+    results = _map(pool, _suppress_warnings_str, [(tree.get_text(p),) for p in paths])
+    for path, content in zip(paths, results):
+        tree.set_text(path, content)
+
+def _localize_buildout(tree, langdir, option_minify):
+    """Make a localized version of the build tree. That is, with one
     script.js for each language, with a prefix suffix for each language
-    src: directory containing the finished build
+    tree: the build tree
     language: dir containing language files. NOT in build dir!
 
     Note, this function knows much more than it should about the structure
     of the build. The whole thing should possibly be refactored :(
     """
-    tmpfiles = []
-    scriptpath = os.path.normpath(os.path.join(src, "script/dragonfly.js"))
-    fp = codecs.open(scriptpath, "r", encoding="utf_8_sig")
-    script_data = fp.read()
-    fp.close()
-
-    clientpath = os.path.normpath(os.path.join(src, "client-en.xml"))
-    fp = codecs.open(clientpath, "r", encoding="utf_8_sig")
-    clientdata = fp.read()
-    fp.close()
+    script_data = tree.get_text("script/dragonfly.js")
+    clientdata = tree.get_text("client-en.xml")
 
     # Grab all english data. Will be put in front of localized strings so
     # there are fallbacks
@@ -426,42 +451,57 @@ def _localize_buildout(src, langdir, option_minify):
     langnames = [f for f in os.listdir(langdir) if f.startswith("ui_strings-") and f.endswith(".js") ]
     langnames = [f.replace("ui_strings-", "").replace(".js", "") for f in langnames]
 
-    for lang, newscriptpath, newclientpath, path in [ (ln, "script/dragonfly-"+ln+".js", "client-"+ln+".xml", os.path.join(langdir, "ui_strings-"+ln+".js")) for ln in langnames ]:
-        newscript = codecs.open(os.path.join(src,newscriptpath), "w", encoding="utf_8_sig")
-        newclient = codecs.open(os.path.join(src, newclientpath), "w", encoding="utf_8_sig")
+    script_map = tree.get_file("script/dragonfly.js").line_map
 
+    for lang, newscriptpath, newclientpath, path in [ (ln, "script/dragonfly-"+ln+".js", "client-"+ln+".xml", os.path.join(langdir, "ui_strings-"+ln+".js")) for ln in langnames ]:
+        newscript = []
+        line_map = sourcemap.LineMap()
         if not option_minify:
-            newscript.write(_concatcomment % englishfile)
-        newscript.write(englishdata)
+            newscript.append(_concatcomment % englishfile)
+            line_map.add(newscript[-1])
+        newscript.append(englishdata)
+        line_map.add(englishdata, englishfile)
         langfile = codecs.open(path, "r", encoding="utf_8_sig")
         if not option_minify:
-            newscript.write(_concatcomment % path)
-        newscript.write(langfile.read())
-        newscript.write(script_data)
-        newclient.write(clientdata.replace("dragonfly.js", "dragonfly" + "-" + lang +".js"))
-        newclient.close()
+            newscript.append(_concatcomment % path)
+            line_map.add(newscript[-1])
+        newscript.append(langfile.read())
+        line_map.add(newscript[-1], path)
+        newscript.append(script_data)
+        if script_map:
+            line_map.add_map(script_map)
+        else:
+            line_map.add(script_data)
         langfile.close()
-        newscript.close()
+        tree.set_text(newscriptpath, u"".join(newscript))
+        tree.derive(newscriptpath, ["script/dragonfly.js"])
+        tree.add_sources(newscriptpath, [englishfile, path])
+        tree.get_file(newscriptpath).line_map = line_map
+        tree.set_text(newclientpath, clientdata.replace("dragonfly.js", "dragonfly" + "-" + lang +".js"))
+        tree.derive(newclientpath, ["client-en.xml"])
 
-    os.unlink(os.path.join(src, "script/dragonfly.js"))
-    while tmpfiles:
-        os.unlink(tmpfiles.pop())
+    tree.remove("script/dragonfly.js")
 
 
-def _get_bad_encoding_files(src):
+def _get_bad_encoding_files(src, strict=False, cache_path=None):
     """Check the source directory if it passes the criteria for a valid
-    build. This means all files should be utf8 with a bom and all language
-    strings present in the sources should be present in all the language
-    files"""
-    files = os.walk(src)
-
-    bad = []
-    for base, dirs, files in os.walk(src):
-        for file in [f for f in files if f.endswith(_text_exts)]:
-            abs = os.path.join(base, file)
-            if not _is_utf8(abs): bad.append(abs)
-
-    return bad
+    build. This means all text files should be utf8 with a bom. If strict
+    is set, the whole content must also be valid utf8. src can also be a
+    FileInventory, see bomcheck."""
+    return [path for path, result in
+            bomcheck.check_tree(src, _text_exts, strict, cache_path=cache_path)]
+
+def _fix_bad_encoding_files(src):
+    """Add a BOM to all text files in src which have none. Returns the
+    fixed paths."""
+    bad = _get_bad_encoding_files(src)
+    fixed = []
+    for path, error in zip(bad, bomcheck.fix_files(bad)):
+        if error:
+            print "could not fix \"%s\": %s" % (path, error)
+        else:
+            fixed.append(path)
+    return fixed
 
 def _get_string_keys(path):
     """Grab all the string keys of out a language file"""
@@ -500,143 +540,175 @@ def _get_missing_strings_for_dir(stringsdir, masterlang):
 
     return missing
 
-def _clobbering_copytree(src, dst, symlinks=False):
-    """This is a modified version of copytree from the shutil module in
-    the standard library. This version will allow copying to existing folders
-    and will clobber existing files. USE WITH CAUTION!
-    Original docstring follows:
-
-    Recursively copy a directory tree using copy2().
-
-    The destination directory must not already exist.
-    If exception(s) occur, an Error is raised with a list of reasons.
-
-    If the optional symlinks flag is true, symbolic links in the
-    source tree result in symbolic links in the destination tree; if
-    it is false, the contents of the files pointed to by symbolic
-    links are copied.
-
-    XXX Consider this example code rather than the ultimate tool.
-
-    """
-    names = os.listdir(src)
-    if not os.path.isdir(dst):
-        os.makedirs(dst)
-
-    errors = []
-    for name in names:
-        srcname = os.path.join(src, name)
-        dstname = os.path.join(dst, name)
-        try:
-            if symlinks and os.path.islink(srcname):
-                linkto = os.readlink(srcname)
-                os.symlink(linkto, dstname)
-            elif os.path.isdir(srcname):
-                _clobbering_copytree(srcname, dstname, symlinks)
-            else:
-                shutil.copy2(srcname, dstname)
-            # XXX What about devices, sockets etc.?
-        except (IOError, os.error), why:
-            errors.append((srcname, dstname, str(why)))
-        # catch the Error from the recursive copytree so that we can
-        # continue with other files
-        except Error, err:
-            errors.extend(err.args[0])
-    try:
-        shutil.copystat(src, dst)
-    except WindowsError:
-        # can't copy file access times on Windows
-        pass
-    except OSError, why:
-        errors.extend((src, dst, str(why)))
-    if errors:
-        raise Error, errors
-
-def _data_uri_from_path(path):
-    if os.path.isfile(path):
-        fp = open(path, "rb")
-        return "'data:image/png;charset=utf-8;base64," + base64.b64encode(fp.read()) + "'"
-    else:
-        return None
-
-def _find_file_path(base, file_name):
-    for dirpath, dirs, fns in os.walk(base):
-        for fn in fns:
-            if fn == file_name:
-                return os.path.join(dirpath, fn)
-    return None
+# (path, sha1 of the content): data URI
+_data_uri_cache = {}
+
+def _data_uri(path, data):
+    """Return the quoted data URI for the file at path with content data.
+    URIs are memoized by path and content hash."""
+    key = (path, hashlib.sha1(data).hexdigest())
+    if not key in _data_uri_cache:
+        ext = os.path.splitext(path)[1].lower()
+        mime = _mime_types.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        _data_uri_cache[key] = "'data:%s;charset=utf-8;base64,%s'" % (mime, base64.b64encode(data))
+    return _data_uri_cache[key]
+
+def _get_file_name_index(tree):
+    """Map the file names in tree to the first path with that name."""
+    index = {}
+    for path in tree.paths():
+        index.setdefault(os.path.basename(path), path)
+    return index
 
 def URI_to_os_path(path):
     return os.path.join(*[urllib.unquote(part) for part in path.split('/')])
 
-def _convert_imgs_to_data_uris(src, whitelist=[]):
-    re_img = re.compile(r""".*?url\((['"]?(.*?)['"]?)\)""")
-    deletions = []
-    for base, dirs, files in os.walk(src):
-        if whitelist:
-            bl = [d for d in dirs if not d in whitelist]
-            while bl:
-                dirs.pop(dirs.index(bl.pop()))
-        for path in [ os.path.join(base, f) for f in files if f.endswith(".css") ]:
-            fp = codecs.open(path, "r", "utf_8_sig")
-            dirty = False
-            temp = tempfile.TemporaryFile()
-            for line in fp:
-                match = re_img.findall(line)
-                if match:
-                    for full, stripped in match:
-                        file_path = os.path.join(base, URI_to_os_path(stripped))
-                        if not os.path.isfile(file_path):
-                            # src is actually the target destination of the build
-                            # that means the relations of css and according images
-                            # are lost. Clashing filenames will cause problems.
-                            parts = stripped.split('/')
-                            file_name = parts[len(parts) - 1]
-                            file_path = _find_file_path(src, file_name)
-                        uri = ""
-                        if file_path:
-                            deletions.append(file_path)
-                            uri = _data_uri_from_path(file_path)
-                        if uri:
-                            temp.write(line.replace(full, uri).encode("utf-8"))
-                        else:
-                            if not stripped.startswith("data:"):
-                                print "no data uri for path:", os.path.join(base, URI_to_os_path(stripped))
-                            temp.write(line.encode("utf-8"))
-                            dirty = True
-                else:
-                    temp.write(line.encode("utf-8"))
-                    dirty = True
-
-            if dirty:
-                fp.close()
-                fp = codecs.open(path, "w", encoding="utf_8_sig")
-                temp.seek(0)
-                fp.write(temp.read().decode("utf-8"))
-                fp.close()
-
-    for path in deletions:
-        if os.path.isfile(path): os.unlink(path)
+def _data_uris_str(content, uris):
+    """Replace the url() references in content with data URIs. uris maps
+    the url() arguments to the data URIs."""
+    def replace_url(match):
+        full, stripped = match.groups()
+        if stripped in uris:
+            return "url(%s)" % uris[stripped]
+        return match.group(0)
+
+    return _re_img_url.sub(replace_url, content)
+
+def _convert_imgs_to_data_uris(tree, whitelist=[], pool=None, max_size=0, max_refs=0):
+    """Replace the images referenced in the stylesheets in tree with data
+    URIs. An image stays an external file if it is bigger than max_size
+    bytes or referenced more than max_refs times in one stylesheet, 0 means
+    no limit. Returns the paths of the images which are still referenced.
+    """
+    deletions = set()
+    referenced = set()
+    paths = []
+    arg_lists = []
+    inlined_bytes = 0
+    inlined_count = 0
+    file_names = _get_file_name_index(tree)
+    for path in tree.paths((".css",), whitelist):
+        base = os.path.dirname(path)
+        content = tree.get_text(path)
+        targets = {}
+        counts = {}
+        occurrences = {}
+        for full, stripped in _re_img_url.findall(content):
+            occurrences[stripped] = occurrences.get(stripped, 0) + 1
+            if stripped in targets:
+                file_path = targets[stripped]
+            else:
+                file_path = os.path.normpath(os.path.join(base, URI_to_os_path(stripped)))
+                if not file_path in tree:
+                    # the tree is the finished build, that means the relations
+                    # of css and according images are lost. Clashing
+                    # filenames will cause problems.
+                    parts = stripped.split('/')
+                    file_name = parts[len(parts) - 1]
+                    file_path = file_names.get(file_name)
+                if not file_path and not stripped.startswith("data:"):
+                    print "no data uri for path:", os.path.join(base, URI_to_os_path(stripped))
+                targets[stripped] = file_path
+            if file_path:
+                counts[file_path] = counts.get(file_path, 0) + 1
+
+        uris = {}
+        for stripped, file_path in targets.items():
+            if not file_path:
+                continue
+            tree.derive(path, [file_path])
+            data = tree.get_bytes(file_path)
+            if (max_size and len(data) > max_size) or \
+               (max_refs and counts[file_path] > max_refs):
+                referenced.add(file_path)
+                url = _make_rel_url_path(path, file_path)
+                if not url == stripped:
+                    uris[stripped] = "'%s'" % url
+            else:
+                deletions.add(file_path)
+                uris[stripped] = _data_uri(file_path, data)
+                inlined_bytes += len(uris[stripped]) * occurrences[stripped]
+                inlined_count += occurrences[stripped]
+
+        # a stylesheet which is up to date only decides about the images
+        if uris and not tree.get_file(path).up_to_date:
+            paths.append(path)
+            arg_lists.append((content, uris))
+
+    results = _map(pool, _data_uris_str, arg_lists)
+    for path, content in zip(paths, results):
+        tree.set_text(path, content)
+
+    for path in deletions - referenced:
+        tree.remove(path)
+
+    referenced_bytes = sum(len(tree.get_bytes(p)) for p in referenced)
+    print "%s bytes inlined in %s data URIs, %s bytes in %s images referenced" % \
+        (inlined_bytes, inlined_count, referenced_bytes, len(referenced))
+    return referenced
+
+def _fingerprint_name(tree, path):
+    """Return path with a hash of the content of the file before the
+    extension, e.g. script/dragonfly-de.3f9a1c2b.js."""
+    f = tree.get_file(path)
+    if f.up_to_date and f.name:
+        # not changed since the last build, the content was not processed
+        return f.name
+    base, ext = os.path.splitext(path)
+    return "%s.%s%s" % (base, hashlib.sha1(tree.get_bytes(path)).hexdigest()[:8], ext)
+
+# the suffixes of the outputs which are made from a file and named after
+# it, e.g. the source map script/dragonfly.js.map
+_derived_suffixes = (".map",)
+
+def _name_derived_outputs(tree, path):
+    """Name the outputs made from the file path after its output, e.g.
+    script/dragonfly.3f9a1c2b.js.map for script/dragonfly.js.map."""
+    output = tree.output_path(path)
+    for suffix in _derived_suffixes:
+        if path + suffix in tree and output != path:
+            tree.set_name(path + suffix, output + suffix)
+
+def _fingerprint_bundles(tree):
+    """Give all scripts and stylesheets which are linked from a client
+    file a name with a hash of their content and update the links. The
+    outputs made from a bundle are renamed with it, see
+    _name_derived_outputs. Returns the number of renamed files."""
+    names = {}
+    client_files = [path for path, lang in _client_lang_files(tree)]
+    for path in client_files:
+        for match in _re_linked_source.finditer(tree.get_text(path)):
+            ref = match.group(1) or match.group(2)
+            if ref in names or not ref.endswith((".js", ".css")) or not ref in tree:
+                continue
+            names[ref] = _fingerprint_name(tree, ref)
+            tree.set_name(ref, names[ref])
+            _name_derived_outputs(tree, ref)
+
+    def replace(match):
+        ref = match.group(1) or match.group(2)
+        if not ref in names:
+            return match.group(0)
+        start, end = match.span(1 if match.group(1) else 2)
+        name = names[ref].replace(os.sep, "/")
+        return match.group(0)[:start - match.start()] + name + match.group(0)[end - match.start():]
+
+    for path in client_files:
+        content = tree.get_text(path)
+        refs = [m.group(1) or m.group(2) for m in _re_linked_source.finditer(content)]
+        refs = [r for r in refs if r in names]
+        if refs:
+            tree.set_text(path, _re_linked_source.sub(replace, content))
+            f = tree.get_file(path)
+            # the links changed if any of the files changed
+            f.up_to_date = f.up_to_date and \
+                not [r for r in refs if not tree.get_file(r).up_to_date]
+    return len(names)
 
 def _make_rel_url_path(src, dst):
-    """src is a file or dir which wants to adress dst relatively, calculate
-    the appropriate path to get from here to there."""
-    srcdir = os.path.abspath(src + "/..")
-    dst = os.path.abspath(dst)
-
-    # For future reference, I hate doing dir munging with string operations
-    # with a fiery passion, but pragmatism won out over making a lib.. .
-
-    common = os.path.commonprefix((srcdir, dst))
-
-    reldst = dst[len(common):]
-    srcdir = srcdir[len(common):]
-
-    newpath = re.sub(""".*?[/\\\]|.+$""", "../", srcdir) or "./"
-    newpath = newpath + reldst
-    newpath = newpath.replace("\\", "/")
-    newpath = newpath.replace("//", "/")
-    return newpath
+    """Return the url of the file dst relative to the file src, both are
+    build relative paths."""
+    return os.path.relpath(dst, os.path.dirname(src) or os.curdir).replace(os.sep, "/")
 
 def make_archive(src, dst, in_subdir=True):
     """This simply packs up the contents in the directory src into a zip
@@ -664,9 +736,30 @@ def make_archive(src, dst, in_subdir=True):
 
     z.close()
 
-def make_build_archive(src, dest_dir, file_name):
-    dest = os.path.join(dest_dir, file_name.replace(".xml", ".zip"))
-    z = zipfile.ZipFile(dest, "w", zipfile.ZIP_DEFLATED)
+def _stylesheet_urls(src, path):
+    """Return (url, file) of the url() references of the stylesheet path
+    in src which are not data URIs or absolute URLs. file is the path in
+    src the url points to, or None if there is no such file."""
+    with open(os.path.join(src, path), "rb") as f:
+        content = f.read()
+    urls = []
+    for full, stripped in _re_img_url.findall(content):
+        if stripped.startswith(("data:", "/", "#")) or ":" in stripped.split("/")[0]:
+            continue
+        # e.g. a font url with "?#iefix"
+        rel = re.split(r"[?#]", stripped)[0]
+        file_path = os.path.normpath(os.path.join(os.path.dirname(path),
+                                                  URI_to_os_path(rel)))
+        if file_path.startswith(os.pardir) or \
+           not os.path.isfile(os.path.join(src, file_path)):
+            file_path = None
+        urls.append((stripped, file_path))
+    return urls
+
+def _build_archive_files(src, file_name):
+    """Return the client file file_name, the scripts and stylesheets it
+    links to and the files the stylesheets reference with url(), e.g. the
+    images which were not made data URIs."""
     files = [file_name]
 
     with open(os.path.join(src, file_name), 'r') as f:
@@ -679,11 +772,178 @@ def make_build_archive(src, dest_dir, file_name):
             if ext in [".css", ".js"]:
                 files.append(path)
 
+    for path in [p for p in files if p.endswith(".css")]:
+        if not os.path.isfile(os.path.join(src, path)):
+            continue
+        for url, file_path in _stylesheet_urls(src, path):
+            if file_path and not file_path in files:
+                files.append(file_path)
+
+    return files
+
+def _check_archive_urls(src, files):
+    """Return a message for each url() of a stylesheet in files which does
+    not point to one of files."""
+    members = set(files)
+    errors = []
+    for path in [p for p in files if p.endswith(".css")]:
+        for url, file_path in _stylesheet_urls(src, path):
+            if not file_path in members:
+                errors.append("%s: url(%s) is not in the archive" % (path, url))
+    return errors
+
+def _read_member(src, path, cache):
+    """Read and compress the file path in src for a zip archive. The result
+    is kept in cache, keyed by path, size and mtime, so a file shared by
+    several archives is only read and deflated once."""
+    abs_path = os.path.join(src, path)
+    st = os.stat(abs_path)
+    key = (path, st.st_size, st.st_mtime)
+    if not key in cache:
+        with open(abs_path, "rb") as f:
+            data = f.read()
+        file_size = len(data)
+        crc = zlib.crc32(data) & 0xffffffff
+        if path.lower().endswith(_stored_exts):
+            compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = zipfile.ZIP_DEFLATED
+            # the same raw deflate stream as ZipFile.writestr
+            co = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            data = co.compress(data) + co.flush()
+        cache[key] = {"date_time": time.localtime(st.st_mtime)[0:6],
+                      "external_attr": (st.st_mode & 0xFFFF) << 16L,
+                      "compress_type": compress_type,
+                      "file_size": file_size,
+                      "CRC": crc,
+                      "data": data}
+    return cache[key]
+
+def _write_member(z, arcname, member):
+    """Add a member read by _read_member to the open archive z. The data
+    is already compressed and is written as it is, the way
+    ZipFile.writestr does after compressing."""
+    zinfo = zipfile.ZipInfo(arcname.replace(os.sep, "/"), member["date_time"])
+    zinfo.external_attr = member["external_attr"]
+    zinfo.compress_type = member["compress_type"]
+    zinfo.file_size = member["file_size"]
+    zinfo.compress_size = len(member["data"])
+    zinfo.CRC = member["CRC"]
+    zinfo.header_offset = z.fp.tell()
+    z._writecheck(zinfo)
+    z._didModify = True
+    z.fp.write(zinfo.FileHeader())
+    z.fp.write(member["data"])
+    z.filelist.append(zinfo)
+    z.NameToInfo[zinfo.filename] = zinfo
+
+def make_build_archive(src, dest_dir, file_name, cache=None):
+    dest = os.path.join(dest_dir, file_name.replace(".xml", ".zip"))
+    # write next to dest and rename, an existing archive may be linked
+    # from elsewhere, e.g. from the "latest" directory
+    tmp = dest + ".tmp"
+    z = zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED)
+    if cache is None:
+        cache = {}
+
+    files = _build_archive_files(src, file_name)
+    for error in _check_archive_urls(src, files):
+        print "warning:", error
     for path in files:
-        z.write(os.path.join(src, path), path)
+        _write_member(z, path, _read_member(src, path, cache))
 
     z.close()
+    if os.name == "nt" and os.path.exists(dest):
+        os.unlink(dest)
+    os.rename(tmp, dest)
+
+def make_build_archives(src, dest_dir, file_names, jobs=1):
+    """Create a zip archive in dest_dir for each client file in file_names.
+    Every distinct member is read and compressed once, in parallel by jobs
+    threads, 0 meaning one per CPU, and copied as it is into each archive."""
+    cache = {}
+    members = set()
+    for file_name in file_names:
+        members.update(_build_archive_files(src, file_name))
+
+    pool = multiprocessing.pool.ThreadPool(jobs or None)
+    try:
+        # zlib releases the GIL, threads are enough here
+        pool.map(lambda path: _read_member(src, path, cache), sorted(members))
+        pool.map(lambda name: make_build_archive(src, dest_dir, name, cache), file_names)
+    finally:
+        pool.close()
+        pool.join()
+
+def _gzip_file(path):
+    """Write path.gz with the maximum compression. The header has no name
+    and no time, so the same content always gives the same file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    tmp_path = path + ".gz.tmp"
+    with open(tmp_path, "wb") as f:
+        gz = gzip.GzipFile("", "wb", 9, f, mtime=0)
+        gz.write(data)
+        gz.close()
+    os.rename(tmp_path, path + ".gz")
+
+def _gzip_outputs(dest, manifest, min_size=0, jobs=1):
+    """Write a .gz sibling for each text file in dest which is at least
+    min_size bytes. Files whose hash did not change since the last build
+    keep their .gz. The .gz files which are not needed any more are
+    removed. Returns the paths of the compressed files."""
+    inventory = FileInventory(dest)
+    last = manifest.gzipped
+    gzipped = {}
+    todo = []
+    for path in inventory.paths(_gzip_exts):
+        size, mtime = inventory.stat(path)
+        if size < min_size:
+            continue
+        record = last.get(path)
+        has_gz = path + ".gz" in inventory
+        if record and has_gz and record[:2] == [size, mtime]:
+            gzipped[path] = record
+            continue
+        digest = file_hash(inventory.abspath(path))
+        gzipped[path] = [size, mtime, digest]
+        if not (record and has_gz and record[2] == digest):
+            todo.append(path)
 
+    for path in last:
+        if not path in gzipped and path + ".gz" in inventory:
+            os.unlink(inventory.abspath(path + ".gz"))
+
+    if todo:
+        pool = multiprocessing.pool.ThreadPool(jobs or None)
+        try:
+            # zlib releases the GIL, threads are enough here
+            pool.map(_gzip_file, [inventory.abspath(p) for p in todo])
+        finally:
+            pool.close()
+            pool.join()
+    manifest.gzipped = gzipped
+    return todo
+
+def export_tree(src, process_directives=True, keywords={},
+                exclude_dirs=[], exclude_files=[], directive_vars={}, pool=None,
+                source_cache=None, graph=None, inventory=None):
+    """
+    Read a directory into a BuildTree and run the export stages on it.
+    Nothing is written, see export for the arguments.
+    """
+    tree = BuildTree(src, source_cache, inventory)
+
+    if process_directives:
+        _process_directive_files(tree, directive_vars, graph)
+
+    # remove stuff in the blacklist
+    _clean_dir(tree, exclude_dirs, exclude_files)
+
+    if keywords:
+        _add_keywords(tree, keywords, pool)
+
+    return tree
 
 def export(src, dst, process_directives=True, keywords={},
            exclude_dirs=[], exclude_files=[], directive_vars={}):
@@ -702,45 +962,12 @@ def export(src, dst, process_directives=True, keywords={},
     directive_vars: a dictionary that will passed on to the diretive handling.
         Can be used to control the handling of the directives
     """
-
-    src = os.path.abspath(src); # make sure it's absolute
-
-    # get a temporary place to do stuff
-    tmpbase = tempfile.mkdtemp(".tmp", "dfbuild.")
-    ## this is kinda dumb but copytree always copy to a non-extant subdir
-    tmpdir = os.path.join(tmpbase, "src")
-    shutil.copytree(src, tmpdir)
-
-    if process_directives:
-        _process_directive_files(tmpdir, directive_vars)
-
-    # remove empty directories and stuff in the blacklist
-    _clean_dir(tmpdir, exclude_dirs, exclude_files)
-
-    if keywords:
-        _add_keywords(tmpdir, keywords)
-
-    #copy the stuff to its final destination and get rid of temp copy:
-    if not os.path.isdir(dst):
-        os.mkdir(dst)
-
-    # stupid copy function to get around the must-put-in-subdir thingy in shutil.copytree
-    for entry in os.listdir(tmpdir):
-        path = os.path.join(tmpdir, entry)
-        if os.path.isdir(path):
-            _clobbering_copytree(path, os.path.join(dst, entry))
-        else:
-            shutil.copy(os.path.join(tmpdir,entry), dst)
-
-    shutil.rmtree(tmpbase)
-
-def _ansi2utf8(path):
-    f = codecs.open(path, 'r', 'utf-8')
-    c = f.read()
-    f.close()
-    f = codecs.open(path, 'w', 'utf_8_sig')
-    f.write(c)
-    f.close()
+    tree = export_tree(src, process_directives=process_directives,
+                       keywords=keywords, exclude_dirs=exclude_dirs,
+                       exclude_files=exclude_files,
+                       directive_vars=directive_vars)
+    tree.write(dst)
+    return tree
 
 def main(argv=sys.argv):
     """
@@ -799,9 +1026,7 @@ Destination can be either a directory or a zip file"""
     globals()['options'] = options
 
     if len(args) == 1 and options.fix_BOM:
-        bad = _get_bad_encoding_files(args[0])
-        for path in bad:
-            _ansi2utf8(path)
+        _fix_bad_encoding_files(args[0])
         return 0
 
     # Make sure we have a source and destination
@@ -862,56 +1087,42 @@ Destination can be either a directory or a zip file"""
                 parser.error("Destination exists! use -d to force overwrite")
             else:
                 os.unlink(dst)
+    elif os.path.isdir(dst) and not options.overwrite_dst:
+        parser.error("Destination exists! use -d to force overwrite")
 
-        tempdir = tempfile.mkdtemp(".tmp", "dfbuild.")
-        export(src, tempdir, process_directives=options.concat, exclude_dirs=exdirs,
-               keywords=keywords, directive_vars=dirvars)
+    tree = export_tree(src, process_directives=options.concat, exclude_dirs=exdirs,
+                       keywords=keywords, directive_vars=dirvars)
 
-        if options.translate_build:
-            _localize_buildout(tempdir,
-                               os.path.join(os.path.abspath(src), "ui-strings"),
-                               options.minify)
+    if options.translate_build:
+        _localize_buildout(tree,
+                           os.path.join(os.path.abspath(src), "ui-strings"),
+                           options.minify)
 
-        if options.make_data_uris:
-            _convert_imgs_to_data_uris(dst)
+    if options.make_data_uris:
+        referenced = _convert_imgs_to_data_uris(tree)
+        # any other image in ui-images is not used
+        tree.remove_dir('ui-images', keep=referenced)
 
-        if options.minify:
-            _minify_buildout(dst)
+    if options.minify:
+        _minify_buildout(tree)
 
-        if options.license:
-            _add_license(tempdir)
+    if options.license:
+        _add_license(tree)
 
+    if dst.endswith(".zip"):
+        tempdir = tempfile.mkdtemp(".tmp", "dfbuild.")
+        tree.write(tempdir)
         make_archive(tempdir, dst)
         shutil.rmtree(tempdir)
 
     else: # export to a directory
-        if os.path.isdir(dst) and not options.overwrite_dst:
-            parser.error("Destination exists! use -d to force overwrite")
-
-        export(src, dst, process_directives=options.concat, exclude_dirs=exdirs,
-               keywords=keywords, directive_vars=dirvars)
-
-        if options.translate_build:
-            _localize_buildout(dst,
-                               os.path.join(os.path.abspath(src), "ui-strings"),
-                               options.minify)
-
-        if options.make_data_uris:
-            _convert_imgs_to_data_uris(dst)
-            # any remaining image in ui-images is not used
-            img_dir = os.path.join(dst, 'ui-images')
-            shutil.rmtree(img_dir)
-
-        if options.minify:
-            _minify_buildout(dst)
-
-        if options.license:
-            _add_license(dst)
+        tree.write(dst)
 
         AUTHORS = os.path.join(src, '..', 'AUTHORS')
         if os.path.isfile(AUTHORS):
             shutil.copy(AUTHORS, os.path.join(dst, 'AUTHORS'))
 
+
 def cmd_call(*args):
     return subprocess.Popen(args,
                             stdout=subprocess.PIPE,
@@ -934,9 +1145,7 @@ def filter_git_login_msg(input_string):
     return input_string
 
 def fix_bom(args):
-    bad = _get_bad_encoding_files(args.src)
-    for path in bad:
-        _ansi2utf8(path)
+    for path in _fix_bad_encoding_files(args.src):
         print "BOM fixed for \"%s.\"" % path
     return 0
 
@@ -949,272 +1158,847 @@ def _get_profile(profiles, name):
                 return profiles[p]
     return None
 
-def _dfl_bug2link(bts_url, match):
-    url = bts_url % match.group(0)
-    return LOG_A % (url, match.group(0))
+def _build_tree(profile, src, dest, keywords, directive_vars, pool=None, stats=None,
+                source_cache=None, inventory=None, minify_cache=None, base_tree=None,
+                graph=None):
+    """Run the export and all per-file stages of profile and write the
+    result to dest. Returns the build tree and the build manifest.
+    source_cache is passed on to the BuildTree. inventory is the
+    FileInventory of src, it is made if not passed in. minify_cache is
+    an optional MinifyCache. base_tree is an export without keywords
+    shared with other profiles, see _export_base, graph the
+    DependencyGraph it was made with. The tree is copied, only the
+    keywords are added."""
+    stats = stats or BuildStats()
+    whitelist = profile.get("minify_whitelist")
+    graph = graph or DependencyGraph(os.path.join(state_dir(dest), GRAPH_NAME))
+    if base_tree:
+        inventory = inventory or base_tree.inventory
+        with stats.stage("keywords") as record:
+            tree = base_tree.copy()
+            _add_keywords(tree, keywords, pool)
+            for key in tree.counters:
+                record[key] += tree.counters[key]
+        print "build copied from the shared export."
+    else:
+        if not inventory:
+            with stats.stage("inventory") as record:
+                inventory = FileInventory(src)
+                record["files"] += len(inventory)
+        with stats.stage("export") as record:
+            tree = export_tree(src,
+                               exclude_dirs=profile.get("copy_blacklist"),
+                               keywords=keywords,
+                               directive_vars=directive_vars,
+                               pool=pool,
+                               source_cache=source_cache,
+                               graph=graph,
+                               inventory=inventory)
+            # the tree did not exist before the stage
+            for key in tree.counters:
+                record[key] += tree.counters[key]
+        print "build exported."
+    if profile.get("translate"):
+        with stats.stage("translate", tree):
+            _localize_buildout(tree,
+                               os.path.join(src, "ui-strings"),
+                               profile.get("minify"))
+        print "build translated"
+
+    manifest = BuildManifest(dest, settings_digest(profile, [("minifier", minifier_identity(jsminify))]),
+                             inventory)
+    if profile.get("incremental"):
+        with stats.stage("up-to-date check", tree):
+            count = manifest.mark_up_to_date(tree)
+            if profile.get("source_maps"):
+                _keep_source_maps(tree, manifest)
+        print "%s of %s files are up to date" % (count, len(tree))
+
+    if profile.get("make_data_uris"):
+        with stats.stage("data URIs", tree):
+            referenced = _convert_imgs_to_data_uris(tree, whitelist, pool,
+                                                    profile.get("data_uri_max_size", 0),
+                                                    profile.get("data_uri_max_refs", 0))
+            # any other image in ui-images is not used
+            tree.remove_dir('ui-images', keep=referenced)
+        print "data URIs created"
+
+    if profile.get("minify"):
+        with stats.stage("minify", tree):
+            count, cached = _minify_buildout(tree, whitelist, pool, minify_cache,
+                                             profile.get("source_maps"),
+                                             profile.get("mangle"))
+        if minify_cache:
+            print "builds minified, %s of %s scripts from the cache" % (cached, count)
+        else:
+            print "builds minified"
 
-def escape_html(str):
-    return str.replace("&", "&amp;").replace("<" , "&lt;")
+    if profile.get("license"):
+        with stats.stage("license", tree):
+            _add_license(tree, whitelist=whitelist, pool=pool)
+        print "license added"
+
+    if profile.get("suppress_warnings"):
+        with stats.stage("suppress warnings", tree):
+            _suppress_warnings(tree, whitelist, pool)
+        print "warnings suppressed in build."
+
+    if profile.get("fingerprint_bundles"):
+        with stats.stage("fingerprint", tree):
+            count = _fingerprint_bundles(tree)
+        print "%s bundles fingerprinted" % count
+
+    if profile.get("source_maps"):
+        with stats.stage("source maps", tree):
+            count = _write_source_maps(tree, profile.get("source_map_root"))
+        print "%s source maps written" % count
+
+    with stats.stage("write", tree):
+        counts = tree.write(dest, profile.get("link_files"))
+        stale = manifest.remove_stale_outputs(tree)
+        _remove_dest_state_files(dest)
+        if not os.path.isdir(state_dir(dest)):
+            os.makedirs(state_dir(dest))
+        graph.save(os.path.join(state_dir(dest), GRAPH_NAME))
+    print "build written to %s, %s files written, %s linked, %s copied, %s removed" % \
+        (dest, counts["write"], counts["reflink"] + counts["hardlink"], counts["copy"], len(stale))
+    return tree, manifest
+
+def _remove_dest_state_files(dest):
+    """Remove the state files which older builds wrote into dest itself,
+    they are in the state directory now, see buildmanifest.state_dir."""
+    for name in [MANIFEST_NAME, GRAPH_NAME, bomcheck.CACHE_NAME]:
+        if os.path.isfile(os.path.join(dest, name)):
+            os.unlink(os.path.join(dest, name))
+
+def _client_lang_files(tree):
+    """Return a list of (path, language) of the client files in tree."""
+    client_lang_files = []
+    for item in tree.paths((".xml",)):
+        match = _re_client_lang_file.match(item)
+        if match:
+            client_lang_files.append((item, match.group(1)))
+    return client_lang_files
+
+def _set_base_uris(profile, dest, client_lang_files, stats):
+    """Set the base URI in the client files in dest, if the profile says
+    so. Returns False if that failed."""
+    if not profile.get("set_base_uri"):
+        return True
+
+    path_segs = dest.split(os.path.sep)
+    pos = path_segs.index(profile.get("local_domain_dir_name"))
+    if pos > -1:
+        base_url = "/%s/" % "/".join(path_segs[pos + 1:])
+        base_url_tag = (BASE_URL % base_url).strip().encode("utf-8")
+        cmd_base_url = "<!-- command set_rel_base_url -->"
+
+        with stats.stage("base URIs") as record:
+            for name, lang in client_lang_files:
+                path = os.path.join(dest, name)
+                content = ""
+                with open(path, 'rb') as f:
+                    content = f.read()
+                if content:
+                    content = content.replace(cmd_base_url, base_url_tag, 1)
+                    with open(path, 'wb') as f:
+                        f.write(content)
+                    record["files"] += 1
+                    record["out"] += len(content)
+                else:
+                    print "abort, could not set base URL in %s" % name
+                    return False
 
+        print "base URLs set"
+        return True
 
-def log2html(log, tag, rev, short_hash, url_commits, bts_url):
-    entry = LogEntry()
-    ret = []
-    lines = log.split("\n")
-    url_commits = url_commits.encode("utf-8")
-    to_bts_link = partial(_dfl_bug2link, bts_url.encode("utf-8")) if bts_url else None
-    for line in lines:
-        if line:
-            entry.update(line)
-        else:
-            if entry.shorthash:
-                url = url_commits % entry.shorthash
-                subject_escaped = escape_html(entry.subject)
-                subject = _re_bts_dfl.sub(to_bts_link, subject_escaped) if bts_url else subject_escaped
-                ret.append(LOG_LINE % (entry.author, url, entry.shorthash, subject, entry.date))
-            entry = LogEntry()
+    print "abort, could not set the base URLs"
+    return False
 
-    m = _re_bts_dfl.search(tag)
-    log_h2 = LOG_H2 % (LOG_A % (url_commits % tag, tag), to_bts_link(m) if m else "")
-    return LOG_BODY % (tag, log_h2, "".join(ret))
+def _create_app_cache_manifests(profile, dest, tag, stats):
+    """Create the app cache manifests in dest, if the profile says so.
+    Returns False if that failed."""
+    if not profile.get("create_manifests"):
+        return True
 
-def build(args):
-    build_config = args.config.get("build", {})
+    try:
+        root = profile.get("local_domain_dir_name").encode("utf-8")
+        with stats.stage("app cache manifests"):
+            create_manifests(dest.encode("utf-8"), domain_token=root, tag=tag)
+        print "app cache manifests created"
+        return True
+    except:
+        print "abort, could not create the manifest files"
+        return False
+
+def _finish_dest(profile, dest, tree, manifest, client_lang_files, tag, stats, jobs=1):
+    """Run the stages which work on the written build in dest and save the
+    build manifest. Returns False if a stage failed."""
+    if not _set_base_uris(profile, dest, client_lang_files, stats):
+        return False
+
+    if not _create_app_cache_manifests(profile, dest, tag, stats):
+        return False
+
+    if profile.get("gzip_outputs"):
+        with stats.stage("gzip") as record:
+            paths = _gzip_outputs(dest, manifest, profile.get("gzip_min_size", 0), jobs)
+            record["files"] += len(paths)
+            for path in paths:
+                record["in"] += os.path.getsize(os.path.join(dest, path))
+                record["out"] += os.path.getsize(os.path.join(dest, path + ".gz"))
+        print "%s files gzipped" % len(paths)
+
+    with stats.stage("build manifest"):
+        manifest.update(tree)
+        manifest.save()
+    return True
+
+def _watch_build(profile, src, dest, keywords, directive_vars, jobs, tree, source_cache,
+                 minify_cache, tag):
+    """Rebuild dest each time files in src change, until interrupted. Each
+    change runs the export again on the whole source tree, the build
+    manifest then marks the outputs whose sources did not change as up to
+    date, the later stages skip them and they are not written again. The
+    process pool and the content of the unchanged source files are kept
+    between the rebuilds. No VCS command is run and no zips or logs are
+    created."""
+    profile = dict(profile, incremental=True)
+    watcher = watch.watcher(src, profile.get("watch_interval", 1))
+    print "watching %s with %s, press Ctrl+C to stop" % \
+        (src, "inotify" if watch.pyinotify else "polling")
+    pool = None
+    if jobs != 1:
+        pool = multiprocessing.Pool(jobs or None)
+    try:
+        while True:
+            changed = watcher.wait()
+            affected = [p for p in tree.paths()
+                        if [s for s in tree.get_file(p).sources if s in changed]]
+            print
+            print "%s files changed: %s" % (len(changed), ", ".join(
+                sorted(os.path.relpath(p, src) for p in changed)))
+            if affected:
+                print "affected outputs: %s" % ", ".join(affected)
+            stats = BuildStats(lambda: _worker_cpu_time[0])
+            try:
+                tree, manifest = _build_tree(profile, src, dest, keywords,
+                                             directive_vars, pool, stats, source_cache,
+                                             minify_cache=minify_cache)
+            except Exception, e:
+                # e.g. a file which is saved in the middle of an edit
+                print "build failed:", e
+                continue
+            if minify_cache:
+                with stats.stage("minify cache eviction"):
+                    minify_cache.evict()
+            if _finish_dest(profile, dest, tree, manifest, _client_lang_files(tree),
+                            tag, stats, jobs):
+                print stats.report()
+    except KeyboardInterrupt:
+        print "watch stopped"
+    finally:
+        watcher.close()
+        if pool:
+            pool.terminate()
+            pool.join()
+
+def _get_build_profile(config, name):
+    """Return the profile name merged into the default profile, or None."""
+    build_config = config.get("build", {})
+    target_profile = _get_profile(build_config.get("profiles", {}), name)
+    if target_profile == None:
+        return None
     profile = {}
     profile.update(build_config.get("default_profile", {}))
-    target_profile = _get_profile(build_config.get("profiles", {}), args.profile)
-    if target_profile == None:
-        print "abort, profile \"%s\" not found in config" % args.profile
-        return
-
     profile.update(target_profile)
-    out, err = cmd_call("hg", "identify")
-    is_git = bool(err)
-    current_branch = ""
-    if is_git:
-        git_shell = build_config.get("git-shell")
-        if git_shell:
-            shell = partial(shell_call, git_shell, filter_git_login_msg)
-        else:
-            shell = cmd_call
-            print "no 'git-shell' defined in config, using default shell"
-        cmds = GIT_COMMANDS
-        if args.tag == "tip":
-            args.tag = "HEAD"
-        print "getting status"
-        status, err = shell("git", "status")
-        if err:
-            print err
+    return profile
+
+def deps(args):
+    """Show the bundles of the directive files and their sources."""
+    if args.src:
+        src = os.path.abspath(args.src)
+        graph_path = None
+    else:
+        profile = _get_build_profile(args.config, args.profile)
+        if profile == None:
+            print "abort, profile \"%s\" not found in config" % args.profile
             return
-        if not ("nothing to commit" in status and "working directory clean" in status):
-            print status
-            print "you need a clean status to build"
+        if not profile.get("src"):
+            print "abort, missing \"src\" in the profile"
             return
-        m = _re_branch.search(status)
-        if m:
-            current_branch = m.group(1)
+        src = os.path.abspath(os.path.normpath(profile.get("src")))
+        # share the parsed files with the build
+        graph_path = profile.get("dest") and \
+            os.path.join(state_dir(os.path.abspath(profile.get("dest"))), GRAPH_NAME)
+
+    tree = BuildTree(src)
+    graph = DependencyGraph(graph_path)
+    for path in tree.paths(_directive_exts):
+        src_path = tree.get_file(path).src_path
+        graph.items(path, src_path, lambda: io.StringIO(tree.get_text(path)),
+                    tree.stat_source(src_path))
+    graph.save()
+
+    if args.reverse:
+        result = [{"file": path, "bundle": bundle, "when": when}
+                  for path, bundle, when in graph.reverse(args.reverse)]
+        if args.json:
+            json.dump(result, sys.stdout, indent=1, sort_keys=True)
+            return
+        if not result:
+            print "%s is not in any bundle" % args.reverse
+        for r in result:
+            print "%s: %s%s" % (r["file"], r["bundle"],
+                                " (if %s)" % format_when(r["when"]) if r["when"] else "")
+        return
+
+    result = graph.to_json()
+    if args.json:
+        json.dump(result, sys.stdout, indent=1, sort_keys=True)
+        return
+    for path in sorted(result):
+        print path
+        for bundle in result[path]:
+            print "    %s (%s)%s" % (bundle["bundle"], bundle["type"],
+                                    " if %s" % format_when(bundle["when"]) if "when" in bundle else "")
+            for source in bundle["sources"]:
+                print "        %s%s" % (source["path"],
+                                        " if %s" % format_when(source["when"]) if "when" in source else "")
+
+def _expand_profile_groups(build_config, names):
+    """Replace the names of the groups in "profile_groups" with their
+    profiles. A profile is only listed once."""
+    groups = build_config.get("profile_groups", {})
+    ret = []
+    for name in names:
+        for member in groups.get(name, [name]):
+            if not member in ret:
+                ret.append(member)
+    return ret
+
+def _directive_vars(profile):
+    dirvars = {}
+    if profile.get("translate"):
+        dirvars["exclude_uistrings"] = True
+    return dirvars
+
+def _build_keywords(profile, revision, tag, rev, short_hash):
+    revision_name = "%s:%s, %s, %s" % (rev, short_hash, profile.get("name"), tag)
+    return {"$dfversion$": revision, "$revdate$": revision_name}
+
+def _export_base(profile, src, dest, directive_vars, inventory, source_cache, stats):
+    """Export src without keywords for all profiles with the same source,
+    blacklist and directive vars. The files which can take keywords are
+    read here, so the sources are read once for all profiles. Returns the
+    tree and the DependencyGraph."""
+    graph = DependencyGraph(os.path.join(state_dir(dest), GRAPH_NAME))
+    with stats.stage("shared export") as record:
+        tree = export_tree(src,
+                           exclude_dirs=profile.get("copy_blacklist"),
+                           directive_vars=directive_vars,
+                           source_cache=source_cache,
+                           graph=graph,
+                           inventory=inventory)
+        for path in tree.paths(_keyword_exts):
+            tree.get_bytes(path)
+        for key in tree.counters:
+            record[key] += tree.counters[key]
+    return tree, graph
+
+def _build_profile(profile, src, dest, keywords, directive_vars, jobs, tag, rev, short_hash,
+                   stats, source_cache=None, inventory=None, minify_cache=None,
+                   base_tree=None, graph=None):
+    """Build profile to dest, create the zips and run the stages on the
+    written build, see _build_tree for the arguments. Returns the tree, or
+    None if a stage failed."""
+    pool = None
+    if jobs != 1:
+        pool = multiprocessing.Pool(jobs or None)
+        print "using %s processes" % (jobs or multiprocessing.cpu_count())
+    try:
+        tree, manifest = _build_tree(profile, src, dest, keywords, directive_vars, pool, stats,
+                                     source_cache, inventory, minify_cache, base_tree, graph)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    client_lang_files = _client_lang_files(tree)
+
+    if profile.get("create_zips"):
+        zip_dir = os.path.abspath(os.path.normpath(profile.get("zips")))
+        zip_target = os.path.join(zip_dir, "%s.%s" % (rev, short_hash))
+        if not os.path.isdir(zip_target):
+            os.makedirs(zip_target)
+
+        with stats.stage("zip") as record:
+            zip_names = []
+            for name, lang in client_lang_files:
+                files = _build_archive_files(dest, name)
+                zip_path = os.path.join(zip_target, name.replace(".xml", ".zip"))
+                if os.path.isfile(zip_path) and \
+                   not [p for p in files if not tree.get_output(p) or
+                                            not tree.get_output(p).up_to_date]:
+                    print "build for %s is up to date" % lang
+                    continue
+                zip_names.append(name)
+                record["in"] += sum(os.path.getsize(os.path.join(dest, p)) for p in files)
+
+            make_build_archives(dest, zip_target, zip_names, jobs)
+            for name in zip_names:
+                record["files"] += 1
+                record["out"] += os.path.getsize(os.path.join(zip_target, name.replace(".xml", ".zip")))
+        if zip_names:
+            print "builds zipped for %s" % ", ".join(_re_client_lang_file.match(n).group(1)
+                                                     for n in zip_names)
+
+        if profile.get("copy_zips_to_latest"):
+            latest = os.path.join(zip_dir, "latest")
+            with stats.stage("copy zips to latest"):
+                replace_dir(zip_target, latest, profile.get("link_files"))
+
+    if not _finish_dest(profile, dest, tree, manifest, client_lang_files,
+                        tag, stats, jobs):
+        return None
+
+    AUTHORS = os.path.join(src, '..', 'AUTHORS')
+    if os.path.isfile(AUTHORS):
+        shutil.copy(AUTHORS, os.path.join(dest, 'AUTHORS'))
+    return tree
+
+def _build_profile_process(name, stats_out, stats_info, kwargs):
+    """Build one profile of a multi-profile build in its own process, see
+    _build_profile. The output is printed in one block at the end, so it
+    is not mixed with the other profiles. Exits with 1 if the build
+    failed."""
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    tree = None
+    try:
+        stats = BuildStats(lambda: _worker_cpu_time[0])
+        tree = _build_profile(stats=stats, **kwargs)
+        print
+        print stats.report()
+        if stats_out:
+            stats.save(stats_out, **stats_info)
+            print "build stats written to %s" % stats_out
+    finally:
+        out = sys.stdout.getvalue()
+        sys.stdout = stdout
+        stdout.write("\nprofile %s:\n%s" % (name, out))
+        stdout.flush()
+    if not tree:
+        sys.exit(1)
+
+def _fan_out(target, arg_lists):
+    """Call target with each of arg_lists in its own process, all at the
+    same time. Returns the exit codes. The processes are not daemonic, so
+    each can have its own process pool."""
+    sys.stdout.flush()
+    processes = [multiprocessing.Process(target=target, args=args) for args in arg_lists]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+def _profile_stats_path(path, name):
+    """Insert the profile name before the extension of path."""
+    root, ext = os.path.splitext(path)
+    return "%s.%s%s" % (root, name, ext)
+
+def _log_names(log_dir):
+    """Return the names of the logs in log_dir, the oldest first."""
+    logs = sorted([(l, int(os.stat(os.path.join(log_dir, l)).st_mtime))
+                   for l in os.listdir(log_dir) if l.endswith((".html", ".log")) and
+                                                   l != changelog.INDEX_NAME],
+                   key=lambda item: item[1])
+    return [l for l, mtime in logs]
+
+def _create_log(profile, repo, is_git, tag, start_rev, rev, short_hash, stats, index=False):
+    """Write the log of start_rev..tag to the "logs" directory of profile.
+    Without start_rev the log starts at the end of the previous log. The
+    git logs are made from the commits in the LogStore of the directory,
+    with index an index of all logs is written too."""
+    log_dir = os.path.abspath(os.path.normpath(profile.get("logs")))
+    if is_git:
+        log_name = "%s.%s.html" % (tag.lower().replace("_", "-"), short_hash)
     else:
-        shell = cmd_call
-        cmds = HG_COMMANDS
+        log_name = "%s.%s.log" % (rev, short_hash)
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
 
-    out, err = shell(*cmds["update"](args.tag))
-    err = err.strip(" \n\t")
-    if err:
-        # It's expected to be in detached head state here.
-        if not ("You are in 'detached HEAD' state." in err or "HEAD is now at" in err):
-            print "abort", err
-            return
+    store = None
+    if is_git:
+        store = changelog.LogStore(os.path.join(log_dir, changelog.STORE_NAME))
+        start_rev = start_rev or store.last_end(log_name)
 
-    if out:
-        print out.strip()
-    out, err = shell(*cmds["get_hash"](args.tag))
-    if err:
-        print "abort", err
+    if not start_rev:
+        logs = _log_names(log_dir)
+        last_log = logs and logs[-1] or None
+
+        if last_log == log_name:
+            last_log = logs[-2] if len(logs) > 1 else ""
+
+        if last_log:
+            if is_git:
+                start_rev = last_log.split(".").pop(-2)
+            elif len(last_log.split(".")) == 3:
+                start_rev = last_log.split(".")[1]
+
+    if not start_rev:
+        print "not possible to find a start revision",
+        print "provide a start revision with the -l flag"
         return
 
-    print "updated to revision: ", out.strip()
     if is_git:
-        short_hash = out.strip()
-        rev = time.strftime("%Y.%m.%d", time.gmtime())
+        hashes, err = repo.rev_list(start_rev, tag)
     else:
-        rev, short_hash = out.strip().split(":", 1)
+        out, err = repo.log(start_rev, tag)
+    if err:
+        print "could not create a log\n", err
+        return
 
-    if not args.skip_build:
+    with stats.stage("log") as record:
+        if is_git:
+            read = store.read
+            count, size = changelog.write_log(os.path.join(log_dir, log_name),
+                                              store.iter_entries(repo, hashes), tag,
+                                              profile.get("url_commits"),
+                                              profile.get("bts_url"))
+            store.add_log(log_name, tag, start_rev, short_hash, count)
+            if index or profile.get("log_index"):
+                changelog.write_index(log_dir, store)
+            store.save()
+            record["files"] += 1
+            record["out"] += size
+        else:
+            record["in"] += len(out)
+            with open(os.path.join(log_dir, log_name), "w") as f:
+                if os.name == "nt":
+                    f.write(out.decode("windows-1252").encode("utf-8"))
+                else:
+                    f.write(out)
+            record["files"] += 1
+            record["out"] += len(out)
+    if is_git:
+        print "log %s created, %s commits, %s of them new" % (log_name, count, store.read - read)
+    else:
+        print "log %s created" % log_name
+
+def _add_worktree(repo, revision):
+    """Export revision to a temporary directory with 'git worktree add' or
+    'hg archive'. The working tree and the current branch are not
+    touched. Returns a tuple of the root of the repository and the
+    directory, or None."""
+    root, err = repo.root()
+    if err or not root:
+        print "abort, no repository found", err
+        return None
+    tmp = tempfile.mkdtemp(".tmp", "dfbuild.")
+    path = os.path.join(tmp, "src")
+    out, err = repo.add_worktree(revision, path)
+    if not os.path.isdir(path):
+        print "abort, could not export %s" % revision, err
+        shutil.rmtree(tmp, True)
+        return None
+    print "revision %s exported to %s" % (revision, path)
+    return os.path.realpath(os.path.normpath(root)), path
+
+def _remove_worktree(repo, worktree):
+    shutil.rmtree(os.path.dirname(worktree[1]), True)
+    repo.prune_worktrees()
+
+def _build_profiles(args, build_config, names, profiles, rev, short_hash, stats, watching,
+                    worktree=None):
+    """Build all profiles, see build. worktree is a tuple of the root of
+    the repository and of the directory the revision was exported to, the
+    "src" of the profiles is then taken from the latter. Returns None if
+    the build was aborted, otherwise the arguments for _watch_build."""
+    # (name, profile, src, dest)
+    builds = []
+    # the source of each profile is walked only once, all stages use
+    # the inventory
+    inventories = {}
+    for name, profile in zip(names, profiles):
         src = profile.get("src", None)
         dest = profile.get("dest", None)
         if not (src and dest):
-            print "abort, missing \"src\" or \"dest\" in the profile"
-            return
+            print "abort, missing \"src\" or \"dest\" in the profile \"%s\"" % name
+            return None
 
         src = os.path.abspath(os.path.normpath(src))
         dest = os.path.abspath(os.path.normpath(dest))
+        if worktree:
+            rel = os.path.relpath(os.path.realpath(src), worktree[0])
+            if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+                print "abort, \"src\" of the profile \"%s\" is not in the repository" % name
+                return None
+            src = os.path.join(worktree[1], rel)
+        if not src in inventories:
+            with stats.stage("inventory") as record:
+                inventories[src] = FileInventory(src)
+                record["files"] += len(inventories[src])
         if profile.get("verify_bom"):
-            bad = _get_bad_encoding_files(src)
+            with stats.stage("verify BOM"):
+                bad = _get_bad_encoding_files(inventories[src],
+                                              profile.get("verify_bom_strict"),
+                                              os.path.join(state_dir(dest), bomcheck.CACHE_NAME))
             if bad:
                 print "abort",
                 print "the following files do not seem to be UTF8 with BOM encoded:"
                 for b in bad: print "\t%s" % b
-                return
+                return None
 
         if os.path.isdir(dest) and not profile.get("force_overwrite"):
             print "abort",
-            print "destination exists! Set \"force_overwrite\" in the config file"
-            return
+            print "destination \"%s\" exists! Set \"force_overwrite\" in the config file" % dest
+            return None
+        builds.append((name, profile, src, dest))
+
+    # the content of the sources is kept for the rebuilds and shared
+    # by the profiles
+    source_cache = {} if watching or len(builds) > 1 else None
+    minify_cache = None
+    if build_config.get("minify_cache_dir") and [b for b in builds if b[1].get("minify")]:
+        minify_cache = MinifyCache(build_config.get("minify_cache_dir"),
+                                   build_config.get("minify_cache_size", 0),
+                                   minifier_identity(jsminify))
+
+    if len(builds) == 1:
+        name, profile, src, dest = builds[0]
+        jobs = getattr(args, "jobs", None)
+        if jobs is None:
+            jobs = profile.get("jobs", 1)
+        keywords = _build_keywords(profile, args.revision, args.tag, rev, short_hash)
+        dirvars = _directive_vars(profile)
+        tree = _build_profile(profile, src, dest, keywords, dirvars, jobs, args.tag,
+                              rev, short_hash, stats, source_cache, inventories[src],
+                              minify_cache)
+        if not tree:
+            return None
+        state = {"profile": profile, "src": src, "dest": dest, "keywords": keywords,
+                 "directive_vars": dirvars, "jobs": jobs, "tree": tree,
+                 "source_cache": source_cache, "minify_cache": minify_cache}
+    else:
+        # the export is shared by the profiles which only differ in
+        # later stages, the profile-specific stages run in parallel
+        exports = {}
+        arg_lists = []
+        for name, profile, src, dest in builds:
+            dirvars = _directive_vars(profile)
+            key = (src, tuple(profile.get("copy_blacklist") or []),
+                   tuple(sorted(dirvars.items())))
+            if not key in exports:
+                exports[key] = _export_base(profile, src, dest, dirvars, inventories[src],
+                                            source_cache, stats)
+            base_tree, graph = exports[key]
+            jobs = getattr(args, "jobs", None)
+            if jobs is None:
+                jobs = profile.get("jobs", 1)
+            if jobs == 0:
+                # all CPUs are shared by the profiles
+                jobs = max(1, multiprocessing.cpu_count() // len(builds))
+            kwargs = {"profile": profile, "src": src, "dest": dest,
+                      "keywords": _build_keywords(profile, args.revision, args.tag,
+                                                  rev, short_hash),
+                      "directive_vars": dirvars, "jobs": jobs, "tag": args.tag,
+                      "rev": rev, "short_hash": short_hash,
+                      "inventory": inventories[src], "minify_cache": minify_cache,
+                      "base_tree": base_tree, "graph": graph}
+            stats_out = getattr(args, "stats_out", None)
+            stats_out = stats_out and _profile_stats_path(stats_out, name)
+            stats_info = {"profile": profile.get("name"), "tag": args.tag,
+                          "revision": short_hash}
+            arg_lists.append((name, stats_out, stats_info, kwargs))
+        print "%s exports for %s profiles" % (len(exports), len(builds))
+
+        with stats.stage("profiles"):
+            codes = _fan_out(_build_profile_process, arg_lists)
+        failed = [b[0] for b, code in zip(builds, codes) if code]
+        if failed:
+            print "abort, the build of %s failed" % ", ".join(failed)
+            return None
+        state = {}
+
+    if minify_cache:
+        with stats.stage("minify cache eviction"):
+            minify_cache.evict()
+    return state
+
+def _vcs_backend(build_config, stats):
+    """Return the vcs backend for the repository in the current
+    directory. The commands are timed as the stage "vcs"."""
+    out, err = stats.timed("vcs", cmd_call)("hg", "identify")
+    if not err:
+        return vcs.Hg(stats.timed("vcs", cmd_call))
+    git_shell = build_config.get("git-shell")
+    if git_shell:
+        shell = partial(shell_call, git_shell, filter_git_login_msg)
+    else:
+        shell = cmd_call
+        print "no 'git-shell' defined in config, using default shell"
+    # hashes are looked up in a single cat-file process, see vcs
+    return vcs.Git(stats.timed("vcs", shell), git_shell)
 
-        revision_name = "%s:%s, %s, %s" % (rev, short_hash, profile.get("name"), args.tag)
-        dirvars = {}
-        if profile.get("translate"):
-            dirvars["exclude_uistrings"] = True
+def log(args):
+    """Write the logs of one or more ranges of revisions, see _create_log.
+    Nothing is checked out."""
+    build_config = args.config.get("build", {})
+    profile = _get_build_profile(args.config, args.profile)
+    if profile == None:
+        print "abort, profile \"%s\" not found in config" % args.profile
+        return
 
-        export(src, dest,
-               exclude_dirs=profile.get("copy_blacklist"),
-               keywords={"$dfversion$": args.revision, "$revdate$": revision_name},
-               directive_vars=dirvars)
-        print "build exported."
-        if profile.get("translate"):
-            _localize_buildout(dest,
-                               os.path.join(src, "ui-strings"),
-                               profile.get("minify"))
-            print "build translated"
+    stats = BuildStats()
+    repo = _vcs_backend(build_config, stats)
+    is_git = repo.name == "git"
+    ranges = [(args.last_revision_log, args.tag)]
+    for r in args.range:
+        if not ".." in r:
+            print "abort, a range is \"<start>..<end>\", not \"%s\"" % r
+            return
+        ranges.append(tuple(r.split("..", 1)))
 
-        if profile.get("make_data_uris"):
-            _convert_imgs_to_data_uris(dest, profile.get("minify_whitelist"))
-            # any remaining image in ui-images is not used
-            img_dir = os.path.join(dest, 'ui-images')
-            shutil.rmtree(img_dir)
-            print "data URIs created"
+    for i, (start_rev, tag) in enumerate(ranges):
+        if is_git and tag == "tip":
+            tag = "HEAD"
+        out, err = repo.get_hash(tag)
+        if err:
+            print "abort", err
+            return
+        if is_git:
+            short_hash = out.strip()
+            rev = time.strftime("%Y.%m.%d", time.gmtime())
+        else:
+            rev, short_hash = out.strip().split(":", 1)
+        # the index is written once, after the last log
+        _create_log(profile, repo, is_git, tag, start_rev, rev, short_hash, stats,
+                    args.index and i == len(ranges) - 1)
+    repo.close()
 
-        if profile.get("minify"):
-            _minify_buildout(dest, profile.get("minify_whitelist"))
-            print "builds minified"
+    print
+    print stats.report()
 
-        if profile.get("license"):
-            _add_license(dest, whitelist=profile.get("minify_whitelist"))
-            print "license added"
+def build(args):
+    build_config = args.config.get("build", {})
+    names = args.profile if isinstance(args.profile, list) else [args.profile]
+    names = _expand_profile_groups(build_config, names or ["default"])
+    profiles = []
+    for name in names:
+        profile = _get_build_profile(args.config, name)
+        if profile == None:
+            print "abort, profile \"%s\" not found in config" % name
+            return
+        profiles.append(profile)
 
-        if profile.get("suppress_warnings"):
-            _suppress_warnings(dest, profile.get("minify_whitelist"))
-            print "warnings suppressed in build."
+    watching = getattr(args, "watch", False) and not args.skip_build
+    if watching and len(profiles) > 1:
+        print "abort, --watch only works with a single profile"
+        return
 
-        client_lang_files = []
-        for item in os.listdir(dest):
-            if os.path.isfile(os.path.join(dest, item)):
-                match = _re_client_lang_file.match(item)
-                if match:
-                    client_lang_files.append((item, match.group(1)))
+    use_worktree = (getattr(args, "worktree", False) or build_config.get("worktree_builds")) \
+                   and not args.skip_build
+    if watching and use_worktree:
+        print "abort, --watch needs the checked out sources"
+        return
 
-        if profile.get("create_zips"):
-            zip_dir = os.path.abspath(os.path.normpath(profile.get("zips")))
-            zip_target = os.path.join(zip_dir, "%s.%s" % (rev, short_hash))
-            if not os.path.isdir(zip_target):
-                os.makedirs(zip_target)
+    stats = BuildStats(lambda: _worker_cpu_time[0])
+    repo = _vcs_backend(build_config, stats)
+    is_git = repo.name == "git"
+    current_branch = ""
+    if is_git and args.tag == "tip":
+        args.tag = "HEAD"
 
-            for name, lang in client_lang_files:
-                make_build_archive(dest, zip_target, name)
-                print "build for %s zipped" % lang
-
-            if profile.get("copy_zips_to_latest"):
-                latest = os.path.join(zip_dir, "latest")
-                if os.path.exists(latest):
-                    shutil.rmtree(latest)
-                shutil.copytree(zip_target, latest)
-
-        if profile.get("set_base_uri"):
-            path_segs = dest.split(os.path.sep)
-            pos = path_segs.index(profile.get("local_domain_dir_name"))
-            if pos > -1:
-                base_url = "/%s/" % "/".join(path_segs[pos + 1:])
-                base_url_tag = (_base_url % base_url).strip().encode("utf-8")
-                cmd_base_url = "<!-- command set_rel_base_url -->"
-
-                for name, lang in client_lang_files:
-                    path = os.path.join(dest, name)
-                    content = ""
-                    with open(path, 'rb') as f:
-                        content = f.read()
-                    if content:
-                        with open(path, 'wb') as f:
-                            f.write(content.replace(cmd_base_url, base_url_tag, 1))
-                    else:
-                        print "abort, could not set base URL in %s" % name
-                        return
-
-                print "base URLs set"
-            else:
-                print "abort, could not set the base URLs"
-                return
+    # the working tree is not touched if the revision is built in a
+    # worktree, it needs no clean status and several builds can run at
+    # the same time
+    if is_git and not use_worktree:
+        print "getting status"
+        status, err = repo.status()
+        if err:
+            print err
+            return
+        if not ("nothing to commit" in status and "working directory clean" in status):
+            print status
+            print "you need a clean status to build"
+            return
+        m = _re_branch.search(status)
+        if m:
+            current_branch = m.group(1)
 
-        if profile.get("create_manifests"):
-            try:
-                root = profile.get("local_domain_dir_name").encode("utf-8")
-                create_manifests(dest.encode("utf-8"), domain_token=root, tag=args.tag)
-                print "app cache manifests created"
-            except:
-                print "abort, could not create the manifest files"
+    if not use_worktree:
+        out, err = repo.update(args.tag)
+        err = err.strip(" \n\t")
+        if err:
+            # It's expected to be in detached head state here.
+            if not ("You are in 'detached HEAD' state." in err or "HEAD is now at" in err):
+                print "abort", err
                 return
 
-    if profile.get("create_log"):
-        log_dir = os.path.abspath(os.path.normpath(profile.get("logs")))
-        start_rev = args.last_revision_log
-        if is_git:
-            log_name = "%s.%s.html" % (args.tag.lower().replace("_", "-"), short_hash)
-        else:
-            log_name = "%s.%s.log" % (rev, short_hash)
-        if not os.path.isdir(log_dir):
-            os.makedirs(log_dir)
-
-        if not start_rev:
-            logs = sorted([(l, int(os.stat(os.path.join(log_dir, l)).st_mtime))
-                           for l in os.listdir(log_dir)],
-                           key=lambda item: item[1])
-            last_log = logs and logs[-1][0] or None
-
-            if last_log == log_name:
-                last_log = logs[-2][0] if len(logs) > 1 else ""
-
-            if last_log:
-                if is_git:
-                    start_rev = last_log.split(".").pop(-2)
-                elif not is_git and len(s) == 3:
-                    start_rev = last_log.split(".")[1]
-
-        if start_rev:
-            out, err = shell(*cmds["log"](start_rev, args.tag))
-            if err:
-                print "could not create a log\n", err
-            else:
-                if is_git:
-                    url_commits = profile.get("url_commits")
-                    bts_url = profile.get("bts_url")
-                    out = log2html(out, args.tag, rev, short_hash, url_commits, bts_url)
-                with open(os.path.join(log_dir, log_name), "w") as f:
-                    if not is_git and os.name == "nt":
-                        f.write(out.decode("windows-1252").encode("utf-8"))
-                    else:
-                        f.write(out)
-                    print "log %s created" % log_name
-        else:
-            print "not possible to find a start revision",
-            print "provide a start revision with the -l flag"
+        if out:
+            print out.strip()
+    out, err = repo.get_hash(args.tag)
+    if err:
+        print "abort", err
+        return
+
+    print "building revision: " if use_worktree else "updated to revision: ", out.strip()
+    if is_git:
+        short_hash = out.strip()
+        rev = time.strftime("%Y.%m.%d", time.gmtime())
+    else:
+        rev, short_hash = out.strip().split(":", 1)
 
     if not args.skip_build:
-        AUTHORS = os.path.join(src, '..', 'AUTHORS')
-        if os.path.isfile(AUTHORS):
-            shutil.copy(AUTHORS, os.path.join(dest, 'AUTHORS'))
+        worktree = None
+        if use_worktree:
+            worktree = _add_worktree(repo, short_hash)
+            if not worktree:
+                return
+        try:
+            state = _build_profiles(args, build_config, names, profiles, rev, short_hash,
+                                    stats, watching, worktree)
+        finally:
+            if worktree:
+                _remove_worktree(repo, worktree)
+        if state is None:
+            return
+
+    for profile in profiles:
+        if profile.get("create_log"):
+            _create_log(profile, repo, is_git, args.tag, args.last_revision_log, rev,
+                        short_hash, stats)
 
     tip = current_branch if is_git else "tip"
-    if tip:
+    if tip and not use_worktree:
         print "update to %s" % tip
-        out, err = shell(*cmds["update"](tip))
+        out, err = repo.update(tip)
         print err if err else out
+    repo.close()
+
+    print
+    print stats.report()
+    if getattr(args, "stats_out", None):
+        stats.save(args.stats_out, profile=", ".join(p.get("name") for p in profiles),
+                   tag=args.tag, revision=short_hash)
+        print "build stats written to %s" % args.stats_out
+
+    if watching:
+        _watch_build(tag=args.tag, **state)
 
 def setup_subparser(subparsers, config):
     subp = subparsers.add_parser('build', help="Build Dragonfly.")
     subp.add_argument('profile',
-                      nargs="?",
-                      default="default",
-                      help="""The profile to build. The profile is
-                              defined in the config file.""")
+                      nargs="*",
+                      default=["default"],
+                      help="""The profiles to build. A profile is defined
+                              in the config file, a name in
+                              "profile_groups" stands for all profiles of
+                              the group. Several profiles share the VCS
+                              update and the export and are built in
+                              parallel.""")
     subp.add_argument('--revision', '-r',
                       required=False,
                       default="",
@@ -1234,9 +2018,59 @@ def setup_subparser(subparsers, config):
                               the log is created from the previous log
                               (build recreated). If there is no log and the
                               argument is not set no log is created.""")
+    subp.add_argument('--jobs', '-j',
+                      type=int,
+                      default=None,
+                      help="""The number of processes for the per-file
+                              build stages. 0 uses all CPUs. Overrides
+                              "jobs" in the profile.""")
+    subp.add_argument('--stats-out',
+                      required=False,
+                      default=None,
+                      help="""An optional path to write the time, the
+                              number of files and the bytes of each build
+                              stage to, as JSON. With several profiles the
+                              stats of each profile are written next to it,
+                              with the profile name before the
+                              extension.""")
+    subp.add_argument('--watch', '-w',
+                      action="store_true",
+                      default=False,
+                      help="""Keep watching "src" after the build and
+                              rebuild the outputs which depend on the
+                              changed files. Uses pyinotify if it is
+                              installed, otherwise polls every
+                              "watch_interval" seconds.""")
+    subp.add_argument('--worktree',
+                      action="store_true",
+                      default=False,
+                      help="""Build the tag from a temporary git worktree
+                              or hg archive instead of checking it out.
+                              The working tree needs no clean status and
+                              several builds can run at the same time.
+                              See "worktree_builds" in the config.""")
     subp.set_defaults(skip_build=False)
     subp.set_defaults(func=build)
 
+    subp = subparsers.add_parser('deps', help="Show the bundles of the concat directives.")
+    subp.add_argument('profile',
+                      nargs="?",
+                      default="default",
+                      help="""The profile to take "src" from. The graph is
+                              shared with the builds into "dest".""")
+    subp.add_argument('--src', '-s',
+                      default=None,
+                      help="""A source path to use instead of the profile.""")
+    subp.add_argument('--reverse', '-r',
+                      default=None,
+                      help="""Show the bundles which include this source
+                              path, relative to "src".""")
+    subp.add_argument('--json',
+                      action="store_true",
+                      default=False,
+                      help="""Print the result as JSON.""")
+    subp.set_defaults(func=deps)
+
     subp = subparsers.add_parser('fixBOM', help="Add a BOM in all JS source files.")
     subp.add_argument('src', help="""The source path.""")
     subp.set_defaults(func=fix_bom)
@@ -1245,8 +2079,17 @@ def setup_subparser(subparsers, config):
     subp.add_argument('tag', help="""Start revision.""")
     subp.add_argument('last_revision_log', help="""End revision.""")
     subp.add_argument('profile', help="""The profile to or the log.""")
-    subp.set_defaults(skip_build=True)
-    subp.set_defaults(func=build)
+    subp.add_argument('--range', '-R',
+                      action="append",
+                      default=[],
+                      help="""A further range "<start>..<end>" to write
+                              a log for. Can be given more than once.""")
+    subp.add_argument('--index', '-i',
+                      action="store_true",
+                      default=False,
+                      help="""Also write an index of all logs in the
+                              "logs" directory.""")
+    subp.set_defaults(func=log)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,188 @@
+"""Persisted record of a build, used for incremental builds.
+
+The manifest is written to the state directory of a build, next to its
+destination, so it is not deployed with the outputs. It maps each output
+file to the hashes of the source files it was created from and to the
+keywords which were substituted in it. It also keeps a digest of the profile
+settings. The next build into the same destination only regenerates the
+outputs whose sources, keywords or settings changed.
+"""
+
+import os
+import json
+import hashlib
+from fileinventory import FileInventory
+
+MANIFEST_NAME = ".df2-build.json"
+VERSION = 1
+
+# appended to the destination for the directory of the files which the
+# build keeps between runs: the manifest, the dependency graph and the
+# encoding cache
+STATE_SUFFIX = ".df2-state"
+
+# profile settings which change the content of the outputs
+SETTINGS = ["copy_blacklist", "translate", "make_data_uris",
+            "data_uri_max_size", "data_uri_max_refs", "minify",
+            "minify_whitelist", "mangle", "license", "suppress_warnings",
+            "set_base_uri", "local_domain_dir_name", "create_manifests",
+            "fingerprint_bundles", "source_maps", "source_map_root"]
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), ""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def settings_digest(profile, extra=()):
+    """Return a digest of the settings of profile which have an effect on
+    the outputs. extra is a list of further values to take into account,
+    e.g. the identity of the minifier."""
+    settings = [(key, profile.get(key)) for key in SETTINGS]
+    settings.extend(extra)
+    return hashlib.sha1(json.dumps(settings, sort_keys=True)).hexdigest()
+
+def state_dir(dest):
+    """Return the state directory of a build into dest."""
+    return os.path.normpath(dest) + STATE_SUFFIX
+
+class BuildManifest(object):
+
+    def __init__(self, dest, settings, inventory=None):
+        self.dest = dest
+        self.path = os.path.join(state_dir(dest), MANIFEST_NAME)
+        self.settings = settings
+        # the FileInventory of the source, used instead of stat'ing the
+        # sources one by one
+        self.inventory = inventory
+        # the FileInventory of the destination before the build
+        self._dest_inventory = None
+        # path: [hash, size, mtime] of the sources of the last build
+        self._last_sources = {}
+        # path: record of the outputs of the last build
+        self._last_outputs = {}
+        # the same, also if the settings changed since then
+        self._previous_outputs = {}
+        self.sources = {}
+        self.outputs = {}
+        # path: [size, mtime, hash] of the outputs with a .gz sibling
+        self.gzipped = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = json.load(f)
+        except ValueError:
+            print "invalid build manifest %s, doing a full build" % self.path
+            return
+        if data.get("version") == VERSION:
+            self._previous_outputs = data.get("outputs", {})
+            self.gzipped = data.get("gzipped", {})
+            if data.get("settings") == self.settings:
+                self._last_sources = data.get("sources", {})
+                self._last_outputs = self._previous_outputs
+
+    def source_hash(self, path):
+        """Return the content hash of the source file at path, or None if
+        it does not exist. Files with the same size and mtime as in the last
+        build are not read again."""
+        if path in self.sources:
+            return self.sources[path][0]
+        st = self.inventory and self.inventory.stat(path)
+        if not st:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            st = (st.st_size, st.st_mtime)
+        last = self._last_sources.get(path)
+        if last and last[1:] == list(st):
+            digest = last[0]
+        else:
+            digest = file_hash(path)
+        self.sources[path] = [digest] + list(st)
+        return digest
+
+    def _stat_output(self, path):
+        """Return [size, mtime] of the output path as it is now."""
+        try:
+            st = os.stat(os.path.join(self.dest, path))
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime]
+
+    def is_up_to_date(self, build_file):
+        record = self._last_outputs.get(build_file.path)
+        if not record:
+            return False
+        if not record["keywords"] == build_file.keywords:
+            return False
+        if [s for s in build_file.sources if not s in record["sources"]]:
+            return False
+        for path, digest in record["sources"].items():
+            if not self.source_hash(path) == digest:
+                return False
+        if not self._dest_inventory:
+            self._dest_inventory = FileInventory(self.dest)
+        st = self._dest_inventory.stat(record.get("output", build_file.path))
+        return bool(st) and record["stat"] == list(st)
+
+    def mark_up_to_date(self, tree):
+        """Flag all files in tree which are still valid in the destination.
+        Returns the number of flagged files."""
+        count = 0
+        for path in tree.paths():
+            f = tree.get_file(path)
+            f.up_to_date = self.is_up_to_date(f)
+            if f.up_to_date:
+                record = self._last_outputs[path]
+                # the sources which are only known after later stages
+                tree.add_sources(path, record["sources"].keys())
+                if "output" in record:
+                    tree.set_name(path, record["output"])
+                count += 1
+        return count
+
+    def update(self, tree):
+        """Record the outputs of tree. Must be called after the outputs
+        are written and all stages which touch the destination are done."""
+        self.outputs = {}
+        for path in tree.paths():
+            f = tree.get_file(path)
+            self.outputs[path] = {"sources": dict((s, self.source_hash(s)) for s in f.sources),
+                                  "keywords": f.keywords,
+                                  "stat": self._stat_output(f.name or path)}
+            if f.name:
+                self.outputs[path]["output"] = f.name
+
+    def remove_stale_outputs(self, tree):
+        """Remove the outputs of the last build from the destination which
+        tree does not write any more, e.g. a bundle with an old content
+        hash in its name. Returns the removed paths."""
+        outputs = set(tree.output_path(p) for p in tree.paths())
+        removed = []
+        for path, record in sorted(self._previous_outputs.items()):
+            output = record.get("output", path)
+            if not output in outputs and os.path.isfile(os.path.join(self.dest, output)):
+                os.unlink(os.path.join(self.dest, output))
+                removed.append(output)
+        return removed
+
+    def save(self):
+        sources = {}
+        for record in self.outputs.values():
+            for path in record["sources"]:
+                if path in self.sources:
+                    sources[path] = self.sources[path]
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "wb") as f:
+            json.dump({"version": VERSION,
+                       "settings": self.settings,
+                       "sources": sources,
+                       "outputs": self.outputs,
+                       "gzipped": self.gzipped}, f, indent=1, sort_keys=True)
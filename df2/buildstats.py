@@ -0,0 +1,110 @@
+"""Timing and throughput of the stages of a build.
+
+Each stage records the wall time, the CPU time, the number of files it
+changed or wrote and the bytes which went in and out. The numbers of the
+per-file stages are taken from the counters of the build tree, other stages
+set them on the record. A stage which runs more than once, e.g. the VCS
+calls, sums up.
+"""
+
+import os
+import json
+import time
+from contextlib import contextmanager
+
+# tree counters which are reported per stage
+COUNTERS = ["files", "read", "in", "out"]
+
+def _cpu_time():
+    t = os.times()
+    # includes the subprocesses which were waited for, e.g. git or hg
+    return t[0] + t[1] + t[2] + t[3]
+
+def _format_bytes(count):
+    if count < 1024:
+        return "%d B" % count
+    for unit in ["KB", "MB"]:
+        count /= 1024.0
+        if count < 1024:
+            return "%.1f %s" % (count, unit)
+    return "%.1f GB" % (count / 1024.0)
+
+class BuildStats(object):
+
+    def __init__(self, worker_cpu_time=None):
+        # returns the CPU time spent in the workers of a process pool so far
+        self._worker_cpu_time = worker_cpu_time or (lambda: 0.0)
+        self.stages = []
+        self._records = {}
+        self.start = time.time()
+
+    def _cpu(self):
+        return _cpu_time() + self._worker_cpu_time()
+
+    def _record(self, name):
+        record = self._records.get(name)
+        if not record:
+            record = {"stage": name, "wall": 0.0, "cpu": 0.0, "calls": 0}
+            for key in COUNTERS:
+                record[key] = 0
+            self._records[name] = record
+            self.stages.append(record)
+        return record
+
+    @contextmanager
+    def stage(self, name, tree=None):
+        """Time the block as stage name. If tree is set, the files and
+        bytes are taken from the counters of the tree. The block gets the
+        record and can add to the counters itself."""
+        record = self._record(name)
+        counters = dict(tree.counters) if tree else None
+        wall = time.time()
+        cpu = self._cpu()
+        try:
+            yield record
+        finally:
+            record["wall"] += time.time() - wall
+            record["cpu"] += self._cpu() - cpu
+            record["calls"] += 1
+            if counters:
+                for key in COUNTERS:
+                    record[key] += tree.counters[key] - counters[key]
+
+    def timed(self, name, fn):
+        """Wrap fn, all calls are timed as stage name."""
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def total(self):
+        return time.time() - self.start
+
+    def report(self):
+        """Return the stages as a table."""
+        header = ("stage", "wall s", "cpu s", "files", "read", "in", "out")
+        rows = [header]
+        for r in self.stages:
+            rows.append((r["stage"], "%.2f" % r["wall"], "%.2f" % r["cpu"],
+                         str(r["files"]), _format_bytes(r["read"]),
+                         _format_bytes(r["in"]), _format_bytes(r["out"])))
+        rows.append(("total", "%.2f" % self.total(), "", "", "", "", ""))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = []
+        for i, row in enumerate(rows):
+            cells = [row[0].ljust(widths[0])]
+            cells.extend(cell.rjust(width) for cell, width in zip(row[1:], widths[1:]))
+            lines.append("  ".join(cells).rstrip())
+            if i == 0 or i == len(rows) - 2:
+                lines.append("-" * len(lines[0]))
+        return "\n".join(lines)
+
+    def save(self, path, **info):
+        """Write the stages as JSON to path. info is added to the top level,
+        e.g. the profile and the tag of the build."""
+        data = dict(info)
+        data["time"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.start))
+        data["total"] = self.total()
+        data["stages"] = self.stages
+        with open(path, "wb") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
@@ -0,0 +1,352 @@
+"""In-memory view of a Dragonfly build.
+
+The build stages used to copy the whole source to a temporary directory and
+rewrite the files there through temp files, once per stage. A BuildTree keeps
+a record for each file of the build instead. A file is read from the source
+at most once, the stages transform its content in memory and the tree is
+written to the destination in a single pass at the end. Files which no stage
+touched are copied straight from the source.
+"""
+
+import os
+import sys
+import copy
+import codecs
+import shutil
+from fileinventory import FileInventory, in_whitelist
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# from linux/fs.h
+FICLONE = 0x40049409
+
+# (source device, destination device): True if reflinks work between them
+_reflink_support = {}
+
+def _reflink(src, dst):
+    """Clone src to dst with the FICLONE ioctl. The clone shares the data
+    blocks with src, but is a separate file. Returns False if the file
+    system does not support it."""
+    if not fcntl or not sys.platform.startswith("linux"):
+        return False
+    key = (os.stat(src).st_dev, os.stat(os.path.dirname(dst)).st_dev)
+    if _reflink_support.get(key) is False:
+        return False
+    try:
+        with open(src, "rb") as fsrc:
+            with open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (IOError, OSError):
+        _reflink_support[key] = False
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        return False
+    _reflink_support[key] = True
+    shutil.copystat(src, dst)
+    return True
+
+def link_file(src, dst, hardlink=False):
+    """Make the content of src available at dst without copying the data,
+    if possible. Tries a reflink first, then a hardlink if hardlink is
+    set, and falls back to a copy. An existing dst is unlinked first, so
+    nothing is ever written through an old link. Returns "reflink",
+    "hardlink" or "copy"."""
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    if _reflink(src, dst):
+        return "reflink"
+    if hardlink and hasattr(os, "link"):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+def link_tree(src, dst, hardlink=False):
+    """Recreate the directory src at dst, see link_file."""
+    for base, dirs, files in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(base, src))
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        for name in files:
+            link_file(os.path.join(base, name), os.path.join(target_dir, name), hardlink)
+
+def replace_dir(src, target, hardlink=False):
+    """Replace the directory target with a linked copy of src. The copy is
+    made next to target and swapped in with renames, so target is never
+    seen half written."""
+    parent = os.path.dirname(os.path.abspath(target))
+    name = os.path.basename(target)
+    tmp = os.path.join(parent, ".%s.new" % name)
+    old = os.path.join(parent, ".%s.old" % name)
+    for path in [tmp, old]:
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    link_tree(src, tmp, hardlink)
+    if os.path.exists(target):
+        os.rename(target, old)
+    os.rename(tmp, target)
+    if os.path.exists(old):
+        shutil.rmtree(old)
+
+def normpath(path):
+    """Normalize a build relative path. Paths in the directives use "/"."""
+    return os.path.normpath(path.replace("/", os.sep))
+
+def _size(content):
+    if isinstance(content, unicode):
+        return len(codecs.BOM_UTF8) + len(content.encode("utf-8"))
+    return len(content)
+
+class BuildFile(object):
+
+    def __init__(self, path, src_path=None, content=None):
+        # the path relative to the build root
+        self.path = path
+        # the absolute path of the file in the source, if any
+        self.src_path = src_path
+        # unicode for text files, str for binary files, None if not read yet
+        self.content = content
+        # True if the content differs from the file at src_path
+        self.dirty = src_path is None
+        # absolute paths of all files the content was created from
+        self.sources = [src_path] if src_path else []
+        # the keywords which were substituted in the content
+        self.keywords = {}
+        # the path in the destination, if it is not path, e.g. a name with
+        # a content hash
+        self.name = None
+        # True if the file in the destination is still valid, see
+        # buildmanifest
+        self.up_to_date = False
+        # the sourcemap.LineMap of a script made from other files, e.g. a
+        # bundle, None if there is none
+        self.line_map = None
+
+    def encoded(self):
+        if isinstance(self.content, unicode):
+            return codecs.BOM_UTF8 + self.content.encode("utf-8")
+        return self.content
+
+class BuildTree(object):
+
+    def __init__(self, src=None, source_cache=None, inventory=None):
+        self.src = src and os.path.abspath(src)
+        # the FileInventory of src, made if not passed in
+        self.inventory = inventory
+        # src_path: [size, mtime, content] of the files read by an earlier
+        # tree, e.g. in watch mode. Unchanged files are not read again.
+        self.source_cache = source_cache
+        self._files = {}
+        self._removed_dirs = []
+        # files: files changed or written, read: bytes read from the source,
+        # in and out: bytes of the content before and after a change, out
+        # also counts the bytes written, see buildstats
+        self.counters = {"files": 0, "read": 0, "in": 0, "out": 0}
+        if self.src:
+            self._scan()
+
+    def _scan(self):
+        if not self.inventory:
+            self.inventory = FileInventory(self.src)
+        for path in self.inventory:
+            self._files[path] = BuildFile(path, self.inventory.abspath(path))
+
+    def copy(self):
+        """Return a tree with a copy of each file, e.g. to build another
+        profile from the same export. The content is shared, the stages
+        only ever replace it."""
+        tree = BuildTree(source_cache=self.source_cache, inventory=self.inventory)
+        tree.src = self.src
+        tree._removed_dirs = list(self._removed_dirs)
+        for path, f in self._files.iteritems():
+            f = copy.copy(f)
+            f.sources = list(f.sources)
+            f.keywords = dict(f.keywords)
+            tree._files[path] = f
+        return tree
+
+    def __contains__(self, path):
+        return normpath(path) in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def paths(self, exts=None, whitelist=None):
+        """Return a sorted list of the paths in the tree, optionally only
+        the ones with an extension in exts. If whitelist is set, all
+        directories of a path must be listed in it, files in the root are
+        always included.
+        """
+        ret = []
+        for path in sorted(self._files):
+            if exts and not path.endswith(exts):
+                continue
+            if whitelist and not in_whitelist(path, whitelist):
+                continue
+            ret.append(path)
+        return ret
+
+    def stale_paths(self, exts=None, whitelist=None):
+        """Like paths, but without the files which are up to date in the
+        destination."""
+        return [p for p in self.paths(exts, whitelist) if not self._files[p].up_to_date]
+
+    def find_source(self, src_path):
+        """Return the path of the file which was read from src_path."""
+        for path, f in self._files.iteritems():
+            if f.src_path == src_path:
+                return path
+        return None
+
+    def get_file(self, path):
+        return self._files[normpath(path)]
+
+    def output_path(self, path):
+        """Return the path in the destination of the file at path."""
+        f = self.get_file(path)
+        return f.name or f.path
+
+    def get_output(self, output_path):
+        """Return the file which is written to output_path, or None."""
+        output_path = normpath(output_path)
+        f = self._files.get(output_path)
+        if f and not f.name:
+            return f
+        for f in self._files.itervalues():
+            if f.name == output_path:
+                return f
+        return None
+
+    def set_name(self, path, name):
+        """Write the file at path to name in the destination."""
+        self.get_file(path).name = normpath(name)
+
+    def get_bytes(self, path):
+        f = self.get_file(path)
+        if f.content is None:
+            f.content = self._read_source(f.src_path)
+        if isinstance(f.content, unicode):
+            return f.encoded()
+        return f.content
+
+    def _read_source(self, src_path):
+        if self.source_cache is not None:
+            st = self.stat_source(src_path)
+            cached = self.source_cache.get(src_path)
+            if cached and cached[:2] == st:
+                return cached[2]
+        with open(src_path, "rb") as fp:
+            content = fp.read()
+        self.counters["read"] += len(content)
+        if self.source_cache is not None:
+            self.source_cache[src_path] = st + [content]
+        return content
+
+    def stat_source(self, src_path):
+        """Return [size, mtime] of the source file src_path."""
+        st = self.inventory and self.inventory.stat(src_path)
+        if st:
+            return list(st)
+        st = os.stat(src_path)
+        return [st.st_size, st.st_mtime]
+
+    def get_text(self, path):
+        """Return the content of a file as unicode. The file is decoded as
+        UTF-8, an optional BOM is stripped."""
+        f = self.get_file(path)
+        if not isinstance(f.content, unicode):
+            f.content = self.get_bytes(path).decode("utf_8_sig")
+        return f.content
+
+    def set_text(self, path, text):
+        """Set the content of a file. Text files are written with a BOM."""
+        path = normpath(path)
+        f = self._files.get(path)
+        if f:
+            if f.content is not None:
+                self.counters["in"] += _size(f.content)
+            f.content = text
+            f.dirty = True
+        else:
+            self._files[path] = BuildFile(path, content=text)
+        self.counters["files"] += 1
+        self.counters["out"] += _size(text)
+
+    def add_sources(self, path, src_paths, keywords={}):
+        """Record that the file at path was also created from src_paths."""
+        f = self.get_file(path)
+        for src_path in src_paths:
+            if not src_path in f.sources:
+                f.sources.append(src_path)
+        f.keywords.update(keywords)
+
+    def derive(self, path, from_paths):
+        """Record that the file at path was created from the files at
+        from_paths in the tree."""
+        for from_path in from_paths:
+            f = self.get_file(from_path)
+            self.add_sources(path, f.sources, f.keywords)
+
+    def remove(self, path):
+        del self._files[normpath(path)]
+
+    def remove_dir(self, path, keep=()):
+        """Remove all files below path, except the ones in keep. Files below
+        path which are not in the tree will also be removed from the
+        destination when the tree is written."""
+        path = normpath(path)
+        prefix = path + os.sep
+        keep = set(normpath(p) for p in keep)
+        for p in [p for p in self._files if p.startswith(prefix) and not p in keep]:
+            del self._files[p]
+        self._removed_dirs.append(path)
+
+    def write(self, dst, hardlink=False):
+        """Write the tree to the directory dst. Existing files are
+        clobbered, files which are up to date are not written again. Files
+        which no stage changed are linked to the source if possible, see
+        link_file. Returns a dict with the number of files per method."""
+        counts = {"write": 0, "reflink": 0, "hardlink": 0, "copy": 0}
+        dst = os.path.abspath(dst)
+        outputs = set(f.name or f.path for f in self._files.itervalues())
+        for path in self._removed_dirs:
+            target = os.path.join(dst, path)
+            for base, dirs, files in os.walk(target, topdown=False):
+                for name in files:
+                    p = os.path.join(base, name)
+                    if not os.path.relpath(p, dst) in outputs:
+                        os.unlink(p)
+                if not os.listdir(base):
+                    os.rmdir(base)
+
+        dirs = set()
+        for path in sorted(self._files):
+            f = self._files[path]
+            if f.up_to_date:
+                continue
+            target = os.path.join(dst, f.name or path)
+            dirname = os.path.dirname(target)
+            if not dirname in dirs:
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                dirs.add(dirname)
+            if f.dirty:
+                # the old file may be a link to a source file
+                if os.path.lexists(target):
+                    os.unlink(target)
+                content = f.encoded()
+                with open(target, "wb") as fp:
+                    fp.write(content)
+                counts["write"] += 1
+                self.counters["out"] += len(content)
+            else:
+                counts[link_file(f.src_path, target, hardlink)] += 1
+                self.counters["out"] += os.path.getsize(target)
+            self.counters["files"] += 1
+        return counts
@@ -0,0 +1,287 @@
+"""The HTML changelogs of the git builds.
+
+The changelog of a build lists the commits since the previous build. The
+commits of a range are listed with 'git rev-list', a commit which is not in
+the store yet is read through the cat-file process of the vcs backend and
+parsed once. The store is a file in the log directory with the parsed
+commits by hash and the logs which were written, the latter also give the
+start of the next log. A build only appends its new records to it. The rows are written to the file as they are made,
+a long range does not build the whole page in memory.
+"""
+
+import os
+import re
+import json
+import time
+from functools import partial
+
+STORE_NAME = ".df2-log-entries.jsonl"
+# the store of the older builds, read once and replaced
+OLD_STORE_NAME = ".df2-log-entries.json"
+INDEX_NAME = "index.html"
+VERSION = 2
+
+_re_bts_dfl = re.compile(r"DFL-\d*")
+
+LOG_BODY = """<!doctype html>
+<title>%s</title>
+<meta charset=utf-8>
+<style>
+html, body
+{
+    font: menu;
+    padding: 0;
+    margin: 0;
+}
+h2
+{
+    padding: 0 10px;
+    font-weight: normal;
+}
+table
+{
+    border-collapse: collapse;
+    width: 100%%;
+}
+td
+{
+    padding: 2px 10px;
+    border: 1px solid hsl(0, 0%%, 90%%);
+    border-width: 1px 0;
+    vertical-align: text-top;
+}
+td:first-child
+{
+    white-space: pre;
+}
+a
+{
+    text-decoration: none;
+    font-family: monospace;
+    color: #05F;
+}
+a:hover
+{
+   text-decoration: underline;
+}
+.right-aligned
+{
+    float: right;
+}
+</style>
+<h2>%s</h2>
+<table>%s</table>"""
+
+LOG_H2 = """%s <span class="right-aligned">%s</span> """
+LOG_A = """<a href="%s">%s</a>"""
+
+# LOG_LINE % (author, url_commit, hash, summary, date)
+LOG_LINE = """<tr>
+    <td>%s</td>
+    <td><a href="%s">%s</a></td>
+    <td>%s</td>
+    <td>%s</td>
+</tr>
+"""
+
+# INDEX_LINE % (log name, tag, short hash, number of commits, date)
+INDEX_LINE = """<tr>
+    <td><a href="%s">%s</a></td>
+    <td>%s</td>
+    <td>%s commits</td>
+    <td>%s</td>
+</tr>
+"""
+
+class LogEntry(object):
+
+    def __init__(self):
+        self.hash = ""
+        self.shorthash = ""
+        self.author = ""
+        self.email = ""
+        self.date = ""
+        self.subject = ""
+
+def parse_commit(commit_hash, raw):
+    """Return a LogEntry for the raw commit object, as 'git log' with
+    the format of the build would show it."""
+    entry = LogEntry()
+    entry.hash = commit_hash
+    entry.shorthash = commit_hash[0:12]
+    headers, message = (raw.split("\n\n", 1) + [""])[:2]
+    for line in headers.split("\n"):
+        if line.startswith("author "):
+            ident, timestamp, tz = line[len("author "):].rsplit(" ", 2)
+            if "<" in ident:
+                author, email = ident.split("<", 1)
+                entry.author = author.strip().decode("utf-8", "replace")
+                entry.email = email.strip(">").decode("utf-8", "replace")
+            else:
+                entry.author = ident.strip().decode("utf-8", "replace")
+            # --date=short is the day in the time zone of the author
+            offset = (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60) * (-1 if tz[0] == "-" else 1)
+            entry.date = time.strftime("%Y-%m-%d", time.gmtime(int(timestamp) + offset))
+    # the subject is the first paragraph in one line
+    paragraph = message.strip("\n").split("\n\n", 1)[0]
+    entry.subject = " ".join(l.strip() for l in paragraph.split("\n")).decode("utf-8", "replace")
+    return entry
+
+class LogStore(object):
+    """The parsed commits and the written logs. The file has a JSON value
+    per line, the version first, then a ["commit", hash, author, email,
+    date, subject] or a ["log", name, log] per record. A later record of
+    the same log replaces the earlier one. save() only appends the records
+    which are new since the store was loaded."""
+
+    def __init__(self, path):
+        self.path = path
+        # hash: [author, email, date, subject]
+        self.entries = {}
+        # log name: {"tag", "start", "end", "count", "time"}
+        self.logs = {}
+        self.read = 0
+        # the records to append on save
+        self._new = []
+        # False if the file must be written again as a whole
+        self._appendable = False
+        if os.path.isfile(path):
+            self._load()
+        elif os.path.isfile(os.path.join(os.path.dirname(path), OLD_STORE_NAME)):
+            self._load_old(os.path.join(os.path.dirname(path), OLD_STORE_NAME))
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            lines = f.read().split("\n")
+        try:
+            if json.loads(lines[0]) != {"version": VERSION}:
+                return
+        except ValueError:
+            return
+        # the last line is empty unless a save was interrupted
+        self._appendable = not lines[-1]
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self._appendable = False
+                continue
+            if record[0] == "commit":
+                self.entries[record[1]] = record[2:]
+            elif record[0] == "log":
+                self.logs[record[1]] = record[2]
+
+    def _load_old(self, path):
+        """Read the store of the older builds, one JSON object."""
+        try:
+            with open(path, "rb") as f:
+                data = json.load(f)
+        except ValueError:
+            return
+        if data.get("version") == 1:
+            self.entries = data.get("entries", {})
+            self.logs = data.get("logs", {})
+
+    def get(self, repo, commit_hash):
+        """Return the LogEntry of commit_hash, read from repo if it is not
+        in the store."""
+        if commit_hash in self.entries:
+            entry = LogEntry()
+            entry.hash = commit_hash
+            entry.shorthash = commit_hash[0:12]
+            entry.author, entry.email, entry.date, entry.subject = self.entries[commit_hash]
+            return entry
+        obj = repo.read(commit_hash)
+        if not obj or obj[0] != "commit":
+            return None
+        entry = parse_commit(commit_hash, obj[1])
+        self.entries[commit_hash] = [entry.author, entry.email, entry.date, entry.subject]
+        self._new.append(["commit", commit_hash] + self.entries[commit_hash])
+        self.read += 1
+        return entry
+
+    def iter_entries(self, repo, hashes):
+        for commit_hash in hashes:
+            entry = self.get(repo, commit_hash)
+            if entry:
+                yield entry
+
+    def add_log(self, name, tag, start, end, count):
+        self.logs[name] = {"tag": tag, "start": start, "end": end, "count": count,
+                           "time": time.time()}
+        self._new.append(["log", name, self.logs[name]])
+
+    def last_end(self, exclude=None):
+        """Return the end revision of the last written log, not counting
+        the log exclude, or None."""
+        logs = sorted((log["time"], name) for name, log in self.logs.iteritems()
+                      if name != exclude)
+        if not logs:
+            return None
+        return self.logs[logs[-1][1]]["end"]
+
+    def save(self):
+        if self._appendable:
+            records = self._new
+            mode = "ab"
+        else:
+            records = [["commit", h] + e for h, e in sorted(self.entries.iteritems())]
+            records.extend(["log", n, l] for n, l in sorted(self.logs.iteritems()))
+            mode = "wb"
+        with open(self.path, mode) as f:
+            if mode == "wb":
+                f.write(json.dumps({"version": VERSION}) + "\n")
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+        self._new = []
+        self._appendable = True
+        old_path = os.path.join(os.path.dirname(self.path), OLD_STORE_NAME)
+        if os.path.isfile(old_path):
+            os.unlink(old_path)
+
+def _dfl_bug2link(bts_url, match):
+    url = bts_url % match.group(0)
+    return LOG_A % (url, match.group(0))
+
+def escape_html(str):
+    return str.replace("&", "&amp;").replace("<" , "&lt;")
+
+def _log_line(entry, url_commits, to_bts_link):
+    url = url_commits % entry.shorthash
+    subject = escape_html(entry.subject)
+    if to_bts_link:
+        subject = _re_bts_dfl.sub(to_bts_link, subject)
+    return LOG_LINE % (entry.author, url, entry.shorthash, subject, entry.date)
+
+def _log_h2(tag, url_commits, to_bts_link):
+    m = _re_bts_dfl.search(tag)
+    return LOG_H2 % (LOG_A % (url_commits % tag, tag), to_bts_link(m) if m and to_bts_link else "")
+
+def _encode(text):
+    return text.encode("utf-8") if isinstance(text, unicode) else text
+
+def write_log(path, entries, tag, url_commits, bts_url):
+    """Write the page for the LogEntry items of entries to path. Returns
+    the number of entries and the bytes written."""
+    to_bts_link = partial(_dfl_bug2link, bts_url) if bts_url else None
+    head, tail = LOG_BODY.split("%s</table>")
+    count = 0
+    with open(path, "wb") as f:
+        f.write(_encode(head % (tag, _log_h2(tag, url_commits, to_bts_link))))
+        for entry in entries:
+            f.write(_encode(_log_line(entry, url_commits, to_bts_link)))
+            count += 1
+        f.write("</table>" + tail)
+    return count, os.path.getsize(path)
+
+def write_index(log_dir, store):
+    """Write an index of the logs in the store to log_dir, the newest
+    first."""
+    logs = sorted(store.logs.iteritems(), key=lambda item: item[1]["time"], reverse=True)
+    rows = [INDEX_LINE % (name, escape_html(log["tag"]), log["end"], log["count"],
+                          time.strftime("%Y-%m-%d", time.gmtime(log["time"])))
+            for name, log in logs if os.path.isfile(os.path.join(log_dir, name))]
+    with open(os.path.join(log_dir, INDEX_NAME), "wb") as f:
+        f.write(_encode(LOG_BODY % ("Changelogs", "Changelogs", "".join(rows))))
@@ -0,0 +1,244 @@
+"""The dependency graph of the concat directives.
+
+The client files (and any other .xml or .html file) can contain directives
+like
+
+    <!-- command concat_js script/dragonfly.js -->
+    <script src="scripts/a.js"/>
+    <!-- command concat_js off if exclude_uistrings -->
+
+which concatenate the following scripts or stylesheets into a bundle. A
+directive file is parsed into a list of items once, the items are kept in
+a DependencyGraph together with the size and mtime of the file. Unchanged
+files are not parsed again on the next run. evaluate() applies the items
+for a given set of variables, bundles() lists the bundles and their
+sources for all possible values of the conditions.
+"""
+
+import os
+import re
+import json
+import itertools
+
+GRAPH_NAME = ".df2-deps.json"
+VERSION = 1
+
+SCRIPT_ELE = u"<script src=\"%s\"/>\n"
+STYLE_ELE = u"<link rel=\"stylesheet\" href=\"%s\"/>\n"
+BASE_URL = u"<base href=\"%s\" />\n"
+
+_re_command = re.compile("""\s?<!--\s+command\s+(?P<command>\w+)\s+"?(?P<target>.*?)"?\s*(?:if\s+(?P<neg>not)?\s*(?P<cond>\S+?))?\s*-->""")
+_re_comment = re.compile("""\s*<!--.*-->\s*""")
+_re_script = re.compile("\s?<script +src=\"(?P<src>[^\"]*)\"")
+_re_css = re.compile("\s?<link +rel=\"stylesheet\" +href=\"(?P<href>[^\"]*)\"/>")
+
+def parse(lines):
+    """Parse the lines of a directive file into a list of items:
+
+        ["cmd", line, command, target, neg, cond]
+        ["css", line, href]
+        ["js", line, src]
+        ["text", line]
+
+    Comments and empty lines are dropped, they are never written."""
+    items = []
+    for line in lines:
+        match_cmd = _re_command.search(line)
+        if match_cmd:
+            items.append(["cmd", line] + list(match_cmd.groups()))
+        elif _re_comment.search(line) or line.isspace():
+            continue
+        else:
+            match_css = _re_css.search(line)
+            match_js = _re_script.search(line)
+            if match_css:
+                items.append(["css", line, match_css.group("href")])
+            elif match_js:
+                items.append(["js", line, match_js.group("src")])
+            else:
+                items.append(["text", line])
+    return items
+
+def evaluate(items, vars):
+    """Apply the directives in items with the variables vars. Returns the
+    output lines and a list of (bundle, [(index, source), ...]) in the
+    order of the bundles in the file. index is the index of the item of the
+    source.
+
+    TODO: Refactor this to use separate functions for each directive and
+    just pass in a context for it to keep stuff in.
+    """
+    out = []
+    bundles = []
+    known_files = {}
+    current_css_file = None
+    current_js_file = None
+    for index, item in enumerate(items):
+        kind, line = item[0], item[1]
+        if kind == "cmd":
+            cmd, target, neg, cond = item[2:]
+            if cond: # check if this directive is conditional
+                c = bool(cond in vars and vars[cond])
+                if neg:
+                    c = not c
+
+                if not c: # the condition was not met, skip rule
+                    continue
+
+            # at this point the rule will be honoured
+            if cmd == "concat_css":
+                if target in ["off", "false", "no"]:
+                    current_css_file = None
+                elif target in known_files:
+                    current_css_file = target
+                else:
+                    known_files[target] = []
+                    bundles.append((target, known_files[target]))
+                    current_css_file = target
+                    out.append(STYLE_ELE % target)
+                continue
+            elif cmd == "concat_js":
+                if target in ["off", "false", "no"]:
+                    current_js_file = None
+                elif target in known_files:
+                    current_js_file = target
+                else:
+                    known_files[target] = []
+                    bundles.append((target, known_files[target]))
+                    current_js_file = target
+                    out.append(SCRIPT_ELE % target)
+                continue
+            elif cmd == "set_rel_base_url" and \
+               vars.has_key("base_url") and vars["base_url"]:
+                out.append(BASE_URL % vars["base_url"])
+                continue
+            else: # some other unknown command! Let fall through so line is written
+                pass
+        elif kind == "css":
+            if current_css_file:
+                known_files[current_css_file].append((index, item[2]))
+                continue
+        elif kind == "js":
+            if current_js_file:
+                known_files[current_js_file].append((index, item[2]))
+                #fixme: The following continue should have been on the same level as this comment. However, that causes lang files to be included. must fix
+            continue
+
+        out.append(line)
+
+    return out, bundles
+
+def conditions(items):
+    """Return the sorted names of the variables the items depend on."""
+    return sorted(set(item[5] for item in items if item[0] == "cmd" and item[5]))
+
+def bundles(items):
+    """Return the bundles of items for all values of the conditions, as a
+    list of {"bundle", "type", "sources"}. Each source is a {"path"} with a
+    "when" list of the variables under which it is included, if it is not
+    always included. The same applies to the bundles."""
+    names = conditions(items)
+    types = dict((item[3], item[2][len("concat_"):]) for item in items
+                 if item[0] == "cmd" and item[2] in ("concat_js", "concat_css"))
+    assignments = [dict(zip(names, values))
+                   for values in itertools.product([False, True], repeat=len(names))]
+    found = {}
+    order = []
+    for assignment in assignments:
+        for target, sources in evaluate(items, assignment)[1]:
+            if not target in found:
+                found[target] = {"when": [], "sources": {}}
+                order.append(target)
+            found[target]["when"].append(assignment)
+            for index, path in sources:
+                found[target]["sources"].setdefault((index, path), []).append(assignment)
+
+    ret = []
+    for target in order:
+        bundle = {"bundle": target,
+                  "type": types[target],
+                  "sources": []}
+        if len(found[target]["when"]) < len(assignments):
+            bundle["when"] = found[target]["when"]
+        for (index, path), when in sorted(found[target]["sources"].items()):
+            source = {"path": path}
+            if len(when) < len(assignments):
+                source["when"] = when
+            bundle["sources"].append(source)
+        ret.append(bundle)
+    return ret
+
+def format_when(when):
+    """Format a "when" list for humans."""
+    return " or ".join(", ".join("%s%s" % ("" if value else "not ", name)
+                                 for name, value in sorted(assignment.items()))
+                       for assignment in when)
+
+class DependencyGraph(object):
+    """The parsed directive files of a source tree, by their path relative
+    to the source root. Persisted to path, if set."""
+
+    def __init__(self, path=None):
+        self.path = path
+        # path: {"size", "mtime", "items"}
+        self.files = {}
+        self._used = set()
+        if path and os.path.isfile(path):
+            try:
+                with open(path, "rb") as f:
+                    data = json.load(f)
+                if data.get("version") == VERSION:
+                    self.files = data.get("files", {})
+            except ValueError:
+                pass
+
+    def items(self, path, src_path, read_lines, st=None):
+        """Return the items of the directive file path, read from src_path.
+        read_lines is called to get the lines of the file if the file
+        changed since it was parsed. st is [size, mtime] of the file, if
+        already known."""
+        self._used.add(path)
+        if not st:
+            st = os.stat(src_path)
+            st = [st.st_size, st.st_mtime]
+        entry = self.files.get(path)
+        if entry and [entry["size"], entry["mtime"]] == list(st):
+            return entry["items"]
+        items = parse(read_lines())
+        self.files[path] = {"size": st[0], "mtime": st[1], "items": items}
+        return items
+
+    def bundles(self, path):
+        return bundles(self.files[path]["items"])
+
+    def to_json(self):
+        """Return client file -> bundles -> sources of all files which
+        have bundles."""
+        ret = {}
+        for path in sorted(self.files):
+            file_bundles = self.bundles(path)
+            if file_bundles:
+                ret[path.replace(os.sep, "/")] = file_bundles
+        return ret
+
+    def reverse(self, source):
+        """Return a list of (file, bundle) for the bundles which include
+        source. Paths are relative to the source root, with "/"."""
+        source = source.replace(os.sep, "/")
+        ret = []
+        for path, file_bundles in sorted(self.to_json().items()):
+            for bundle in file_bundles:
+                for s in bundle["sources"]:
+                    if s["path"] == source:
+                        ret.append((path, bundle["bundle"], s.get("when")))
+        return ret
+
+    def save(self, path=None):
+        """Write the graph to path, default the path it was loaded from,
+        without the files which were not used since it was loaded."""
+        path = path or self.path
+        if not path or not os.path.isdir(os.path.dirname(path)):
+            return
+        files = dict((p, self.files[p]) for p in self._used)
+        with open(path, "wb") as f:
+            json.dump({"version": VERSION, "files": files}, f, indent=1, sort_keys=True)
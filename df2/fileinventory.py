@@ -0,0 +1,106 @@
+"""The files of a directory with their size and mtime.
+
+A FileInventory is made with a single walk of the directory, with scandir
+if it is available (Python 3.5 or the scandir package on Python 2). The
+build creates one inventory of the source and hands it to all stages which
+used to walk or stat the source themselves: the encoding check, the build
+tree, the directive graph and the build manifest. On a networked file
+system the metadata calls are the expensive part of those stages.
+"""
+
+import os
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+def in_whitelist(path, whitelist):
+    """True if all directories of the relative path are in whitelist.
+    Files in the root are always in it."""
+    dirname = os.path.dirname(path)
+    return not dirname or not [d for d in dirname.split(os.sep) if not d in whitelist]
+
+def _walk(root):
+    """Yield (relative path, size, mtime) of all files below root."""
+    if not scandir:
+        for base, dirs, files in os.walk(root):
+            for name in files:
+                path = os.path.join(base, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield os.path.relpath(path, root), st.st_size, st.st_mtime
+        return
+
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        dirs = []
+        for entry in scandir(os.path.join(root, rel_dir)):
+            path = os.path.join(rel_dir, entry.name)
+            # like os.walk, a link to a directory is not followed
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(path)
+            elif entry.is_file():
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+        stack.extend(reversed(dirs))
+
+class FileInventory(object):
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        # relative path: (size, mtime)
+        self._files = {}
+        # extension: set of relative paths
+        self._by_ext = {}
+        if os.path.isdir(self.root):
+            for path, size, mtime in _walk(self.root):
+                self._add(path, size, mtime)
+
+    def _add(self, path, size, mtime):
+        self._files[path] = (size, mtime)
+        self._by_ext.setdefault(os.path.splitext(path)[1], set()).add(path)
+
+    def _rel(self, path):
+        if os.path.isabs(path):
+            return os.path.relpath(path, self.root)
+        return os.path.normpath(path)
+
+    def __contains__(self, path):
+        return self._rel(path) in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def __iter__(self):
+        return iter(sorted(self._files))
+
+    def abspath(self, path):
+        return os.path.join(self.root, path)
+
+    def stat(self, path):
+        """Return (size, mtime) of the file at path, relative to the root
+        or absolute, or None if it is not in the inventory."""
+        return self._files.get(self._rel(path))
+
+    def paths(self, exts=None, whitelist=None):
+        """Return the sorted relative paths, optionally only the ones with
+        an extension in exts and in whitelist, see in_whitelist."""
+        if exts:
+            paths = set()
+            for ext in exts:
+                paths.update(self._by_ext.get(ext, ()))
+        else:
+            paths = self._files
+        if whitelist:
+            return sorted(p for p in paths if in_whitelist(p, whitelist))
+        return sorted(paths)
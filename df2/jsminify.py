@@ -1,3 +1,4 @@
+import re
 import types
 import sys
 import os
@@ -9,12 +10,30 @@ import string
 import StringIO
 import collections
 
+# offset is the index of the first character of the token in the input,
+# line counts from 1, column from 0
 # Backward compat for pre 2.6 when namedtuple didn't exist
 if hasattr(collections, "namedtuple"):
-    Token = collections.namedtuple("Token", "type, value")
+    Token = collections.namedtuple("Token", "type, value, offset, line, column")
+    Token.__new__.func_defaults = (None, None, None)
 else:
     Token = lambda *x: tuple(x)
 
+# characters read from the input at a time
+CHUNK_SIZE = 64 * 1024
+
+# "\r\n" is one line break
+_re_line_break = re.compile(u"\r\n|[\n\r\u2028\u2029]")
+
+def _line_breaks(value):
+    """Return the number of line breaks in value and the index after the
+    last one."""
+    count = end = 0
+    for match in _re_line_break.finditer(value):
+        count += 1
+        end = match.end()
+    return count, end
+
 
 class JSTokenizer(object):
     LINETERMINATOR = (u'\u000A', u'\u000D', u'\u2028', u'\u2029')
@@ -49,6 +68,9 @@ class JSTokenizer(object):
         self._string_delimiter = ''
         self._buffer = ''
         self._previous_type = ''
+        self._offset = 0
+        self._line = 1
+        self._line_start = 0
         self._input_str = self.next_char()
 
     def __iter__(self):
@@ -66,18 +88,25 @@ class JSTokenizer(object):
             yield token
 
     def next_char(self):
-        for char in self._input.read():
-            self._buffer += self._char
-            self._char = char
-            yield char
+        for chunk in iter(lambda: self._input.read(CHUNK_SIZE), ''):
+            for char in chunk:
+                self._buffer += self._char
+                self._char = char
+                yield char
 
     def read_buffer(self, next_type):
         token = None
         if self._buffer:
-            if self._type == self.STRING_IDENTIFIER and self._buffer in self.KEYWORDS:
-                token = Token(self.STRING_KEYWORD, self._buffer)
-            else:
-                token = Token(self._type, self._buffer)
+            type = self._type
+            if type == self.STRING_IDENTIFIER and self._buffer in self.KEYWORDS:
+                type = self.STRING_KEYWORD
+            token = Token(type, self._buffer, self._offset, self._line,
+                          self._offset - self._line_start)
+            count, end = _line_breaks(self._buffer)
+            if count:
+                self._line += count
+                self._line_start = self._offset + end
+            self._offset += len(self._buffer)
 
             if not self._type == self.STRING_WHITESPACE:
                 self._previous_type = self._type
@@ -238,29 +267,504 @@ class JSTokenizer(object):
             char = self._input_str.next()
 
 
+class JSScanner(object):
+    """Tokenizer with the token stream of JSTokenizer. The input is read
+    once and a compiled pattern consumes a whole token per match instead
+    of the buffer growing by one character at a time.
+
+    Where the two differ JSScanner follows the ECMAScript grammar:
+    identifiers may contain digits ("a1" is one IDENTIFIER, not IDENTIFIER
+    and NUMBER), and a slash after a keyword like return or typeof, after a
+    string, or on a new line after an identifier is told apart from a
+    division by the previous significant token. JSTokenizer also treats a
+    character at the start of the input as part of a number.
+
+    The input is read in chunks of chunk_size, only the text from the
+    start of the current token is kept. input can be any object with a
+    read(size) method, e.g. a file, a codecs reader or an mmap, the tokens
+    are byte strings if it returns byte strings."""
+
+    # keywords after which an expression, so a regular expression, starts
+    REG_EXP_KEYWORDS = frozenset(('return', 'typeof', 'instanceof', 'in', 'new',
+                                  'delete', 'void', 'throw', 'case', 'do', 'else'))
+    # previous tokens which a regular expression can not follow
+    DIV_TYPES = frozenset((JSTokenizer.STRING_IDENTIFIER, JSTokenizer.STRING_NUMBER,
+                           JSTokenizer.STRING_STRING, JSTokenizer.STRING_REG_EXP))
+    KEYWORDS = frozenset(JSTokenizer.KEYWORDS)
+    # tokens which do not change the previous significant token
+    SKIP_TYPES = frozenset((JSTokenizer.STRING_WHITESPACE,
+                            JSTokenizer.STRING_LINETERMINATOR,
+                            JSTokenizer.STRING_COMMENT))
+    # tokens which can span lines
+    MULTILINE_TYPES = frozenset((JSTokenizer.STRING_LINETERMINATOR,
+                                 JSTokenizer.STRING_COMMENT,
+                                 JSTokenizer.STRING_STRING,
+                                 JSTokenizer.STRING_REG_EXP))
+
+    _patterns = {}
+
+    def __init__(self, input, chunk_size=CHUNK_SIZE):
+        self._input = input
+        self._chunk_size = chunk_size
+
+    def __iter__(self):
+        return self.tokeniter()
+
+    @classmethod
+    def _compile(cls, is_unicode):
+        """Return the patterns for a unicode or a byte string input as
+        (pattern after a division, pattern before a regular expression)."""
+        if not is_unicode in cls._patterns:
+            if is_unicode:
+                ws, lt = u"\t\x0b\x0c \xa0", u"\n\r\u2028\u2029"
+            else:
+                ws, lt = "\t\x0b\x0c ", "\n\r"
+            punct = r"{}()\[\];,<>=!+\-*%&|^~?:."
+            other = ws + lt + "\"'" + punct + "/"
+            head = ("(?P<WHITESPACE>[" + ws + "]+)"
+                    "|(?P<LINETERMINATOR>[" + lt + "]+)"
+                    r"|(?P<COMMENT>/\*[\s\S]*?\*/|/\*[\s\S]*|//[^" + lt + "]*)"
+                    r"|(?P<NUMBER>[0-9][xX][0-9a-fA-F]*"
+                    r"|[+\-.]?[0-9][0-9.]*(?:[eE][+\-]?[0-9]*)?)"
+                    r"|(?P<STRING>\"(?:[^\"\\]+|\\[\s\S]?)*\"?|'(?:[^'\\]+|\\[\s\S]?)*'?)")
+            tail = (r"|(?P<PUNCTUATOR>>>>=|===|!==|<<=|>>=|>>>|<=|>=|==|!=|\+\+|--|<<|>>"
+                    r"|&&|\|\||\+=|-=|\*=|%=|&=|\|=|\^=|[" + punct + "])"
+                    "|(?P<IDENTIFIER>[^" + other + "0-9][^" + other + "]*)")
+            div = r"|(?P<DIV_PUNCTUATOR>/=?)"
+            reg_exp = (r"|(?P<REG_EXP>/(?:[^/\\\[]+|\\[\s\S]?"
+                       r"|\[(?:[^\]\\]+|\\[\s\S]?)*\]?)*(?:/[gimsuy]*)?)")
+            cls._patterns[is_unicode] = (re.compile(head + div + tail),
+                                         re.compile(head + reg_exp + tail))
+        return cls._patterns[is_unicode]
+
+    def tokeniter(self):
+        text = self._input.read(self._chunk_size)
+        div, reg_exp = self._compile(isinstance(text, unicode))
+        pos = 0
+        # offset of text in the input
+        base = 0
+        line = 1
+        line_start = 0
+        is_eof = not text
+        is_reg_exp = True
+        while True:
+            if pos == len(text):
+                if is_eof:
+                    break
+                base += len(text)
+                text = self._input.read(self._chunk_size)
+                pos = 0
+                if not text:
+                    break
+            match = (reg_exp if is_reg_exp else div).match(text, pos)
+            if match.end() == len(text) and not is_eof:
+                # the token may continue in the next chunk
+                chunk = self._input.read(self._chunk_size)
+                if chunk:
+                    base += pos
+                    text = text[pos:] + chunk
+                    pos = 0
+                    continue
+                is_eof = True
+            type, value = match.lastgroup, match.group()
+            offset = base + pos
+            pos = match.end()
+            if type in self.SKIP_TYPES:
+                pass
+            elif type == JSTokenizer.STRING_IDENTIFIER and value in self.KEYWORDS:
+                type = JSTokenizer.STRING_KEYWORD
+                is_reg_exp = value in self.REG_EXP_KEYWORDS
+            elif type == JSTokenizer.STRING_PUNCTUATOR:
+                is_reg_exp = not value in (')', ']')
+            else:
+                is_reg_exp = not type in self.DIV_TYPES
+            yield Token(type, value, offset, line, offset - line_start)
+            if type in self.MULTILINE_TYPES:
+                count, end = _line_breaks(value)
+                if count:
+                    line += count
+                    line_start = offset + end
+
+
+# names which a local is never renamed to, "null", "true" and "false" are
+# IDENTIFIER tokens
+_RESERVED = frozenset(JSTokenizer.KEYWORDS + ('null', 'true', 'false', 'let',
+                                              'yield', 'arguments', 'eval',
+                                              'undefined'))
+
+_NAME_START = string.ascii_letters + "$_"
+_NAME_PART = _NAME_START + string.digits
+
+def _short_names():
+    """Yield the identifiers a, b, ..., $, _, aa, ab, ..., the shortest
+    first, without the reserved words."""
+    names = list(_NAME_START)
+    while True:
+        for name in names:
+            if not name in _RESERVED:
+                yield name
+        names = [name + char for name in names for char in _NAME_PART]
+
+
+class _Binding(object):
+    """A name declared in a scope. fixed is set if the name must not
+    change, indexes are the tokens of the declarations and references."""
+
+    def __init__(self, name):
+        self.name = name
+        self.new_name = name
+        self.fixed = False
+        self.indexes = []
+
+
+class _Scope(object):
+    """A function, or a catch block, which only declares its parameter.
+    var and function declarations always belong to the function."""
+
+    def __init__(self, parent, is_function=True):
+        self.parent = parent
+        self.is_function = is_function
+        self.bindings = {}
+        # (token index, name) of the references in the scope itself
+        self.refs = []
+        # with or eval is used in the scope or in a scope below it
+        self.unsafe = False
+        # the bindings of the scopes above and the undeclared names which
+        # are referenced in the scope or below it
+        self.outer = set()
+        self.free = set()
+
+    def function_scope(self):
+        scope = self
+        while not scope.is_function:
+            scope = scope.parent
+        return scope
+
+    def declare(self, name, index, fixed=False):
+        binding = self.bindings.get(name)
+        if not binding:
+            binding = self.bindings[name] = _Binding(name)
+        binding.indexes.append(index)
+        binding.fixed = binding.fixed or fixed
+
+
+class _ScopeParser(object):
+    """Find the scopes, declarations and references in a token stream of
+    JSScanner. Only ECMAScript 5 is understood, parse returns None for
+    syntax which it does not know, e.g. arrow functions, classes or
+    template strings."""
+
+    # previous tokens after which a name followed by ":" is an object key
+    # or a label, not a branch of "?:"
+    KEY_PREVIOUS = frozenset(('{', ',', ';', '}', ':', ')', ']', 'else', 'do'))
+    # previous tokens which can end an expression, a line break after them
+    # may end a var statement
+    END_VALUES = frozenset((')', ']', '}', 'this', '++', '--'))
+    END_TYPES = frozenset((JSTokenizer.STRING_IDENTIFIER, JSTokenizer.STRING_NUMBER,
+                           JSTokenizer.STRING_STRING, JSTokenizer.STRING_REG_EXP))
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        # the indexes of the tokens which are not white space or comments
+        self.sig = [i for i, token in enumerate(tokens)
+                    if not token[0] in JSScanner.SKIP_TYPES]
+        self.scopes = []
+
+    def _get(self, n):
+        if 0 <= n < len(self.sig):
+            return self.tokens[self.sig[n]]
+        return None
+
+    def _value(self, n):
+        token = self._get(n)
+        return token and token[0] != JSTokenizer.STRING_STRING and token[1]
+
+    def _has_line_break(self, n):
+        """True if there is a line break before the n-th token."""
+        start = self.sig[n - 1] + 1 if n else 0
+        for token in self.tokens[start:self.sig[n]]:
+            if token[0] == JSTokenizer.STRING_LINETERMINATOR or \
+               (token[0] == JSTokenizer.STRING_COMMENT and _line_breaks(token[1])[0]):
+                return True
+        return False
+
+    def _new_scope(self, parent, is_function=True):
+        scope = _Scope(parent, is_function)
+        self.scopes.append(scope)
+        return scope
+
+    def _function(self, n, scope):
+        """Read the parameters of a function from the "(" at n. Returns the
+        index of the "{" of the body, or None."""
+        if self._value(n) != '(':
+            return None
+        n += 1
+        while self._value(n) != ')':
+            token = self._get(n)
+            if not token or token[0] != JSTokenizer.STRING_IDENTIFIER:
+                return None
+            scope.declare(token[1], self.sig[n])
+            n += 1
+            if self._value(n) == ',':
+                n += 1
+        n += 1
+        return n if self._value(n) == '{' else None
+
+    def parse(self):
+        """Return the scopes, the global scope first, or None."""
+        IDENTIFIER = JSTokenizer.STRING_IDENTIFIER
+        KEYWORD = JSTokenizer.STRING_KEYWORD
+        PUNCTUATOR = JSTokenizer.STRING_PUNCTUATOR
+        tokens, sig = self.tokens, self.sig
+        scope = self._new_scope(None)
+        # the scope of each open bracket, None for a bracket in the scope
+        stack = []
+        # the depths of the var statements which are read, the innermost
+        # last, and whether a declared name is next
+        var_depths = []
+        expect_name = False
+        # the number of open "?" per depth of the stack, and the tokens
+        # of the ":" which close one
+        conditionals = {}
+        conditional_colons = set()
+        prev = None
+        n = 0
+        while n < len(sig):
+            i = sig[n]
+            type, value = tokens[i][:2]
+            after_dot = prev and prev[1] == '.' and prev[0] == PUNCTUATOR
+            if var_depths and var_depths[-1] == len(stack) and not expect_name and \
+               (prev[0] in self.END_TYPES or prev[1] in self.END_VALUES) and \
+               (type in (IDENTIFIER, KEYWORD) and not value in ('in', 'instanceof')
+                or value in ('++', '--')) and self._has_line_break(n):
+                # a new statement after an automatic semicolon
+                var_depths.pop()
+            if type == IDENTIFIER:
+                if '`' in value:
+                    return None
+                if var_depths and var_depths[-1] == len(stack) and expect_name:
+                    catch = scope
+                    while not catch.is_function:
+                        if value in catch.bindings:
+                            # assigns to the parameter of the catch block
+                            return None
+                        catch = catch.parent
+                    catch.declare(value, i)
+                    expect_name = False
+                elif after_dot or (prev and prev[1] in ('break', 'continue')
+                                   and prev[0] == KEYWORD):
+                    pass
+                elif self._value(n + 1) == ':' and (not prev or prev[0] in self.END_TYPES
+                                                    or prev[1] in self.KEY_PREVIOUS) and \
+                     not sig[n - 1] in conditional_colons:
+                    # an object key or a label
+                    pass
+                elif value in ('get', 'set') and prev and prev[1] in ('{', ',') and \
+                     self._value(n + 2) == '(' and \
+                     self._get(n + 1)[0] in (IDENTIFIER, KEYWORD, JSTokenizer.STRING_STRING,
+                                             JSTokenizer.STRING_NUMBER):
+                    # a getter or setter in an object literal
+                    function = self._new_scope(scope)
+                    n = self._function(n + 2, function)
+                    if n is None:
+                        return None
+                    stack.append(function)
+                    scope = function
+                else:
+                    scope.refs.append((i, value))
+                    if value == 'eval':
+                        scope.unsafe = True
+            elif expect_name:
+                # e.g. a destructuring declaration
+                return None
+            elif type == KEYWORD and not after_dot:
+                if value in ('class', 'import', 'export'):
+                    return None
+                if value in ('var', 'const'):
+                    var_depths.append(len(stack))
+                    expect_name = True
+                elif value == 'with':
+                    scope.unsafe = True
+                elif value == 'in' and var_depths and var_depths[-1] == len(stack):
+                    var_depths.pop()
+                elif value == 'function':
+                    is_declaration = not prev or (prev[0] == PUNCTUATOR and
+                                                  prev[1] in (';', '{', '}'))
+                    function = self._new_scope(scope)
+                    name = self._get(n + 1)
+                    if name and name[0] == IDENTIFIER:
+                        # the name of a function expression is only bound
+                        # in the function, it keeps its name in case it
+                        # is a declaration after all
+                        scope.function_scope().declare(name[1], sig[n + 1],
+                                                       not is_declaration)
+                        n += 1
+                    n = self._function(n + 1, function)
+                    if n is None:
+                        return None
+                    stack.append(function)
+                    scope = function
+                elif value == 'catch':
+                    name = self._get(n + 2)
+                    if self._value(n + 1) != '(' or not name or name[0] != IDENTIFIER \
+                       or self._value(n + 3) != ')' or self._value(n + 4) != '{':
+                        return None
+                    catch = self._new_scope(scope, False)
+                    catch.declare(name[1], sig[n + 2])
+                    n += 4
+                    stack.append(catch)
+                    scope = catch
+            elif type == PUNCTUATOR:
+                next_value = self._value(n + 1)
+                if (value == '=' and next_value == '>') or (value == '.' and next_value == '.'):
+                    return None
+                if value in ('(', '[', '{'):
+                    stack.append(None)
+                elif value in (')', ']', '}'):
+                    if not stack:
+                        return None
+                    conditionals.pop(len(stack), None)
+                    if stack.pop():
+                        scope = scope.parent
+                elif value == '?':
+                    conditionals[len(stack)] = conditionals.get(len(stack), 0) + 1
+                elif value == ':' and conditionals.get(len(stack)):
+                    conditionals[len(stack)] -= 1
+                    conditional_colons.add(i)
+                    while var_depths and var_depths[-1] > len(stack):
+                        var_depths.pop()
+                elif var_depths and var_depths[-1] == len(stack):
+                    if value == ';':
+                        var_depths.pop()
+                    elif value == ',':
+                        expect_name = True
+            prev = tokens[sig[n]]
+            n += 1
+        if stack or expect_name:
+            return None
+        return self.scopes
+
+
+def mangle_locals(tokens):
+    """Return the tokens with the local variables, parameters and function
+    names renamed to the shortest identifiers which are free in their
+    scope, the most used ones first. tokens is a token stream of
+    JSScanner, the result is a list. Global names are never renamed, nor
+    the names of a function which uses with or eval, or of the functions
+    around it. If the scopes can not be read, the tokens are returned
+    unchanged."""
+    tokens = list(tokens)
+    scopes = _ScopeParser(tokens).parse()
+    if not scopes:
+        return tokens
+    scopes[0].unsafe = True
+    for scope in scopes:
+        if scope.unsafe:
+            parent = scope.parent
+            while parent and not parent.unsafe:
+                parent.unsafe = True
+                parent = parent.parent
+        for name, binding in scope.bindings.iteritems():
+            if binding.fixed:
+                # no scope around it may use the name
+                outer = scope
+                while outer:
+                    outer.free.add(name)
+                    outer = outer.parent
+    for scope in scopes:
+        for index, name in scope.refs:
+            declared = scope
+            while declared and not name in declared.bindings:
+                declared = declared.parent
+            if declared:
+                binding = declared.bindings[name]
+                binding.indexes.append(index)
+            outer = scope
+            while outer is not declared:
+                if declared:
+                    outer.outer.add(binding)
+                else:
+                    outer.free.add(name)
+                outer = outer.parent
+
+    # the scopes are in the order of their start, so the names of the
+    # scopes around a scope are set before its own
+    for scope in scopes:
+        if scope.unsafe:
+            continue
+        used = set(scope.free)
+        used.update(binding.new_name for binding in scope.outer)
+        names = _short_names()
+        bindings = [b for b in scope.bindings.itervalues() if not b.fixed]
+        bindings.sort(key=lambda b: (-len(b.indexes), min(b.indexes)))
+        for binding in bindings:
+            for name in names:
+                if not name in used:
+                    break
+            binding.new_name = name
+            for index in binding.indexes:
+                token = tokens[index]
+                tokens[index] = Token(token[0], name, *token[2:])
+    return tokens
+
+
 class Minify(object):
     """Minify class, handling minification frome one file to another"""
 
-    def __init__(self, input, output, encoding="utf_8"):
+    # tokens which are kept before they are written to the output
+    FLUSH_SIZE = 4096
+
+    def __init__(self, input, output, encoding="utf_8", tokenizer=JSScanner,
+                 mappings=None, mangle=False):
         """ only new lines and white spaces which are safe to remove are removed
-            input and output must be file like objects """
+            input and output must be file like objects, tokenizer is
+            JSScanner or JSTokenizer. The output is written as the input is
+            read. If mappings is a list or an array, the output line, output
+            column, input line and input column of each token are appended to
+            it, the lines counting from 1. If mangle is set, the local names
+            are also shortened, see mangle_locals, the whole input is then
+            read before the output is written """
         self.input = input
         self.output = output
         self.tokens = [('', ''), ('', ''), ('', '')]
         self.buffersize = 2
         self.out = []
-
-        for token in JSTokenizer(input):
+        self.mappings = mappings
+        # the position in the output, for the mappings
+        self._line = 1
+        self._column = 0
+
+        tokens = tokenizer(input)
+        if mangle:
+            if tokenizer is not JSScanner:
+                raise ValueError("mangling needs the tokens of JSScanner")
+            tokens = mangle_locals(tokens)
+        for token in tokens:
             self.ontoken(token)
         self.onfinish()
 
+    def _map(self, token):
+        if len(token) > 2 and token[2] is not None:
+            self.mappings.extend((self._line, self._column, token[3], token[4]))
+        count, end = _line_breaks(token[1]) if token[0] in JSScanner.MULTILINE_TYPES \
+                     else (0, 0)
+        if count:
+            self._line += count
+            self._column = len(token[1]) - end
+        else:
+            self._column += len(token[1])
+
+    def flush(self):
+        if self.out:
+            self.output.write("".join(self.out))
+            self.out = []
+
     def onfinish(self):
         self.buffersize = 0
         self.tokens += [('', ''), ('', '')]
         self.ontoken(('', ''))
 
-        for token in self.out:
-            self.output.write(token)
+        self.flush()
 
     def ontoken(self, token):
         """
@@ -287,7 +791,7 @@ class Minify(object):
                     tokens = tokens.pop(2)
                     continue
                 if tokens[2][0] == WHITESPACE:
-                    tokens[2] = (WHITESPACE, u' ')
+                    tokens[2] = (WHITESPACE, ' ')
                     if tokens[1][0] == LINETERMINATOR \
                       or tokens[1][0] == PUNCTUATOR \
                       or tokens[1][0] == DIV_PUNCTUATOR:
@@ -300,7 +804,7 @@ class Minify(object):
                         tokens.pop(1)
                         continue
                 if tokens[1][0] == LINETERMINATOR:
-                    tokens[1] = (LINETERMINATOR, u'\n')
+                    tokens[1] = (LINETERMINATOR, '\n')
                     if tokens[2][0] == LINETERMINATOR \
                       or tokens[2][1] in CLOSENERS:
                         tokens.pop(1)
@@ -316,35 +820,40 @@ class Minify(object):
                               or tokens[1][1] in OPENERS):
                         tokens.pop(2)
                         continue
+                if self.mappings is not None:
+                    self._map(tokens[0])
                 self.out.append(tokens.pop(0)[1])
         except:
             pass
+        if len(self.out) >= self.FLUSH_SIZE:
+            self.flush()
 
 
-def minify_in_place(path, encoding="utf_8"):
+def minify_in_place(path, encoding="utf_8", mangle=False):
     """Minify path and write it to to the same location. Optionally use
     encoding"""
     tmpfd, tmppath = tempfile.mkstemp(".tmp", "minify.")
     os.fdopen(tmpfd).close()
-    minify(path, tmppath, encoding=encoding)
+    minify(path, tmppath, encoding=encoding, mangle=mangle)
     shutil.copyfile(tmppath, path)
     os.unlink(tmppath)
 
 
-def minify(inpath, outpath, encoding="utf_8"):
+def minify(inpath, outpath, encoding="utf_8", mangle=False):
     """Minify input path to outputpath, optionally using encoding"""
     input = codecs.open(inpath, "r", encoding=encoding)
     output = codecs.open(outpath, "w", encoding=encoding)
-    Minify(input, output)
+    Minify(input, output, mangle=mangle)
     input.close()
     output.close()
 
 
-def minify_str(data):
-    """Return minified version of the argument. Argument should be a string"""
+def minify_str(data, mappings=None, mangle=False):
+    """Return minified version of the argument. Argument should be a string,
+    see Minify for mappings and mangle"""
     input = StringIO.StringIO(data)
     output = StringIO.StringIO()
-    Minify(input, output)
+    Minify(input, output, mappings=mappings, mangle=mangle)
     return output.getvalue()
 
 
@@ -353,11 +862,14 @@ def main():
     parser.add_option("-o", "--overwrite", dest="overwrite",
                       default=False, action="store_true",
                       help="Overwrite target if it exists. WARNING! Includes source if no target is given!")
+    parser.add_option("-m", "--mangle", dest="mangle",
+                      default=False, action="store_true",
+                      help="Rename the local variables and parameters to short names.")
 
     options, args = parser.parse_args()
 
     if len(args) == 0:  # no args, use as filter
-        Minify(sys.stdin, sys.stdout)
+        Minify(sys.stdin, sys.stdout, mangle=options.mangle)
         return 1
     if len(args) == 1:
         src = args[0]
@@ -374,9 +886,9 @@ def main():
         parser.error("Destination file exists. Use -o to overwrite")
 
     if src == dst:
-        minify_in_place(src)
+        minify_in_place(src, mangle=options.mangle)
     else:
-        minify(src, dst)
+        minify(src, dst, mangle=options.mangle)
     return 1
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+"""On-disk cache of minified scripts.
+
+Most scripts are the same from one build to the next and between the
+profiles. The cache maps the SHA-256 of the input and of the identity of
+the minifier to the minified output, so a script is only minified again if
+it or the minifier changed. Each entry is a file, its mtime is the time of
+the last use. The token mappings of a script with a source map are kept in
+a second file next to the entry, see jsminify.Minify. The entries which
+were not used for the longest time are removed when the cache grows above
+its size limit.
+"""
+
+import os
+import array
+import hashlib
+import inspect
+import tempfile
+
+def minifier_identity(module):
+    """Return a string which changes with the code of the minifier module,
+    e.g. "jsminify:3f9a...". Falls back to the version or the name."""
+    try:
+        source = inspect.getsourcefile(module) or inspect.getfile(module)
+        with open(source, "rb") as f:
+            return "%s:%s" % (module.__name__, hashlib.sha256(f.read()).hexdigest())
+    except (TypeError, IOError):
+        return "%s:%s" % (module.__name__, getattr(module, "__version__", ""))
+
+class MinifyCache(object):
+
+    def __init__(self, path, max_size, identity):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.identity = identity
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, content, variant=""):
+        key = hashlib.sha256(self.identity)
+        key.update("\0")
+        if variant:
+            key.update(variant + "\0")
+        key.update(content.encode("utf-8"))
+        digest = key.hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, content, with_mappings=False, variant=""):
+        """Return the minified content, or None. If with_mappings is set,
+        return (minified content, mappings), or None if the entry has no
+        mappings. variant names the options of the minifier, e.g.
+        "mangle", each variant has its own entries."""
+        entry = self._entry(content, variant)
+        try:
+            with open(entry, "rb") as f:
+                minified = f.read().decode("utf-8")
+            if with_mappings:
+                mappings = array.array("i")
+                with open(entry + ".map", "rb") as f:
+                    mappings.fromstring(f.read())
+                os.utime(entry + ".map", None)
+            os.utime(entry, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (minified, mappings) if with_mappings else minified
+
+    def _write(self, path, data):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # other builds may use the cache at the same time
+        fd, tmp_path = tempfile.mkstemp(".tmp", "", dirname)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp makes the file only readable by the owner
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+
+    def put(self, content, minified, mappings=None, variant=""):
+        """Store minified for content, and the token mappings if set."""
+        entry = self._entry(content, variant)
+        if mappings is not None:
+            self._write(entry + ".map", array.array("i", mappings).tostring())
+        self._write(entry, minified.encode("utf-8"))
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is not
+        larger than max_size. Returns the number of removed entries."""
+        if not self.max_size or not os.path.isdir(self.path):
+            return 0
+        entries = []
+        size = 0
+        for base, dirs, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(base, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+                size += st.st_size
+        count = 0
+        for mtime, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            os.unlink(path)
+            size -= entry_size
+            count += 1
+        return count
@@ -0,0 +1,169 @@
+"""Source maps, version 3, of the script bundles.
+
+A LineMap records where the text of a file comes from as a list of runs:
+from a position in the text on, the text is a copy of a source file from
+a position in it, up to the next run. The concatenation of a bundle adds
+one run per file, the minifier one per token. source_map turns the runs
+into the "mappings" of a source map, a segment at the start of each run
+and of each further line of it, the numbers as base64 VLQs.
+"""
+
+import re
+import json
+import codecs
+
+# line terminators of ECMAScript, "\r\n" is one line break
+_re_line_break = re.compile(u"\r\n|[\n\r\u2028\u2029]")
+
+BASE64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+def _encode_vlq(value):
+    # the sign is the lowest bit, then groups of 5 bits, the lowest first,
+    # with a continuation bit
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    digits = []
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        digits.append(BASE64[digit])
+        if not value:
+            return "".join(digits)
+
+# most deltas in a map are small
+_VLQ = dict((value, _encode_vlq(value)) for value in xrange(-1024, 1024))
+
+def vlq(value):
+    """Return value as a base64 VLQ."""
+    return _VLQ.get(value) or _encode_vlq(value)
+
+def end_position(text, line=0, column=0):
+    """Return (line, column) of the end of text if it starts at (line,
+    column). Lines and columns count from 0."""
+    last = None
+    for last in _re_line_break.finditer(text):
+        line += 1
+    if last:
+        return line, len(text) - last.end()
+    return line, column + len(text)
+
+class LineMap(object):
+
+    def __init__(self):
+        # (line, column, source, source line, source column), source is
+        # None for text which is not from a source, e.g. a comment added
+        # by the build
+        self.runs = []
+        # (line, column) of the end of the text
+        self.end = (0, 0)
+
+    def add(self, text, source=None, line=0, column=0):
+        """Append text which is a copy of source from (line, column)."""
+        self.runs.append(self.end + (source, line, column))
+        self.end = end_position(text, *self.end)
+
+    def add_map(self, line_map):
+        """Append the text of line_map."""
+        end_line, end_column = self.end
+        self.runs.append(self.end + (None, 0, 0))
+        for line, column, source, src_line, src_column in line_map.runs:
+            if line == 0:
+                column += end_column
+            self.runs.append((line + end_line, column, source, src_line, src_column))
+        line, column = line_map.end
+        self.end = (line + end_line, column + end_column if line == 0 else column)
+
+    def map_tokens(self, mappings, text):
+        """Return the LineMap of text, the minified text of this one.
+        mappings is [output line, output column, input line, input column,
+        ...] of the tokens in the order of the text, the lines counting
+        from 1, see jsminify.Minify."""
+        line_map = LineMap()
+        runs = self.runs
+        index = 0
+        for i in xrange(0, len(mappings), 4):
+            in_pos = (mappings[i + 2] - 1, mappings[i + 3])
+            while index + 1 < len(runs) and runs[index + 1][:2] <= in_pos:
+                index += 1
+            line, column, source, src_line, src_column = runs[index]
+            if source is None or in_pos < (line, column):
+                source, src_line, src_column = None, 0, 0
+            elif in_pos[0] == line:
+                src_column += in_pos[1] - column
+            else:
+                src_line += in_pos[0] - line
+                src_column = in_pos[1]
+            line_map.runs.append((mappings[i] - 1, mappings[i + 1],
+                                  source, src_line, src_column))
+        line_map.end = end_position(text)
+        return line_map
+
+    def sources(self):
+        """Return the sources in the order of their first run."""
+        sources = []
+        seen = set()
+        for run in self.runs:
+            if run[2] is not None and not run[2] in seen:
+                seen.add(run[2])
+                sources.append(run[2])
+        return sources
+
+    def mappings(self, sources):
+        """Return the "mappings" of a source map, sources is the list of
+        the sources in the map."""
+        index = dict((source, i) for i, source in enumerate(sources))
+        out = []
+        # the fields of the previous segment, the column restarts in each
+        # line
+        out_line = prev_column = prev_source = prev_line = prev_src_column = 0
+        is_first = True
+        runs = self.runs
+        for i, (line, column, source, src_line, src_column) in enumerate(runs):
+            end = runs[i + 1][:2] if i + 1 < len(runs) else self.end
+            if source is None or (line, column) >= end:
+                continue
+            source = index[source]
+            # the lines which have text of the run
+            last = end[0] if end[1] else end[0] - 1
+            while line <= last:
+                if out_line < line:
+                    out.append(";" * (line - out_line))
+                    out_line = line
+                    prev_column = 0
+                elif not is_first:
+                    out.append(",")
+                out.append(vlq(column - prev_column) + vlq(source - prev_source) +
+                           vlq(src_line - prev_line) + vlq(src_column - prev_src_column))
+                is_first = False
+                prev_column, prev_source, prev_line, prev_src_column = \
+                    column, source, src_line, src_column
+                line += 1
+                src_line += 1
+                column = src_column = 0
+        return "".join(out)
+
+def source_map(line_map, file, source_name, root="", contents=None):
+    """Return the source map of line_map as JSON. file is the name of the
+    generated file and source_name(source) the name of a source in the
+    map. If root is set, it is the URL the names are relative to, else
+    the content of the sources is embedded, read with contents(source)."""
+    sources = line_map.sources()
+    data = {"version": 3,
+            "file": file,
+            "sources": [source_name(source) for source in sources],
+            "names": [],
+            "mappings": line_map.mappings(sources)}
+    if root:
+        data["sourceRoot"] = root
+    elif contents:
+        data["sourcesContent"] = [contents(source) for source in sources]
+    return json.dumps(data, sort_keys=True)
+
+def read_source(path):
+    """Return the content of the source file path, or None."""
+    try:
+        with codecs.open(path, "r", encoding="utf_8_sig") as f:
+            return f.read()
+    except (IOError, UnicodeDecodeError):
+        return None
@@ -0,0 +1,180 @@
+"""The git or hg repository a build is made from.
+
+The build used to start a new git process for each VCS command, with a
+configured "git-shell" each of them also printed the login banner. The Git
+backend keeps one 'git cat-file --batch' process for the whole build, the
+content of objects is read through it, and one 'git cat-file --batch-check'
+which resolves revisions to their hashes. The other commands still run
+through the shell function the backend gets, e.g. build.cmd_call. Code
+which needs the repository only uses the methods of a backend, a test can
+pass in any object with the same methods.
+"""
+
+import subprocess
+
+# printed by the shell before it starts cat-file, everything before it is
+# the login banner
+MARKER = "df2-cat-file-start"
+
+# the digits of the short commit hashes
+SHORT_HASH = 12
+
+class CatFile(object):
+    """A running 'git cat-file' in mode "--batch-check" or "--batch".
+    If login_shell is set, cat-file is started in that shell, e.g. the
+    "git-shell" of the config."""
+
+    def __init__(self, mode, login_shell=None):
+        self.mode = mode
+        if login_shell:
+            self._process = subprocess.Popen(login_shell,
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE)
+            self._process.stdin.write("echo %s; exec git cat-file %s\n" % (MARKER, mode))
+            self._process.stdin.flush()
+            while True:
+                line = self._process.stdout.readline()
+                if not line:
+                    raise IOError("git cat-file did not start in %s" % login_shell)
+                if line.rstrip("\r\n") == MARKER:
+                    break
+        else:
+            self._process = subprocess.Popen(["git", "cat-file", mode],
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE)
+
+    def query(self, name):
+        """Return (hash, type, size, content) of the object name, e.g.
+        "HEAD" or "v1.0:src/client-en.xml", or None if there is no such
+        object. content is None with "--batch-check"."""
+        if "\n" in name:
+            return None
+        self._process.stdin.write(name + "\n")
+        self._process.stdin.flush()
+        header = self._process.stdout.readline().split()
+        if len(header) != 3:
+            # "<name> missing" or "<name> ambiguous"
+            return None
+        obj_hash, obj_type, size = header[0], header[1], int(header[2])
+        content = None
+        if self.mode == "--batch":
+            content = self._process.stdout.read(size)
+            self._process.stdout.read(1)
+        return obj_hash, obj_type, size, content
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.stdin.close()
+            self._process.wait()
+
+class Git(object):
+    """shell runs a git command and returns (out, err), login_shell is
+    passed on to CatFile."""
+
+    name = "git"
+
+    def __init__(self, shell, login_shell=None):
+        self.shell = shell
+        self.login_shell = login_shell
+        self._cat_files = {}
+        self._root = None
+
+    def _cat_file(self, mode):
+        if not mode in self._cat_files:
+            self._cat_files[mode] = CatFile(mode, self.login_shell)
+        return self._cat_files[mode]
+
+    def status(self):
+        return self.shell("git", "status")
+
+    def update(self, rev):
+        return self.shell("git", "checkout", rev)
+
+    def get_hash(self, rev):
+        """Return the short hash of the commit rev and an error message.
+        The hash has 12 digits, more if that prefix is ambiguous."""
+        cat_file = self._cat_file("--batch-check")
+        obj = cat_file.query(rev + "^{commit}")
+        if not obj:
+            return "", "unknown revision: %s\n" % rev
+        full_hash = obj[0]
+        for length in range(SHORT_HASH, len(full_hash)):
+            prefix = cat_file.query(full_hash[:length])
+            if prefix and prefix[0] == full_hash:
+                return full_hash[:length] + "\n", ""
+        return full_hash + "\n", ""
+
+    def read(self, name):
+        """Return (type, content) of the object name, or None."""
+        obj = self._cat_file("--batch").query(name)
+        return obj and (obj[1], obj[3])
+
+    def rev_list(self, start, end):
+        """Return the hashes of the commits in start..end without the
+        merges, the newest first, and an error message."""
+        out, err = self.shell("git", "rev-list", "--no-merges", "%s..%s" % (start, end))
+        return out.split(), err
+
+    def root(self):
+        """Return the root directory of the repository and an error."""
+        if self._root:
+            return self._root, ""
+        out, err = self.shell("git", "rev-parse", "--show-toplevel")
+        if out.strip():
+            self._root = out.strip()
+        return out.strip(), err
+
+    def add_worktree(self, rev, path):
+        return self.shell("git", "worktree", "add", "--detach", path, rev)
+
+    def prune_worktrees(self):
+        return self.shell("git", "worktree", "prune")
+
+    def close(self):
+        """Stop the cat-file processes. They also end with the build."""
+        for cat_file in self._cat_files.values():
+            cat_file.close()
+        self._cat_files = {}
+
+class Hg(object):
+
+    name = "hg"
+
+    def __init__(self, shell):
+        self.shell = shell
+
+    def status(self):
+        return self.shell("hg", "status")
+
+    def update(self, rev):
+        return self.shell("hg", "up", rev)
+
+    def get_hash(self, rev):
+        """Return "<rev>:<short hash>" of rev and an error message."""
+        return self.shell("hg", "log", "-r", rev, "--template", "{rev}:{node|short}")
+
+    def read(self, name):
+        rev, path = name.split(":", 1)
+        out, err = self.shell("hg", "cat", "-r", rev, path)
+        return None if err else ("blob", out)
+
+    def log(self, start, end):
+        return self.shell("hg", "log", "-r", "%s:%s" % (end, start), "--style", "changelog")
+
+    def rev_list(self, start, end):
+        out, err = self.shell("hg", "log", "-r", "%s:%s" % (end, start), "--no-merges",
+                              "--template", "{node}\n")
+        return out.split(), err
+
+    def root(self):
+        out, err = self.shell("hg", "root")
+        return out.strip(), err
+
+    def add_worktree(self, rev, path):
+        return self.shell("hg", "archive", "-r", rev, path)
+
+    def prune_worktrees(self):
+        return "", ""
+
+    def close(self):
+        pass
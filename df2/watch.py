@@ -0,0 +1,107 @@
+"""Watch a source directory for changes, used by 'df2 build --watch'.
+
+pyinotify is used if it is installed, otherwise the directory is polled
+for changes of the size and mtime of its files.
+"""
+
+import os
+import time
+from fileinventory import FileInventory
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# time to wait for further changes after the first one, e.g. an editor
+# which writes a file in several steps or a checkout of a branch
+SETTLE_TIME = 0.2
+
+def _ignore(name):
+    # hidden files, e.g. .git, and editor backups
+    return name.startswith(".") or name.endswith("~")
+
+def _snapshot(src):
+    inventory = FileInventory(src)
+    return dict((inventory.abspath(p), inventory.stat(p)) for p in inventory
+                if not [name for name in p.split(os.sep) if _ignore(name)])
+
+class PollWatcher(object):
+
+    def __init__(self, src, interval=1.0):
+        self.src = os.path.abspath(src)
+        self.interval = interval
+        self._snapshot = _snapshot(self.src)
+
+    def _changes(self):
+        snapshot = _snapshot(self.src)
+        changed = set(p for p in snapshot if snapshot[p] != self._snapshot.get(p))
+        changed.update(p for p in self._snapshot if not p in snapshot)
+        self._snapshot = snapshot
+        return changed
+
+    def wait(self):
+        """Block until files below src changed. Returns the set of the
+        absolute paths of the added, changed and removed files."""
+        while True:
+            time.sleep(self.interval)
+            changed = self._changes()
+            if changed:
+                time.sleep(SETTLE_TIME)
+                changed.update(self._changes())
+                return changed
+
+    def close(self):
+        pass
+
+if pyinotify:
+
+    class _Collector(pyinotify.ProcessEvent):
+
+        def my_init(self, changed=None):
+            self.changed = changed
+
+        def process_default(self, event):
+            if not event.dir and not _ignore(event.name):
+                self.changed.add(event.pathname)
+
+class InotifyWatcher(object):
+
+    MASK = pyinotify and (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE |
+                          pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM |
+                          pyinotify.IN_MOVED_TO)
+
+    def __init__(self, src):
+        self.src = os.path.abspath(src)
+        self._changed = set()
+        self._wm = pyinotify.WatchManager()
+        self._notifier = pyinotify.Notifier(self._wm, _Collector(changed=self._changed))
+        self._wm.add_watch(self.src, self.MASK, rec=True, auto_add=True,
+                           exclude_filter=lambda path: _ignore(os.path.basename(path)))
+
+    def _read(self, timeout):
+        if self._notifier.check_events(timeout):
+            self._notifier.read_events()
+            self._notifier.process_events()
+            return True
+        return False
+
+    def wait(self):
+        """See PollWatcher.wait."""
+        while not self._changed:
+            self._read(None)
+        while self._read(SETTLE_TIME * 1000):
+            pass
+        changed = set(self._changed)
+        self._changed.clear()
+        return changed
+
+    def close(self):
+        self._notifier.stop()
+
+def watcher(src, interval=1.0):
+    """Return an InotifyWatcher for src if pyinotify is available,
+    otherwise a PollWatcher which checks every interval seconds."""
+    if pyinotify:
+        return InotifyWatcher(src)
+    return PollWatcher(src, interval)
@@ -0,0 +1,138 @@
+"""A small Dragonfly source tree and a quiet build of it for the tests.
+The modules in df2 import each other by their plain names, so df2 is
+put on the path."""
+
+import os
+import sys
+import codecs
+import shutil
+import tempfile
+import unittest
+import contextlib
+import StringIO
+
+DF2 = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "df2")
+if not DF2 in sys.path:
+    sys.path.insert(0, DF2)
+
+import build
+from buildstats import BuildStats
+from buildmanifest import BuildManifest, settings_digest
+
+CLIENT = u"""<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+<title>Opera Dragonfly $dfversion$</title>
+<!-- command concat_css style/dragonfly.css -->
+<link rel="stylesheet" href="ui-style/a.css"/>
+<link rel="stylesheet" href="ui-style/b.css"/>
+<!-- command concat_css off -->
+<!-- command concat_js script/dragonfly.js -->
+<script src="scripts/a.js"/>
+<script src="scripts/b.js"/>
+<script src="ui-strings/ui_strings-en.js"/>
+<!-- command concat_js off -->
+</head>
+<body>$revdate$</body>
+</html>
+"""
+
+FILES = {
+    "client-en.xml": CLIENT,
+    "ui-style/a.css": u".a { background: url(../ui-images/small.png); }\n"
+                      u".b { background: url(\"../ui-images/big.png\"); }\n",
+    "ui-style/b.css": u".c { background: url('../ui-images/small.png'); }\n",
+    "scripts/a.js": u"var cls = window.cls || (window.cls = {});\n"
+                    u"cls.add = function(first_value, second_value)\n"
+                    u"{\n  var result = first_value + second_value;\n  return result;\n};\n",
+    "scripts/b.js": u"cls.version = \"$dfversion$\";\n",
+    "ui-strings/ui_strings-en.js": u"window.ui_strings || (window.ui_strings = {});\n"
+                                   u"ui_strings.S_OK = \"OK\";\n",
+}
+
+# not real images, the build only looks at the size and the extension
+IMAGES = {
+    "ui-images/small.png": "\x89PNG" + "s" * 60,
+    "ui-images/big.png": "\x89PNG" + "b" * 5000,
+    "ui-images/unused.png": "\x89PNG" + "u" * 60,
+}
+
+PROFILE = {"copy_blacklist": ["scripts", "ui-style", "ui-strings"],
+           "make_data_uris": True,
+           "minify_whitelist": ["script", "style"]}
+
+def write_file(root, path, data):
+    path = os.path.join(root, path)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(data)
+
+def write_text(root, path, text):
+    """Write a text file of the source, with a BOM like all of them."""
+    write_file(root, path, codecs.BOM_UTF8 + text.encode("utf-8"))
+
+def make_source(root):
+    for path, text in FILES.items():
+        write_text(root, path, text)
+    for path, data in IMAGES.items():
+        write_file(root, path, data)
+
+@contextlib.contextmanager
+def quiet():
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        yield sys.stdout
+    finally:
+        sys.stdout = stdout
+
+def build_profile(src, dest, revision="1.0", jobs=1, stats=None, **settings):
+    """Build src to dest with PROFILE and settings in jobs processes.
+    stats is the BuildStats of the build. Returns the tree."""
+    profile = dict(PROFILE, dest=dest, **settings)
+    keywords = build._build_keywords(profile, revision, "tip", "1", "abcdef123456")
+    with quiet():
+        return build._build_profile(profile, src, dest, keywords,
+                                    build._directive_vars(profile), jobs, "tip", "1",
+                                    "abcdef123456", stats or BuildStats())
+
+def build_tree(src, dest, keywords, **settings):
+    """Run the stages of an incremental build of src into dest with
+    PROFILE and settings, without the data URIs. Returns the tree."""
+    profile = dict(PROFILE, **settings)
+    with quiet():
+        tree = build.export_tree(src, exclude_dirs=profile["copy_blacklist"],
+                                 keywords=keywords)
+        manifest = BuildManifest(dest, settings_digest(profile))
+        manifest.mark_up_to_date(tree)
+        if profile.get("minify"):
+            build._minify_buildout(tree, profile["minify_whitelist"])
+        if profile.get("fingerprint_bundles"):
+            build._fingerprint_bundles(tree)
+        tree.write(dest)
+        manifest.remove_stale_outputs(tree)
+        manifest.update(tree)
+        manifest.save()
+    return tree
+
+def read_tree(root):
+    """Return {path: content} of all files below root."""
+    files = {}
+    for base, dirs, names in os.walk(root):
+        for name in names:
+            path = os.path.join(base, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+class BuildTestCase(unittest.TestCase):
+    """Gives each test a source tree in self.src and a temp dir."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="df2-test.")
+        self.src = os.path.join(self.tmp, "src")
+        make_source(self.src)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
@@ -0,0 +1,99 @@
+import os
+import zlib
+import shutil
+import zipfile
+import unittest
+
+from helpers import BuildTestCase, build_profile
+import build
+
+class ArchiveTest(BuildTestCase):
+
+    def build_zip(self, **settings):
+        dest = os.path.join(self.tmp, "dest")
+        zips = os.path.join(self.tmp, "zips")
+        build_profile(self.src, dest, create_zips=True, zips=zips, **settings)
+        return dest, zipfile.ZipFile(os.path.join(zips, "1.abcdef123456", "client-en.zip"))
+
+    def assert_urls_in_zip(self, z):
+        names = set(z.namelist())
+        for name in names:
+            if name.endswith(".css"):
+                content = z.read(name)
+                for full, url in build._re_img_url.findall(content):
+                    if url.startswith("data:"):
+                        continue
+                    path = os.path.normpath(os.path.join(os.path.dirname(name), url))
+                    self.assertIn(path.replace(os.sep, "/"), names,
+                                  "%s: url(%s)" % (name, url))
+
+    def test_external_images_are_archived(self):
+        dest, z = self.build_zip(data_uri_max_size=1000)
+        self.assertIn("ui-images/big.png", z.namelist())
+        self.assertNotIn("ui-images/small.png", z.namelist())
+        self.assertNotIn("ui-images/unused.png", z.namelist())
+        self.assertEqual(z.read("ui-images/big.png"),
+                         open(os.path.join(dest, "ui-images", "big.png"), "rb").read())
+        self.assert_urls_in_zip(z)
+        self.assertEqual(z.testzip(), None)
+
+    def test_all_images_inlined(self):
+        dest, z = self.build_zip()
+        self.assertEqual([n for n in z.namelist() if n.startswith("ui-images")], [])
+        self.assert_urls_in_zip(z)
+
+    def test_compress_types(self):
+        dest, z = self.build_zip(data_uri_max_size=1000)
+        self.assertEqual(z.getinfo("ui-images/big.png").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(z.getinfo("client-en.xml").compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(z.read("client-en.xml"),
+                         open(os.path.join(dest, "client-en.xml"), "rb").read())
+
+    def test_read_member_cache(self):
+        cache = {}
+        path = os.path.join("scripts", "a.js")
+        member = build._read_member(self.src, path, cache)
+        self.assertIs(build._read_member(self.src, path, cache), member)
+        with open(os.path.join(self.src, path), "ab") as f:
+            f.write("var changed = 1;\n")
+        data = build._read_member(self.src, path, cache)["data"]
+        self.assertTrue(zlib.decompress(data, -15).endswith("changed = 1;\n"))
+
+    def test_members_compressed_once(self):
+        dest = os.path.join(self.tmp, "dest")
+        zips = os.path.join(self.tmp, "zips")
+        os.mkdir(zips)
+        build_profile(self.src, dest, data_uri_max_size=1000)
+        shutil.copy(os.path.join(dest, "client-en.xml"), os.path.join(dest, "client-de.xml"))
+        calls = []
+        compressobj = zlib.compressobj
+        def counting_compressobj(*args):
+            calls.append(args)
+            return compressobj(*args)
+        build.zlib.compressobj = counting_compressobj
+        try:
+            build.make_build_archives(dest, zips, ["client-en.xml", "client-de.xml"], 2)
+        finally:
+            build.zlib.compressobj = compressobj
+        members = set()
+        for name in ["client-en.xml", "client-de.xml"]:
+            members.update(build._build_archive_files(dest, name))
+        deflated = [p for p in members if not p.lower().endswith(build._stored_exts)]
+        self.assertEqual(len(calls), len(deflated))
+        for name in ["client-en.xml", "client-de.xml"]:
+            z = zipfile.ZipFile(os.path.join(zips, name.replace(".xml", ".zip")))
+            self.assertEqual(z.testzip(), None)
+            for path in build._build_archive_files(dest, name):
+                with open(os.path.join(dest, path), "rb") as f:
+                    self.assertEqual(z.read(path.replace(os.sep, "/")), f.read())
+
+    def test_check_archive_urls(self):
+        dest = os.path.join(self.tmp, "dest")
+        build_profile(self.src, dest, data_uri_max_size=1000)
+        files = build._build_archive_files(dest, "client-en.xml")
+        self.assertEqual(build._check_archive_urls(dest, files), [])
+        files.remove(os.path.join("ui-images", "big.png"))
+        self.assertEqual(len(build._check_archive_urls(dest, files)), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import os
+import unittest
+
+from helpers import BuildTestCase, write_file
+import bomcheck
+
+class CheckTreeTest(BuildTestCase):
+
+    def setUp(self):
+        BuildTestCase.setUp(self)
+        write_file(self.src, os.path.join("scripts", "nobom.js"), "var a;\n")
+        write_file(self.src, os.path.join("scripts", "invalid.js"), "\xef\xbb\xbfvar \xff;\n")
+
+    def check(self, threads):
+        bomcheck._results.clear()
+        return [(os.path.basename(path), result) for path, result in
+                bomcheck.check_tree(self.src, [".js"], strict=True, threads=threads)]
+
+    def test_threads(self):
+        expected = [("invalid.js", bomcheck.INVALID), ("nobom.js", bomcheck.NO_BOM)]
+        self.assertEqual(self.check(1), expected)
+        self.assertEqual(self.check(4), expected)
+
+if __name__ == "__main__":
+    unittest.main()
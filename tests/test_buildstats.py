@@ -0,0 +1,73 @@
+import os
+import json
+import unittest
+
+from helpers import BuildTestCase, build_profile
+from buildstats import BuildStats
+import buildstats
+
+class Counters(object):
+
+    def __init__(self):
+        self.counters = {"files": 0, "read": 0, "in": 0, "out": 0}
+
+class BuildStatsTest(BuildTestCase):
+
+    def test_stage_sums_up(self):
+        stats = BuildStats()
+        tree = Counters()
+        for i in range(2):
+            with stats.stage("vcs"):
+                pass
+            with stats.stage("minify", tree) as record:
+                tree.counters["files"] += 2
+                tree.counters["in"] += 100
+                record["out"] += 10
+        self.assertEqual([r["stage"] for r in stats.stages], ["vcs", "minify"])
+        minify = stats.stages[1]
+        self.assertEqual((minify["calls"], minify["files"], minify["in"], minify["out"]),
+                         (2, 4, 200, 20))
+
+    def test_timed(self):
+        stats = BuildStats()
+        fn = stats.timed("shell", lambda a, b=0: a + b)
+        self.assertEqual(fn(1, b=2), 3)
+        self.assertEqual(stats.stages[0]["calls"], 1)
+
+    def test_worker_cpu_time(self):
+        cpu = [0.0]
+        stats = BuildStats(lambda: cpu[0])
+        with stats.stage("minify"):
+            cpu[0] += 5.0
+        self.assertTrue(stats.stages[0]["cpu"] >= 5.0)
+
+    def test_report_and_save(self):
+        stats = BuildStats()
+        with stats.stage("export") as record:
+            record["out"] += 2048
+        lines = stats.report().split("\n")
+        self.assertTrue(lines[0].startswith("stage"))
+        self.assertTrue(lines[2].startswith("export"))
+        self.assertTrue(lines[2].endswith("2.0 KB"))
+        self.assertTrue(lines[-1].startswith("total"))
+        path = os.path.join(self.tmp, "stats.json")
+        stats.save(path, profile="default")
+        with open(path, "rb") as f:
+            data = json.load(f)
+        self.assertEqual(data["profile"], "default")
+        self.assertEqual(data["stages"][0]["out"], 2048)
+
+    def test_build_stages(self):
+        stats = BuildStats()
+        build_profile(self.src, os.path.join(self.tmp, "dest"), stats=stats)
+        stages = dict((r["stage"], r) for r in stats.stages)
+        self.assertIn("export", stages)
+        self.assertTrue(stages["write"]["out"] > 0)
+
+    def test_format_bytes(self):
+        self.assertEqual(buildstats._format_bytes(100), "100 B")
+        self.assertEqual(buildstats._format_bytes(3 << 20), "3.0 MB")
+        self.assertEqual(buildstats._format_bytes(5 << 30), "5.0 GB")
+
+if __name__ == "__main__":
+    unittest.main()
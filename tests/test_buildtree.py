@@ -0,0 +1,30 @@
+import os
+import unittest
+
+from helpers import BuildTestCase, build_profile
+from buildtree import link_file
+
+class LinkFileTest(BuildTestCase):
+
+    def test_no_hardlink_by_default(self):
+        src = os.path.join(self.src, "scripts", "a.js")
+        dst = os.path.join(self.tmp, "a.js")
+        self.assertIn(link_file(src, dst), ["reflink", "copy"])
+        self.assertEqual(os.stat(src).st_nlink, 1)
+        self.assertEqual(open(dst, "rb").read(), open(src, "rb").read())
+
+    def test_hardlink(self):
+        src = os.path.join(self.src, "scripts", "a.js")
+        dst = os.path.join(self.tmp, "a.js")
+        self.assertIn(link_file(src, dst, True), ["reflink", "hardlink", "copy"])
+        self.assertEqual(open(dst, "rb").read(), open(src, "rb").read())
+
+    def test_build_does_not_share_sources(self):
+        dest = os.path.join(self.tmp, "dest")
+        build_profile(self.src, dest)
+        for base, dirs, files in os.walk(self.src):
+            for name in files:
+                self.assertEqual(os.stat(os.path.join(base, name)).st_nlink, 1, name)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import json
+import unittest
+
+from helpers import BuildTestCase, BuildStats, build, quiet, write_file
+import changelog
+
+class FakeHg(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def log(self, start, end):
+        self.calls.append((start, end))
+        return "changeset: 42:123456789abc\n", ""
+
+class HgLogTest(BuildTestCase):
+
+    def test_start_at_previous_log(self):
+        logs = os.path.join(self.tmp, "logs")
+        write_file(logs, "41.0123456789ab.log", "changeset: 41:0123456789ab\n")
+        repo = FakeHg()
+        with quiet():
+            build._create_log({"logs": logs}, repo, False, "tip", None,
+                              "42", "123456789abc", BuildStats())
+        self.assertEqual(repo.calls, [("0123456789ab", "tip")])
+        with open(os.path.join(logs, "42.123456789abc.log"), "rb") as f:
+            self.assertEqual(f.read(), "changeset: 42:123456789abc\n")
+
+COMMIT = ("tree 0123\nauthor A U Thor <a@example.com> 1500000000 +0200\n"
+          "committer A U Thor <a@example.com> 1500000000 +0200\n\nsubject\n")
+
+class FakeGit(object):
+
+    def __init__(self):
+        self.reads = []
+
+    def read(self, name):
+        self.reads.append(name)
+        return "commit", COMMIT
+
+class LogStoreTest(BuildTestCase):
+
+    def setUp(self):
+        BuildTestCase.setUp(self)
+        self.path = os.path.join(self.tmp, changelog.STORE_NAME)
+
+    def read_lines(self):
+        with open(self.path, "rb") as f:
+            return f.read().splitlines()
+
+    def test_save_appends(self):
+        repo = FakeGit()
+        store = changelog.LogStore(self.path)
+        self.assertEqual(store.get(repo, "a" * 40).subject, "subject")
+        store.add_log("1.log", "v1", "s", "a" * 12, 1)
+        store.save()
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 3)
+
+        store = changelog.LogStore(self.path)
+        self.assertEqual(store.get(repo, "a" * 40).date, "2017-07-14")
+        self.assertEqual(repo.reads, ["a" * 40])
+        store.get(repo, "b" * 40)
+        store.add_log("2.log", "v2", "a" * 12, "b" * 12, 1)
+        store.save()
+        # the earlier lines are not written again
+        self.assertEqual(self.read_lines()[:3], lines)
+        self.assertEqual(len(self.read_lines()), 5)
+        store = changelog.LogStore(self.path)
+        self.assertEqual(sorted(store.entries), ["a" * 40, "b" * 40])
+        self.assertEqual(store.last_end(), "b" * 12)
+        self.assertEqual(store.last_end("2.log"), "a" * 12)
+
+    def test_interrupted_save(self):
+        store = changelog.LogStore(self.path)
+        store.get(FakeGit(), "a" * 40)
+        store.save()
+        with open(self.path, "ab") as f:
+            f.write('["commit", "b')
+        store = changelog.LogStore(self.path)
+        self.assertEqual(list(store.entries), ["a" * 40])
+        store.add_log("1.log", "v1", "s", "a" * 12, 1)
+        store.save()
+        self.assertEqual([json.loads(l)[0] for l in self.read_lines()[1:]], ["commit", "log"])
+
+    def test_old_store(self):
+        old_path = os.path.join(self.tmp, changelog.OLD_STORE_NAME)
+        with open(old_path, "wb") as f:
+            json.dump({"version": 1, "entries": {"a" * 40: ["A", "a@x", "2017-07-14", "s"]},
+                       "logs": {"1.log": {"tag": "v1", "start": "s", "end": "a" * 12,
+                                          "count": 1, "time": 1}}}, f)
+        store = changelog.LogStore(self.path)
+        self.assertEqual(store.last_end(), "a" * 12)
+        store.save()
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(changelog.LogStore(self.path).entries, store.entries)
+
+if __name__ == "__main__":
+    unittest.main()
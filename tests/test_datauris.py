@@ -0,0 +1,57 @@
+import os
+import unittest
+
+from helpers import BuildTestCase, quiet, write_text
+from buildtree import BuildTree
+import build
+
+A_CSS = os.path.join("ui-style", "a.css")
+SMALL = os.path.join("ui-images", "small.png")
+BIG = os.path.join("ui-images", "big.png")
+
+class DataURITest(BuildTestCase):
+
+    def convert(self, **kwargs):
+        tree = BuildTree(self.src)
+        with quiet():
+            referenced = build._convert_imgs_to_data_uris(tree, **kwargs)
+        return tree, referenced
+
+    def test_memoized(self):
+        uri = build._data_uri("a.png", "\x89PNG")
+        self.assertTrue(uri.startswith("'data:image/png;charset=utf-8;base64,"))
+        self.assertIs(build._data_uri("a.png", "\x89PNG"), uri)
+        self.assertIsNot(build._data_uri("a.png", "\x89PNG2"), uri)
+
+    def test_max_size(self):
+        tree, referenced = self.convert(max_size=1000)
+        self.assertEqual(referenced, set([BIG]))
+        self.assertNotIn(SMALL, tree)
+        content = tree.get_text(A_CSS)
+        self.assertIn(u"url('data:image/png;", content)
+        self.assertIn(u"url(\"../ui-images/big.png\")", content)
+
+    def test_max_refs(self):
+        write_text(self.src, A_CSS, u".a { background: url(../ui-images/small.png); }\n"
+                                    u".b { background: url(../ui-images/small.png); }\n")
+        tree, referenced = self.convert(max_refs=1)
+        self.assertEqual(referenced, set([SMALL]))
+        # still inlined in b.css, which has one reference
+        self.assertIn(u"data:image/png", tree.get_text(os.path.join("ui-style", "b.css")))
+
+    def test_external_url(self):
+        # found by its name, the url is made relative to the stylesheet
+        write_text(self.src, A_CSS, u".b { background: url(../images/big.png); }\n")
+        tree, referenced = self.convert(max_size=1000)
+        self.assertEqual(referenced, set([BIG]))
+        self.assertIn(u"url('../ui-images/big.png')", tree.get_text(A_CSS))
+        self.assertEqual(build._make_rel_url_path("style.css", BIG), "ui-images/big.png")
+
+    def test_file_name_index(self):
+        # the relative path is wrong, the image is found by its name
+        write_text(self.src, A_CSS, u".a { background: url(../images/small.png); }\n")
+        tree, referenced = self.convert()
+        self.assertIn(u"data:image/png", tree.get_text(A_CSS))
+
+if __name__ == "__main__":
+    unittest.main()
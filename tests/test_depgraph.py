@@ -0,0 +1,63 @@
+import os
+import unittest
+
+from helpers import BuildTestCase, CLIENT
+from depgraph import DependencyGraph
+import depgraph
+
+CONDITIONAL = u"""<!-- command concat_js script/dragonfly.js -->
+<script src="scripts/a.js"/>
+<!-- command concat_js off if exclude_uistrings -->
+<script src="ui-strings/ui_strings-en.js"/>
+<!-- command concat_js off -->
+"""
+
+class BundlesTest(unittest.TestCase):
+
+    def test_bundles(self):
+        bundles = depgraph.bundles(depgraph.parse(CLIENT.splitlines(True)))
+        self.assertEqual([(b["bundle"], b["type"]) for b in bundles],
+                         [("style/dragonfly.css", "css"), ("script/dragonfly.js", "js")])
+        self.assertEqual([s["path"] for s in bundles[1]["sources"]],
+                         ["scripts/a.js", "scripts/b.js", "ui-strings/ui_strings-en.js"])
+        self.assertFalse([b for b in bundles if "when" in b])
+
+    def test_conditional_source(self):
+        items = depgraph.parse(CONDITIONAL.splitlines(True))
+        self.assertEqual(depgraph.conditions(items), ["exclude_uistrings"])
+        sources = depgraph.bundles(items)[0]["sources"]
+        self.assertEqual(sources[0], {"path": "scripts/a.js"})
+        self.assertEqual(sources[1], {"path": "ui-strings/ui_strings-en.js",
+                                      "when": [{"exclude_uistrings": False}]})
+        self.assertEqual(depgraph.format_when(sources[1]["when"]), "not exclude_uistrings")
+
+class DependencyGraphTest(BuildTestCase):
+
+    def test_parsed_once(self):
+        path = os.path.join(self.tmp, "deps.json")
+        src_path = os.path.join(self.src, "client-en.xml")
+        calls = []
+        def read_lines():
+            calls.append(1)
+            return CLIENT.splitlines(True)
+        graph = DependencyGraph(path)
+        items = graph.items("client-en.xml", src_path, read_lines)
+        graph.items("other.xml", src_path, read_lines)
+        graph.save()
+        graph = DependencyGraph(path)
+        self.assertEqual(graph.items("client-en.xml", src_path, read_lines), items)
+        self.assertEqual(len(calls), 2)
+        graph.save()
+        # a file which was not used is dropped
+        self.assertEqual(list(DependencyGraph(path).files), ["client-en.xml"])
+
+    def test_reverse(self):
+        graph = DependencyGraph()
+        graph.items("client-en.xml", os.path.join(self.src, "client-en.xml"),
+                    lambda: CLIENT.splitlines(True))
+        self.assertEqual(graph.reverse(os.path.join("ui-style", "b.css")),
+                         [("client-en.xml", "style/dragonfly.css", None)])
+        self.assertEqual(graph.reverse("scripts/c.js"), [])
+
+if __name__ == "__main__":
+    unittest.main()
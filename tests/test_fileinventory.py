@@ -0,0 +1,42 @@
+import os
+import unittest
+
+from helpers import BuildTestCase, FILES, IMAGES
+import fileinventory
+from fileinventory import FileInventory
+
+class FileInventoryTest(BuildTestCase):
+
+    def test_files(self):
+        inventory = FileInventory(self.src)
+        paths = sorted(os.path.normpath(p) for p in list(FILES) + list(IMAGES))
+        self.assertEqual(list(inventory), paths)
+        path = os.path.join("scripts", "a.js")
+        st = os.stat(os.path.join(self.src, path))
+        self.assertEqual(inventory.stat(path), (st.st_size, st.st_mtime))
+        self.assertEqual(inventory.stat(os.path.join(self.src, path)), inventory.stat(path))
+        self.assertEqual(inventory.paths((".css",)),
+                         [os.path.join("ui-style", "a.css"), os.path.join("ui-style", "b.css")])
+        self.assertEqual(inventory.paths((".js",), ["scripts"]),
+                         [os.path.join("scripts", "a.js"), os.path.join("scripts", "b.js")])
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "no symlinks")
+    def test_directory_links_not_followed(self):
+        # a link back to the root would never end
+        os.symlink(self.src, os.path.join(self.src, "scripts", "loop"))
+        os.symlink(os.path.join(self.src, "scripts", "a.js"), os.path.join(self.src, "a-link.js"))
+        paths = list(FileInventory(self.src))
+        self.assertFalse([p for p in paths if "loop" in p])
+        self.assertIn("a-link.js", paths)
+
+    def test_walk_without_scandir(self):
+        scandir = fileinventory.scandir
+        fileinventory.scandir = None
+        try:
+            paths = list(FileInventory(self.src))
+        finally:
+            fileinventory.scandir = scandir
+        self.assertEqual(paths, list(FileInventory(self.src)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import os
+import unittest
+
+# helpers puts df2 on the path
+from helpers import build
+from buildtree import BuildTree
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_derived_outputs_follow_the_bundle(self):
+        tree = BuildTree()
+        tree.set_text("client-en.xml", u'<script src="script/dragonfly.js"/>')
+        tree.set_text("script/dragonfly.js", u"var a = 1;")
+        tree.set_text("script/dragonfly.js.map", u"{}")
+        tree.set_text("script/other.js.map", u"{}")
+        self.assertEqual(build._fingerprint_bundles(tree), 1)
+        name = tree.output_path("script/dragonfly.js")
+        self.assertNotEqual(name, os.path.join("script", "dragonfly.js"))
+        self.assertEqual(tree.output_path("script/dragonfly.js.map"), name + ".map")
+        self.assertEqual(tree.output_path("script/other.js.map"),
+                         os.path.join("script", "other.js.map"))
+        self.assertIn(name.replace(os.sep, "/"), tree.get_text("client-en.xml"))
+
+if __name__ == "__main__":
+    unittest.main()
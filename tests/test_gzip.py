@@ -0,0 +1,52 @@
+import os
+import gzip
+import time
+import unittest
+
+from helpers import BuildTestCase, build_profile, read_tree, write_text
+
+class GzipTest(BuildTestCase):
+
+    def build(self, **settings):
+        self.dest = os.path.join(self.tmp, "dest")
+        return build_profile(self.src, self.dest, incremental=True, gzip_outputs=True,
+                             **settings)
+
+    def test_siblings(self):
+        self.build()
+        files = read_tree(self.dest)
+        self.assertEqual(sorted(p for p in files if p.endswith(".gz")),
+                         ["client-en.xml.gz", os.path.join("script", "dragonfly.js.gz"),
+                          os.path.join("style", "dragonfly.css.gz")])
+        for path in ["client-en.xml", os.path.join("script", "dragonfly.js")]:
+            gz = gzip.open(os.path.join(self.dest, path + ".gz"), "rb")
+            self.assertEqual(gz.read(), files[path])
+            gz.close()
+        # no name and no time in the header
+        self.assertEqual(files["client-en.xml.gz"][3:8], "\0\0\0\0\0")
+
+    def test_min_size(self):
+        # only the stylesheet with the inlined images is big enough
+        self.build(gzip_min_size=1000)
+        self.assertEqual([p for p in read_tree(self.dest) if p.endswith(".gz")],
+                         [os.path.join("style", "dragonfly.css.gz")])
+
+    def test_unchanged_kept(self):
+        self.build()
+        gz_path = os.path.join(self.dest, "style", "dragonfly.css.gz")
+        mtime = os.path.getmtime(gz_path)
+        time.sleep(0.01)
+        write_text(self.src, os.path.join("scripts", "b.js"), u"cls.changed = 1;\n")
+        self.build()
+        self.assertEqual(os.path.getmtime(gz_path), mtime)
+        gz = gzip.open(os.path.join(self.dest, "script", "dragonfly.js.gz"), "rb")
+        self.assertIn("cls.changed = 1;", gz.read())
+        gz.close()
+
+    def test_stale_removed(self):
+        self.build()
+        self.build(gzip_min_size=1000)
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "client-en.xml.gz")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import re
+import time
+import shutil
+import zipfile
+import unittest
+
+from helpers import BuildTestCase, build_tree, build_profile, read_tree, write_text, quiet
+from helpers import FILES, PROFILE
+from buildmanifest import settings_digest, state_dir, MANIFEST_NAME
+from depgraph import GRAPH_NAME
+import build
+
+KEYWORDS = {u"$dfversion$": u"1.0", u"$revdate$": u"1:abcdef123456"}
+
+class IncrementalBuildTest(BuildTestCase):
+
+    def build(self, keywords=KEYWORDS, **settings):
+        self.dest = os.path.join(self.tmp, "dest")
+        return build_tree(self.src, self.dest, keywords, **settings)
+
+    def clean_build(self, keywords=KEYWORDS, **settings):
+        dest = os.path.join(self.tmp, "clean")
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        build_tree(self.src, dest, keywords, **settings)
+        return read_tree(dest)
+
+    def rebuilt(self, tree):
+        return sorted(p for p in tree.paths() if not tree.get_file(p).up_to_date)
+
+    def assert_clean(self, keywords=KEYWORDS, **settings):
+        self.assertEqual(read_tree(self.dest), self.clean_build(keywords, **settings))
+
+    def test_unchanged(self):
+        tree = self.build()
+        self.assertEqual(self.rebuilt(tree), sorted(tree.paths()))
+        self.assertEqual(self.rebuilt(self.build()), [])
+        self.assert_clean()
+
+    def test_source_changed(self):
+        self.build()
+        write_text(self.src, "ui-style/b.css", FILES["ui-style/b.css"] + u".d { color: red; }\n")
+        self.assertEqual(self.rebuilt(self.build()), [os.path.join("style", "dragonfly.css")])
+        self.assert_clean()
+
+    def test_keyword_changed(self):
+        self.build()
+        keywords = dict(KEYWORDS, **{u"$dfversion$": u"2.0"})
+        tree = self.build(keywords)
+        self.assertEqual(self.rebuilt(tree), ["client-en.xml", os.path.join("script", "dragonfly.js")])
+        self.assert_clean(keywords)
+
+    def test_settings_changed(self):
+        tree = self.build()
+        self.assertEqual(self.rebuilt(self.build(minify=True)), sorted(tree.paths()))
+        self.assert_clean(minify=True)
+        self.assertEqual(self.rebuilt(self.build()), sorted(tree.paths()))
+        self.assert_clean()
+
+    def test_output_changed(self):
+        self.build()
+        path = os.path.join(self.dest, "style", "dragonfly.css")
+        with open(path, "rb") as f:
+            content = f.read()
+        with open(path, "wb") as f:
+            f.write(content.replace(".c", ".x"))
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime - 10))
+        self.assertEqual(self.rebuilt(self.build()), [os.path.join("style", "dragonfly.css")])
+        self.assert_clean()
+
+    def test_missing_output(self):
+        self.build()
+        os.unlink(os.path.join(self.dest, "client-en.xml"))
+        self.assertEqual(self.rebuilt(self.build()), ["client-en.xml"])
+        self.assert_clean()
+
+    def test_stale_fingerprinted_outputs(self):
+        self.build(fingerprint_bundles=True)
+        write_text(self.src, "scripts/a.js", FILES["scripts/a.js"] + u"cls.other = 1;\n")
+        self.build(fingerprint_bundles=True)
+        bundles = [p for p in read_tree(self.dest) if p.startswith("script")]
+        self.assertEqual(len(bundles), 1)
+        self.assertTrue(re.match(r"script[/\\]dragonfly\.[0-9a-f]{8}\.js$", bundles[0]))
+        self.assert_clean(fingerprint_bundles=True)
+
+        # without fingerprints the old names go away too
+        self.build()
+        self.assertNotIn(bundles[0], read_tree(self.dest))
+        self.assert_clean()
+
+class StateDirTest(BuildTestCase):
+
+    def test_state_not_in_dest(self):
+        dest = os.path.join(self.tmp, "dest")
+        with open(os.path.join(self.tmp, "old-manifest"), "wb") as f:
+            f.write("{}")
+        os.makedirs(dest)
+        shutil.copy(os.path.join(self.tmp, "old-manifest"), os.path.join(dest, MANIFEST_NAME))
+        tree = build_profile(self.src, dest, incremental=True, verify_bom=True,
+                             gzip_outputs=True, create_zips=True,
+                             zips=os.path.join(self.tmp, "zips"))
+        self.assertEqual(sorted(p for p in read_tree(dest) if not p.endswith(".gz")),
+                         sorted(tree.output_path(p) for p in tree.paths()))
+        state = read_tree(state_dir(dest))
+        self.assertIn(MANIFEST_NAME, state)
+        self.assertIn(GRAPH_NAME, state)
+        for base, dirs, names in os.walk(os.path.join(self.tmp, "zips")):
+            for name in names:
+                members = zipfile.ZipFile(os.path.join(base, name)).namelist()
+                self.assertFalse([m for m in members if ".df2" in m])
+
+class FakeWatcher(object):
+    """Changes a source file on the first wait, stops the watch on the
+    second one."""
+
+    def __init__(self, src, path, text):
+        self.src = src
+        self.path = path
+        self.text = text
+        self.waited = 0
+
+    def wait(self):
+        self.waited += 1
+        if self.waited > 1:
+            raise KeyboardInterrupt()
+        write_text(self.src, self.path, self.text)
+        return set([os.path.join(self.src, self.path)])
+
+    def close(self):
+        pass
+
+class WatchBuildTest(BuildTestCase):
+
+    def test_unrelated_outputs_not_written(self):
+        dest = os.path.join(self.tmp, "dest")
+        profile = dict(PROFILE, dest=dest, incremental=True)
+        tree = build_profile(self.src, dest, incremental=True)
+        old_mtimes = dict((p, os.path.getmtime(os.path.join(dest, p))) for p in tree.paths())
+        time.sleep(0.01)
+        path = os.path.join("ui-style", "b.css")
+        watcher = FakeWatcher(self.src, path, u".c { color: red; }\n")
+        watch_watcher = build.watch.watcher
+        build.watch.watcher = lambda src, interval: watcher
+        try:
+            with quiet():
+                keywords = build._build_keywords(profile, "1.0", "tip", "1", "abcdef123456")
+                build._watch_build(profile, self.src, dest, keywords,
+                                   build._directive_vars(profile), 1, tree, {}, None, "tip")
+        finally:
+            build.watch.watcher = watch_watcher
+        written = sorted(p for p in tree.paths()
+                         if os.path.getmtime(os.path.join(dest, p)) != old_mtimes[p])
+        self.assertEqual(written, [os.path.join("style", "dragonfly.css")])
+        with open(os.path.join(dest, "style", "dragonfly.css"), "rb") as f:
+            self.assertIn("color:red", f.read().replace(" ", ""))
+
+class SettingsDigestTest(unittest.TestCase):
+
+    def test_digest(self):
+        profile = {"minify": True, "zips": "zips"}
+        digest = settings_digest(profile)
+        self.assertEqual(settings_digest(dict(profile, zips="other")), digest)
+        self.assertNotEqual(settings_digest(dict(profile, minify=False)), digest)
+        self.assertNotEqual(settings_digest(profile, [("minifier", "1")]), digest)
+
+if __name__ == "__main__":
+    unittest.main()
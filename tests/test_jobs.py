@@ -0,0 +1,31 @@
+import os
+import unittest
+
+from helpers import BuildTestCase, build_profile, read_tree
+import build
+
+class JobsTest(BuildTestCase):
+
+    def build(self, name, jobs, **settings):
+        dest = os.path.join(self.tmp, name)
+        build_profile(self.src, dest, jobs=jobs, **settings)
+        return read_tree(dest)
+
+    def test_same_output(self):
+        settings = {"minify": True, "suppress_warnings": True,
+                    "data_uri_max_size": 1000}
+        self.assertEqual(self.build("serial", 1, **settings),
+                         self.build("parallel", 2, **settings))
+
+    def test_map_order(self):
+        pool = build.multiprocessing.Pool(2)
+        try:
+            args = [(i,) for i in range(20)]
+            self.assertEqual(build._map(pool, abs, [(-i,) for i in range(20)]),
+                             build._map(None, abs, args))
+        finally:
+            pool.close()
+            pool.join()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import StringIO
+import unittest
+
+from helpers import FILES
+import jsminify
+from jsminify import JSScanner
+
+SCRIPT = (u"/* a comment\r\n   over two lines */\r\n"
+          u"var re = /[/\\]]+/g, half = total / 2 /x;\r\n"
+          u"function f(a1, b)\n{\n  // one line\n"
+          u"  return typeof a1 == \"string\" ? 'it\\'s' : 0x1F + 1.5e3;\n}\n"
+          u"s = \"été\" t = 1\r\n")
+
+def scan(text, chunk_size=jsminify.CHUNK_SIZE):
+    return list(JSScanner(StringIO.StringIO(text), chunk_size))
+
+class ScannerTest(unittest.TestCase):
+
+    def types(self, text):
+        return [(token[0], token[1]) for token in scan(text)
+                if not token[0] in JSScanner.SKIP_TYPES]
+
+    def test_round_trip(self):
+        self.assertEqual(u"".join(token[1] for token in scan(SCRIPT)), SCRIPT)
+
+    def test_same_tokens_as_tokenizer(self):
+        for path in ["scripts/a.js", "scripts/b.js", "ui-strings/ui_strings-en.js"]:
+            text = FILES[path]
+            self.assertEqual([tuple(token[:2]) for token in scan(text)],
+                             [tuple(token[:2]) for token in
+                              jsminify.JSTokenizer(StringIO.StringIO(text))], path)
+
+    def test_reg_exp_or_division(self):
+        self.assertEqual(self.types(u"a = b / c / d"),
+                         [("IDENTIFIER", u"a"), ("PUNCTUATOR", u"="), ("IDENTIFIER", u"b"),
+                          ("DIV_PUNCTUATOR", u"/"), ("IDENTIFIER", u"c"),
+                          ("DIV_PUNCTUATOR", u"/"), ("IDENTIFIER", u"d")])
+        self.assertEqual(self.types(u"return /[/]+/g.test(s)")[:2],
+                         [("KEYWORD", u"return"), ("REG_EXP", u"/[/]+/g")])
+        self.assertEqual(self.types(u"x = (a) / 2")[5], ("DIV_PUNCTUATOR", u"/"))
+
+    def test_identifier_with_digits(self):
+        self.assertEqual(self.types(u"a1 + 0x1F"),
+                         [("IDENTIFIER", u"a1"), ("PUNCTUATOR", u"+"), ("NUMBER", u"0x1F")])
+
+class ChunkSizeTest(unittest.TestCase):
+
+    def check(self, text):
+        tokens = scan(text, len(text) + 1)
+        self.assertEqual("".join(token.value for token in tokens), text)
+        for chunk_size in [1, 2, 7]:
+            self.assertEqual(scan(text, chunk_size), tokens, chunk_size)
+
+    def test_unicode(self):
+        self.check(SCRIPT)
+        self.check(FILES["scripts/a.js"])
+
+    def test_bytes(self):
+        self.check(SCRIPT.replace(u" ", u"\n").encode("utf-8"))
+
+    def test_token_at_chunk_end(self):
+        # a regular expression, a string and a line break cut by the chunks
+        for text in [u"x = /ab\\/c/g", u"'abc\\'def'", u"a\r\nb", u"ab /* c */"]:
+            self.check(text)
+
+def positions(text):
+    """Return the (line, column) of each index of text, a "\\r\\n" is one
+    line break."""
+    result = []
+    line, column = 1, 0
+    for i, char in enumerate(text):
+        result.append((line, column))
+        if char in u"\n\u2028\u2029" or (char == u"\r" and text[i + 1:i + 2] != u"\n"):
+            line, column = line + 1, 0
+        else:
+            column += 1
+    return result
+
+class PositionTest(unittest.TestCase):
+
+    def check(self, tokens, text):
+        expected = positions(text)
+        offset = 0
+        for token in tokens:
+            self.assertEqual(token.offset, offset, token)
+            self.assertEqual(text[offset:offset + len(token.value)], token.value)
+            self.assertEqual((token.line, token.column), expected[offset], token)
+            offset += len(token.value)
+        self.assertEqual(offset, len(text))
+
+    def test_scanner(self):
+        text = SCRIPT + u"a = 1;\u2028b = 'x';\r\rc = /* \u2028 */ d;\r\n e"
+        for chunk_size in [1, 7, len(text)]:
+            self.check(scan(text, chunk_size), text)
+
+    def test_tokenizer(self):
+        text = u"var a = 1;\r\nb = 'x';\u2028 c /* \r\n */ = d;\n"
+        self.check(list(jsminify.JSTokenizer(StringIO.StringIO(text))), text)
+
+    def test_line_break_pair(self):
+        tokens = [t for t in scan(u"a\r\nb\u2028c") if t.type == "IDENTIFIER"]
+        self.assertEqual([(t.value, t.offset, t.line, t.column) for t in tokens],
+                         [(u"a", 0, 1, 0), (u"b", 3, 2, 0), (u"c", 5, 3, 0)])
+
+class MangleTest(unittest.TestCase):
+
+    def check(self, text, expected):
+        self.assertEqual(jsminify.minify_str(text, mangle=True).strip(), expected)
+
+    def test_locals(self):
+        self.check(u"function f(first, second) {\n"
+                   u"  var local = first;\n  return local + second;\n}\n",
+                   u"function f(a,b){var c=a;return c+b;}")
+
+    def test_globals(self):
+        # the global a is used inside f, the parameter must not hide it
+        self.check(u"var g = 1, a = 2;\nfunction top(value) { return value + g + a; }\n",
+                   u"var g=1,a=2;function top(b){return b+g+a;}")
+
+    def test_eval_and_with(self):
+        self.check(u"function f(value) { var other = value; eval('other'); }\n"
+                   u"function outer(p) { function inner(q) { with (o) { q; } } return p; }\n"
+                   u"function safe(r) { return r; }\n",
+                   u"function f(value){var other=value;eval('other');}\n"
+                   u"function outer(p){function inner(q){with(o){q;}}return p;}\n"
+                   u"function safe(a){return a;}")
+
+    def test_properties(self):
+        self.check(u"function f(value) { var obj = {value: 1, 'x': value};"
+                   u" return obj.value + value; }\n",
+                   u"function f(a){var b={value:1,'x':a};return b.value+a;}")
+
+    def test_labels(self):
+        self.check(u"function f(value) { value: for (var i = 0; i < value; i++)"
+                   u" { continue value; } loop: while (1) break loop; }\n",
+                   u"function f(b){value:for(var a=0;a<b;a++){continue value;}"
+                   u"loop:while(1)break loop;}")
+
+    def test_nested_conditional(self):
+        self.check(u"function f(first, fallback) { return first ? first.x ? 1 : fallback : 0; }\n",
+                   u"function f(a,b){return a?a.x?1:b:0;}")
+        self.check(u"function f(test, alt) { return {key: test ? alt : 1,"
+                   u" other: test ? {inner: alt} : alt}; }\n",
+                   u"function f(b,a){return{key:b?a:1,other:b?{inner:a}:a};}")
+
+    def test_case(self):
+        self.check(u"function f(value, other) { switch (value) { case other: return 1;"
+                   u" case 2: loop: for (;;) break loop; default: return value ? other : 0; } }\n",
+                   u"function f(a,b){switch(a){case b:return 1;case 2:loop:for(;;)break loop;"
+                   u"default:return a?b:0;}}")
+
+    def test_unknown_syntax(self):
+        text = u"var f = (value) => value;\n"
+        self.assertEqual(jsminify.minify_str(text, mangle=True), jsminify.minify_str(text))
+
+if __name__ == "__main__":
+    unittest.main()
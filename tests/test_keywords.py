@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+
+from helpers import BuildTestCase
+from buildtree import BuildTree
+import build
+
+class KeywordsStrTest(unittest.TestCase):
+
+    def replace(self, content, keywords):
+        return build._keywords_str(content, keywords, build._keywords_re(keywords))
+
+    def test_longest_key_wins(self):
+        self.assertEqual(self.replace(u"$date$ $date", {u"$date": u"a", u"$date$": u"b"}),
+                         (u"b a", {u"$date": u"a", u"$date$": u"b"}))
+
+    def test_single_scan(self):
+        # a value is not scanned for keywords again
+        self.assertEqual(self.replace(u"$a$ $b$", {u"$a$": u"$b$", u"$b$": u"2"}),
+                         (u"$b$ 2", {u"$a$": u"$b$", u"$b$": u"2"}))
+
+    def test_str_keys(self):
+        keywords = {"$name$": u"été"}
+        self.assertEqual(self.replace(u"x $name$", keywords),
+                         (u"x été", keywords))
+
+class AddKeywordsTest(BuildTestCase):
+
+    def test_files_without_keywords(self):
+        tree = BuildTree(self.src)
+        build._add_keywords(tree, {u"$dfversion$": u"1.0"})
+        client = tree.get_file("client-en.xml")
+        self.assertTrue(client.dirty)
+        self.assertEqual(client.keywords, {u"$dfversion$": u"1.0"})
+        self.assertIn(u"Opera Dragonfly 1.0", tree.get_text("client-en.xml"))
+        script = tree.get_file(os.path.join("scripts", "a.js"))
+        self.assertFalse(script.dirty)
+        self.assertEqual(script.keywords, {})
+        self.assertTrue(tree.get_file(os.path.join("scripts", "b.js")).dirty)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import time
+import unittest
+
+from helpers import BuildTestCase
+from buildtree import BuildTree
+from minifycache import MinifyCache, minifier_identity
+import build
+import jsminify
+
+class MinifyCacheTest(BuildTestCase):
+
+    def setUp(self):
+        BuildTestCase.setUp(self)
+        self.cache_dir = os.path.join(self.tmp, "cache")
+        self.cache = MinifyCache(self.cache_dir, 0, minifier_identity(jsminify))
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get(u"var a = 1;"), None)
+        self.cache.put(u"var a = 1;", u"var a=1;")
+        self.assertEqual(self.cache.get(u"var a = 1;"), u"var a=1;")
+        # each variant and minifier has its own entries
+        self.assertEqual(self.cache.get(u"var a = 1;", variant="mangle"), None)
+        other = MinifyCache(self.cache_dir, 0, "jsminify:other")
+        self.assertEqual(other.get(u"var a = 1;"), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_mappings(self):
+        self.cache.put(u"a", u"a")
+        self.assertEqual(self.cache.get(u"a", with_mappings=True), None)
+        self.cache.put(u"b", u"b", [1, 0, 1, 0])
+        minified, mappings = self.cache.get(u"b", with_mappings=True)
+        self.assertEqual((minified, list(mappings)), (u"b", [1, 0, 1, 0]))
+
+    def test_evict(self):
+        cache = MinifyCache(self.cache_dir, 25, "test")
+        for i in range(4):
+            cache.put(u"script %s" % i, u"x" * 10)
+            entry = cache._entry(u"script %s" % i)
+            os.utime(entry, (time.time() - 100 + i, time.time() - 100 + i))
+        # used last, kept
+        cache.get(u"script 0")
+        self.assertEqual(cache.evict(), 2)
+        self.assertEqual([i for i in range(4) if cache.get(u"script %s" % i)], [0, 3])
+
+    def test_minify_from_cache(self):
+        tree = BuildTree(self.src)
+        self.assertEqual(build._minify_buildout(tree, ["scripts"], cache=self.cache), (2, 0))
+        minified = tree.get_text(os.path.join("scripts", "a.js"))
+        tree = BuildTree(self.src)
+        self.assertEqual(build._minify_buildout(tree, ["scripts"], cache=self.cache), (2, 2))
+        self.assertEqual(tree.get_text(os.path.join("scripts", "a.js")), minified)
+
+if __name__ == "__main__":
+    unittest.main()
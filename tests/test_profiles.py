@@ -0,0 +1,36 @@
+import os
+import unittest
+
+from helpers import BuildTestCase, BuildStats, build_profile, read_tree, quiet, PROFILE
+import build
+
+class Args(object):
+    revision = "1.0"
+    tag = "tip"
+    jobs = 1
+    stats_out = None
+
+class ProfilesTest(BuildTestCase):
+
+    def test_expand_groups(self):
+        build_config = {"profile_groups": {"release": ["min", "zip"]}}
+        self.assertEqual(build._expand_profile_groups(build_config, ["release", "min", "dev"]),
+                         ["min", "zip", "dev"])
+
+    def test_shared_export(self):
+        settings = [{"minify": True}, {"make_data_uris": False}]
+        profiles = [dict(PROFILE, src=self.src, dest=os.path.join(self.tmp, "p%s" % i),
+                         **s) for i, s in enumerate(settings)]
+        with quiet() as out:
+            state = build._build_profiles(Args(), {}, ["p0", "p1"], profiles, "1",
+                                          "abcdef123456", BuildStats(), False)
+        self.assertEqual(state, {})
+        self.assertIn("1 exports for 2 profiles", out.getvalue())
+        # the same outputs as a build of each profile on its own
+        for i, s in enumerate(settings):
+            dest = os.path.join(self.tmp, "single%s" % i)
+            build_profile(self.src, dest, **s)
+            self.assertEqual(read_tree(os.path.join(self.tmp, "p%s" % i)), read_tree(dest))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import unittest
+
+from helpers import BuildTestCase, build_profile, read_tree, write_text, FILES
+import jsminify
+import sourcemap
+from sourcemap import LineMap
+
+_re_line_break = re.compile(u"\r\n|[\n\r\u2028\u2029]")
+
+def decode_vlqs(text):
+    """Return the list of the numbers of a string of base64 VLQs."""
+    values = []
+    value = shift = 0
+    for char in text:
+        digit = sourcemap.BASE64.index(char)
+        value += (digit & 31) << shift
+        shift += 5
+        if not digit & 32:
+            values.append(-(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return values
+
+def decode_mappings(mappings):
+    """Return (line, column, source, source line, source column) of each
+    segment of mappings, all counting from 0."""
+    segments = []
+    source = src_line = src_column = 0
+    for line, group in enumerate(mappings.split(";")):
+        column = 0
+        for segment in filter(None, group.split(",")):
+            delta = decode_vlqs(segment)
+            column += delta[0]
+            source += delta[1]
+            src_line += delta[2]
+            src_column += delta[3]
+            segments.append((line, column, source, src_line, src_column))
+    return segments
+
+def check_segments(test, mappings, text, sources, keywords={}):
+    """Check that each segment of mappings points at the same character
+    in text and in the source, sources is the list of their texts. A
+    segment at the value of one of keywords points at the keyword."""
+    lines = _re_line_break.split(text)
+    source_lines = [_re_line_break.split(source) for source in sources]
+    segments = decode_mappings(mappings)
+    test.assertTrue(segments)
+    for line, column, source, src_line, src_column in segments:
+        if [key for key, value in keywords.items()
+            if lines[line].startswith(value, column) and
+               source_lines[source][src_line].startswith(key, src_column)]:
+            continue
+        char = lines[line][column:column + 1]
+        test.assertEqual(char, source_lines[source][src_line][src_column:src_column + 1],
+                         (line, column, source, src_line, src_column))
+
+class VLQTest(unittest.TestCase):
+
+    def test_values(self):
+        for value, expected in [(0, "A"), (1, "C"), (-1, "D"), (15, "e"), (16, "gB"),
+                                (-16, "hB"), (1023, "+/B"), (1024, "ggC"),
+                                (-1024, "hgC"), (-1025, "jgC")]:
+            self.assertEqual(sourcemap.vlq(value), expected, value)
+
+    def test_round_trip(self):
+        values = range(-3000, 3000) + [1 << 20, -(1 << 20), (1 << 31) - 1]
+        self.assertEqual(decode_vlqs("".join(sourcemap.vlq(v) for v in values)), values)
+
+class LineMapTest(unittest.TestCase):
+
+    def test_add_map(self):
+        inner = LineMap()
+        inner.add(u"ef", "y", 2, 3)
+        inner.add(u"g\nh", "z")
+        line_map = LineMap()
+        line_map.add(u"ab\ncd", "x")
+        line_map.add_map(inner)
+        self.assertEqual(line_map.runs, [(0, 0, "x", 0, 0), (1, 2, None, 0, 0),
+                                         (1, 2, "y", 2, 3), (1, 4, "z", 0, 0)])
+        self.assertEqual(line_map.end, (2, 1))
+        self.assertEqual(line_map.sources(), ["x", "y", "z"])
+
+    def test_add_map_at_line_start(self):
+        inner = LineMap()
+        inner.add(u"c\nd", "y")
+        line_map = LineMap()
+        line_map.add(u"ab\n", "x")
+        line_map.add_map(inner)
+        self.assertEqual(line_map.runs[-1], (1, 0, "y", 0, 0))
+        self.assertEqual(line_map.end, (2, 1))
+
+    def test_map_tokens(self):
+        sources = [u"var first = 1;\r\n\n  first += 2;\n",
+                   u"/* c */\nfunction  add(a, b)\n{\n  return a + b;\n}\n",
+                   FILES["scripts/a.js"]]
+        line_map = LineMap()
+        text = u""
+        for i, source in enumerate(sources):
+            line_map.add(source, i)
+            text += source
+        mappings = []
+        minified = jsminify.minify_str(text, mappings)
+        minified_map = line_map.map_tokens(mappings, minified)
+        self.assertEqual(minified_map.end, sourcemap.end_position(minified))
+        check_segments(self, minified_map.mappings([0, 1, 2]), minified, sources)
+        # the tokens of all sources are mapped
+        self.assertEqual(set(s[2] for s in decode_mappings(minified_map.mappings([0, 1, 2]))),
+                         set([0, 1, 2]))
+
+    def test_text_without_source(self):
+        line_map = LineMap()
+        line_map.add(u"/* license */\n")
+        line_map.add(u"a;\nb;\n", "x")
+        self.assertEqual(decode_mappings(line_map.mappings(["x"])),
+                         [(1, 0, 0, 0, 0), (2, 0, 0, 1, 0)])
+
+class FingerprintedMapTest(BuildTestCase):
+
+    SETTINGS = {"minify": True, "source_maps": True, "fingerprint_bundles": True,
+                "incremental": True}
+
+    def build(self):
+        self.dest = os.path.join(self.tmp, "dest")
+        build_profile(self.src, self.dest, **self.SETTINGS)
+        return read_tree(self.dest)
+
+    def output_mtimes(self):
+        return dict((p, os.path.getmtime(os.path.join(self.dest, p)))
+                    for p in read_tree(self.dest))
+
+    def check_maps(self, files):
+        bundles = [p for p in files if re.match(r"script[/\\]dragonfly\.[0-9a-f]{8}\.js$", p)]
+        maps = [p for p in files if p.endswith(".map")]
+        self.assertEqual(len(bundles), 1)
+        self.assertEqual(maps, [bundles[0] + ".map"])
+        name = os.path.basename(bundles[0])
+        self.assertEqual(json.loads(files[maps[0]])["file"], name)
+        self.assertTrue(files[bundles[0]].endswith("\n//# sourceMappingURL=%s.map\n" % name))
+        self.assertIn(name, files["client-en.xml"])
+        source_map = json.loads(files[maps[0]])
+        check_segments(self, source_map["mappings"], files[bundles[0]].decode("utf-8"),
+                       source_map["sourcesContent"])
+        return bundles[0]
+
+    def test_map_follows_fingerprint(self):
+        bundle = self.check_maps(self.build())
+
+        # nothing changed, no output is written again
+        mtimes = self.output_mtimes()
+        self.assertEqual(self.check_maps(self.build()), bundle)
+        self.assertEqual(self.output_mtimes(), mtimes)
+
+        # a new content hash, the old bundle and its map are removed
+        write_text(self.src, "scripts/a.js", FILES["scripts/a.js"] + u"cls.other = 1;\n")
+        self.assertNotEqual(self.check_maps(self.build()), bundle)
+
+    def test_missing_map_is_rebuilt(self):
+        bundle = self.check_maps(self.build())
+        os.unlink(os.path.join(self.dest, bundle + ".map"))
+        self.assertEqual(self.check_maps(self.build()), bundle)
+
+class BundleMapTest(BuildTestCase):
+
+    def test_keywords(self):
+        # $dfversion$ in b.js is longer than its value
+        dest = os.path.join(self.tmp, "dest")
+        build_profile(self.src, dest, source_maps=True)
+        files = read_tree(dest)
+        bundle = os.path.join("script", "dragonfly.js")
+        self.assertIn(u'cls.version = "1.0";', files[bundle].decode("utf-8"))
+        source_map = json.loads(files[bundle + ".map"])
+        check_segments(self, source_map["mappings"], files[bundle].decode("utf-8"),
+                       source_map["sourcesContent"], {u"$dfversion$": u"1.0"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+from helpers import build, make_source, quiet, BuildStats, PROFILE
+import vcs
+
+def git(cwd, *args):
+    return subprocess.check_output(("git",) + args, cwd=cwd)
+
+class GitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        git(self.tmp, "init", "-q")
+        with open(os.path.join(self.tmp, "a.txt"), "wb") as f:
+            f.write("a\n")
+        git(self.tmp, "add", "a.txt")
+        git(self.tmp, "-c", "user.name=test", "-c", "user.email=test@example.com",
+            "commit", "-q", "-m", "a")
+        os.chdir(self.tmp)
+        self.repo = vcs.Git(build.cmd_call)
+
+    def tearDown(self):
+        self.repo.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_get_hash(self):
+        out, err = self.repo.get_hash("HEAD")
+        self.assertEqual(err, "")
+        self.assertEqual(out.strip(), git(self.tmp, "rev-parse", "HEAD").strip()[:12])
+
+    def test_get_hash_unknown(self):
+        out, err = self.repo.get_hash("no-such-rev")
+        self.assertTrue(err)
+
+    def test_get_hash_no_shell(self):
+        calls = []
+        repo = vcs.Git(lambda *args: calls.append(args) or ("", ""))
+        try:
+            out, err = repo.get_hash("HEAD")
+            self.assertEqual(out.strip(), git(self.tmp, "rev-parse", "--short=12", "HEAD").strip())
+            self.assertEqual(repo.get_hash("HEAD~1")[0], "")
+        finally:
+            repo.close()
+        self.assertEqual(calls, [])
+
+    def test_read(self):
+        self.assertEqual(self.repo.read("HEAD:a.txt"), ("blob", "a\n"))
+        self.assertEqual(self.repo.read("HEAD:b.txt"), None)
+
+class Args(object):
+    revision = "1.0"
+    tag = "HEAD"
+    jobs = 1
+
+class WorktreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = os.path.realpath(tempfile.mkdtemp())
+        self.root = os.path.join(self.tmp, "repo")
+        self.src = os.path.join(self.root, "src")
+        make_source(self.src)
+        git(self.root, "init", "-q")
+        git(self.root, "add", "src")
+        git(self.root, "-c", "user.name=test", "-c", "user.email=test@example.com",
+            "commit", "-q", "-m", "src")
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+        self.repo = vcs.Git(build.cmd_call)
+
+    def tearDown(self):
+        self.repo.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_build_from_worktree(self):
+        path = os.path.join(self.src, "scripts", "b.js")
+        with open(path, "wb") as f:
+            f.write("cls.uncommitted = 1;\n")
+        dest = os.path.join(self.tmp, "dest")
+        profile = dict(PROFILE, src=self.src, dest=dest)
+        with quiet():
+            worktree = build._add_worktree(self.repo, "HEAD")
+            try:
+                state = build._build_profiles(Args(), {}, ["default"], [profile], "1",
+                                              "abcdef123456", BuildStats(), False, worktree)
+            finally:
+                build._remove_worktree(self.repo, worktree)
+        self.assertEqual(worktree[0], self.root)
+        self.assertNotEqual(state, None)
+        with open(os.path.join(dest, "script", "dragonfly.js"), "rb") as f:
+            bundle = f.read()
+        self.assertIn("cls.version", bundle)
+        self.assertNotIn("uncommitted", bundle)
+        # the working tree is not touched and the worktree is gone
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), "cls.uncommitted = 1;\n")
+        self.assertFalse(os.path.exists(os.path.dirname(worktree[1])))
+        self.assertEqual(len(git(self.root, "worktree", "list").splitlines()), 1)
+
+if __name__ == "__main__":
+    unittest.main()